@@ -4,25 +4,78 @@ Loads all parameters from ``params.yaml`` via DVC's parameter API and resolves
 the path DSL (``@ref/subpath`` references) into concrete filesystem paths.
 R stages access these same objects through ``reticulate::import("project")``,
 ensuring a single source of truth for configuration across both languages.
+
+``config`` and ``paths`` are resolved lazily on first access. Parameters
+interpolated by DVC are stored in ``data/cache/params`` under the content hash
+of ``params.yaml``, so as long as the file does not change, DVC is not even
+imported and only the (cheap) resolution of ``make!:`` directives remains.
 """
 
+import hashlib
+import json
+import os
 from pathlib import Path
-
-import dvc.api
-import dvc.config
-from newsuse.config import Config
+from typing import Any
 
 from .__about__ import __version__
 
 __all__ = ("__version__", "config", "paths")
 
 root = Path(__file__).parent.parent
-# dvc.api.params_show() reads params.yaml (with DVC interpolation and
-# ${eval:...} expressions resolved). Config.resolve() recursively processes
-# 'make!:' factory directives, instantiating objects like Paths and cycler.
-config = Config(dvc.api.params_show()).resolve()
-# Pop 'paths' from config (so it doesn't pollute the parameter namespace) and
-# construct a Paths object rooted at the project directory. The resulting
-# object provides pathlib.Path-like attribute access (e.g. paths.news,
-# paths.epochs) resolved from the @ref/subpath DSL in params.yaml.
-paths = config.pop("paths")(root=root)
+
+
+def __getattr__(name: str) -> Any:
+    if name in ("config", "paths"):
+        config, paths = _load()
+        globals().update(config=config, paths=paths)
+        return globals()[name]
+    errmsg = f"module {__name__!r} has no attribute {name!r}"
+    raise AttributeError(errmsg)
+
+
+# Internals --------------------------------------------------------------------------
+
+
+def _load(root: Path = root) -> tuple[Any, Any]:
+    # Paths are rooted at 'root', which may differ from the project directory
+    # (e.g. for synthetic data in benchmarks).
+    from newsuse.config import Config
+
+    # Config.resolve() recursively processes 'make!:' factory directives,
+    # instantiating objects like Paths and cycler.
+    config = Config(_params()).resolve()
+    # Pop 'paths' from config (so it doesn't pollute the parameter namespace) and
+    # construct a Paths object rooted at the project directory. The resulting
+    # object provides pathlib.Path-like attribute access (e.g. paths.news,
+    # paths.epochs) resolved from the @ref/subpath DSL in params.yaml.
+    paths = config.pop("paths")(root=root)
+    return config, paths
+
+
+def _params() -> dict[str, Any]:
+    # dvc.api.params_show() reads params.yaml (with DVC interpolation and
+    # ${eval:...} expressions resolved). Its output is plain data, so it is
+    # cached as JSON; the cache directory is 'paths.cache', which cannot be
+    # used before parameters are loaded.
+    key = hashlib.sha256((root / "params.yaml").read_bytes()).hexdigest()
+    file = root / "data" / "cache" / "params" / f"{key}.json"
+    try:
+        return json.loads(file.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    import dvc.api
+
+    params = dvc.api.params_show()
+    try:
+        text = json.dumps(params)
+    except TypeError:
+        return params
+    # Parameters that do not survive the round trip (e.g. non-string keys) are
+    # not cached.
+    if json.loads(text) == params:
+        file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = file.with_name(f"{file.stem}.{os.getpid()}.tmp")
+        tmp.write_text(text)
+        tmp.replace(file)
+    return params
@@ -0,0 +1,301 @@
+"""Ensembles of seeded BEAST runs.
+
+Changepoints are detected by running BEAST (:func:`Rbeast.beast123`) many times
+with different random seeds and combining probabilities over runs (see
+:mod:`project.changepoints`). Seeds are drawn exactly as by the original R
+implementation of the ensemble (:func:`seeds`).
+
+:func:`iter_runs` fans fits of single variables out over a pool of worker
+processes and yields results run by run in the order of seeds. The signal
+matrix is placed once in shared memory, so workers read it without copies.
+Results of fits are stored in a content-addressed cache
+(:class:`project.cache.ArrayCache`) keyed by values of the variable, time
+points, BEAST parameters and the seed as soon as they are done. Hence an
+interrupted ensemble resumes from the last finished fits, fits of a variable
+are shared by all subsets including it, and after changes of subsets or the
+number of runs only fits of new variables or seeds are computed.
+
+BEAST results for a given seed are not bitwise reproducible: the library keeps
+internal state between calls and its draws also depend on the state of the
+process. Cached fits make results of repeated runs of the ensemble identical.
+"""
+
+import logging
+import multiprocessing
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from importlib.metadata import version
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import Rbeast as rb
+
+from project.cache import ArrayCache, cache_key
+from project.rng import sample_int
+
+__all__ = ("fit", "iter_runs", "seeds")
+
+logger = logging.getLogger(__name__)
+
+
+def seeds(seed: int, n_runs: int) -> np.ndarray:
+    """Get seeds of BEAST runs.
+
+    Equivalent to ``set.seed(seed); sample.int(1e9, n_runs)`` in R. Seeds of
+    the first runs do not depend on ``n_runs``.
+
+    Examples
+    --------
+    >>> seeds(303, 3).tolist() == seeds(303, 5)[:3].tolist()
+    True
+    """
+    return sample_int(1_000_000_000, n_runs, seed=seed)
+
+
+def fit(
+    y: np.ndarray,
+    time: np.ndarray,
+    seed: int,
+    *,
+    metadata: Mapping[str, Any],
+    prior: Mapping[str, Any],
+) -> tuple[np.ndarray, np.ndarray]:
+    """Detect trend changepoints of a variable with a single BEAST run.
+
+    Parameters
+    ----------
+    y
+        Values of the variable.
+    time
+        Fractional-year times of values.
+    seed
+        MCMC seed.
+    metadata, prior
+        BEAST metadata and prior parameters (``changepoints.beast``).
+
+    Returns
+    -------
+    Times (``date``) and probabilities (``prob``) of changepoints.
+    """
+    output = rb.beast123(
+        np.asarray(y, dtype=np.float64),
+        metadata=rb.args(**metadata, time=np.asarray(time, dtype=np.float64)),
+        prior=rb.args(**prior),
+        mcmc=rb.args(seed=int(seed)),
+        extra=rb.args(quiet=True),
+    )
+    date = np.ravel(output.trend.cp).astype(np.float64)
+    prob = np.ravel(output.trend.cpPr).astype(np.float64)
+    valid = ~(np.isnan(date) | np.isnan(prob))
+    return date[valid], prob[valid]
+
+
+def iter_runs(
+    signal: pd.DataFrame,
+    subsets: Mapping[str, Sequence[str]],
+    *,
+    seed: int,
+    n_runs: int,
+    metadata: Mapping[str, Any],
+    prior: Mapping[str, Any],
+    cache: ArrayCache | None = None,
+    max_workers: int | None = None,
+) -> Iterator[tuple[int, dict[str, tuple[np.ndarray, np.ndarray]]]]:
+    """Run BEAST ensembles for subsets of signal columns.
+
+    Results are yielded run by run in the order of seeds as soon as all fits of a
+    run are done. Closing the iterator early (e.g. after a stopping rule is met)
+    cancels the remaining fits.
+
+    Parameters
+    ----------
+    signal
+        Weekly signal with ``time`` (fractional-year time) and signal columns.
+    subsets
+        Mapping from subset names to lists of signal columns.
+    seed, n_runs
+        Base seed and (maximum) number of runs (see :func:`seeds`).
+    metadata, prior
+        BEAST metadata and prior parameters.
+    cache
+        Cache of results of fits. It is pruned to its size limit at the end.
+    max_workers
+        Number of worker processes. Defaults to the number of CPUs.
+
+    Yields
+    ------
+    Run number (starting from ``1``) and mapping from subset names to times
+    (``date``) and probabilities (``prob``) of changepoints of all variables of
+    the subset, stably sorted by time.
+    """
+    time = signal["time"].to_numpy(dtype=np.float64)
+    columns = list(dict.fromkeys(c for cols in subsets.values() for c in cols))
+    values = signal[columns].to_numpy(dtype=np.float64)
+    metadata, prior = dict(metadata), dict(prior)
+    runseeds = seeds(seed, n_runs)
+
+    def refit(fid: tuple[int, int]) -> np.ndarray:
+        j, idx = fid
+        date, prob = fit(
+            values[:, j], time, runseeds[idx - 1], metadata=metadata, prior=prior
+        )
+        return np.vstack([date, prob])
+
+    # Fits are identified by positions of variables and run numbers.
+    model = cache_key(time, metadata, prior, version("Rbeast"))
+    variables = [cache_key(model, values[:, j]) for j in range(len(columns))]
+    pending = _Pending(
+        {subset: [columns.index(c) for c in cols] for subset, cols in subsets.items()},
+        {
+            (j, idx): cache_key(variables[j], int(s))
+            for idx, s in enumerate(runseeds, start=1)
+            for j in range(len(columns))
+        },
+        cache,
+        refit,
+    )
+    tasks = [(j, idx, runseeds[idx - 1]) for j, idx in pending.missing()]
+    logger.info(
+        "running %d of %d BEAST fits (others are cached)", len(tasks), len(pending.keys)
+    )
+
+    idx = 1
+    results = _fit_all(tasks, values, time, metadata, prior, max_workers)
+    try:
+        for done, (fid, value) in enumerate(results, start=1):
+            pending.add(fid, value)
+            if done % max(len(tasks) // 100, 1) == 0 or done == len(tasks):
+                logger.info("[%d/%d] BEAST fits done", done, len(tasks))
+            while idx <= n_runs and pending.ready(idx):
+                yield idx, pending.pop(idx)
+                idx += 1
+        while idx <= n_runs:
+            yield idx, pending.pop(idx)
+            idx += 1
+    finally:
+        # Shut the pool down (cancelling remaining fits) before pruning the cache.
+        results.close()
+        if cache is not None:
+            cache.prune()
+
+
+# Internals --------------------------------------------------------------------------
+
+_worker: dict[str, Any] = {}
+
+
+@dataclass
+class _Pending:
+    # Finished fits wait here until all fits of their run are available.
+    # New fits are cached immediately, cached ones are read only when needed.
+    # Cached fits evicted in the meantime (e.g. by another process pruning the
+    # cache) are computed again in the main process with 'refit'.
+    positions: dict[str, list[int]]
+    keys: dict[tuple[int, int], str]
+    cache: ArrayCache | None
+    refit: Callable[[tuple[int, int]], np.ndarray]
+    fits: dict[tuple[int, int], np.ndarray] = field(default_factory=dict)
+    cached: set[tuple[int, int]] = field(init=False)
+    columns: list[int] = field(init=False)
+
+    def __post_init__(self) -> None:
+        cache = self.cache
+        self.cached = {f for f, k in self.keys.items() if cache is not None and k in cache}
+        self.columns = sorted({j for j, _ in self.keys})
+
+    def missing(self) -> list[tuple[int, int]]:
+        return [fid for fid in self.keys if fid not in self.cached]
+
+    def add(self, fid: tuple[int, int], value: np.ndarray) -> None:
+        self.fits[fid] = value
+        if self.cache is not None:
+            self.cache.put(self.keys[fid], value)
+
+    def ready(self, idx: int) -> bool:
+        return all((j, idx) in self.fits or (j, idx) in self.cached for j in self.columns)
+
+    def pop(self, idx: int) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+        fits = {j: self._get((j, idx)) for j in self.columns}
+        out = {}
+        for subset, pos in self.positions.items():
+            date, prob = np.hstack([fits[j] for j in pos])
+            order = np.argsort(date, kind="stable")
+            out[subset] = (date[order], prob[order])
+        return out
+
+    def _get(self, fid: tuple[int, int]) -> np.ndarray:
+        if fid in self.fits:
+            return self.fits.pop(fid)
+        if self.cache is not None and (value := self.cache.get(self.keys[fid])) is not None:
+            return value
+        logger.warning("cached BEAST fit %s was evicted, fitting it again", fid)
+        value = self.refit(fid)
+        if self.cache is not None:
+            self.cache.put(self.keys[fid], value)
+        return value
+
+
+def _fit_all(
+    tasks: Sequence[tuple[int, int, int]],
+    values: np.ndarray,
+    time: np.ndarray,
+    metadata: dict[str, Any],
+    prior: dict[str, Any],
+    max_workers: int | None,
+) -> Iterator[tuple[tuple[int, int], np.ndarray]]:
+    if not tasks:
+        return
+    with _shared(values) as name:
+        # Workers are forked, as stage scripts cannot be imported by new interpreters.
+        pool = ProcessPoolExecutor(
+            max_workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(name, values.shape, time, metadata, prior),
+        )
+        try:
+            futures = [pool.submit(_fit_task, task) for task in tasks]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            pool.shutdown(cancel_futures=True)
+
+
+@contextmanager
+def _shared(values: np.ndarray) -> Iterator[str]:
+    shm = SharedMemory(create=True, size=max(values.nbytes, 1))
+    try:
+        np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[...] = values
+        yield shm.name
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _init_worker(
+    name: str,
+    shape: tuple[int, ...],
+    time: np.ndarray,
+    metadata: dict[str, Any],
+    prior: dict[str, Any],
+) -> None:
+    shm = SharedMemory(name=name)
+    values = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    values.flags.writeable = False
+    _worker.update(shm=shm, values=values, time=time, metadata=metadata, prior=prior)
+
+
+def _fit_task(task: tuple[int, int, int]) -> tuple[tuple[int, int], np.ndarray]:
+    j, idx, seed = task
+    date, prob = fit(
+        _worker["values"][:, j],
+        _worker["time"],
+        seed,
+        metadata=_worker["metadata"],
+        prior=_worker["prior"],
+    )
+    return (j, idx), np.vstack([date, prob])
@@ -0,0 +1,217 @@
+"""Content-addressed cache of array results of expensive computations.
+
+Entries of an :class:`ArrayCache` are NumPy arrays stored in separate ``.npy``
+files named by keys derived from the content of all inputs of a computation
+(:func:`cache_key`), so changed inputs never hit stale entries and entries are
+shared by all computations with the same inputs. Reading an entry marks it as
+recently used, and :meth:`ArrayCache.prune` evicts least recently used entries
+once the cache grows beyond its size limit.
+
+The cache can be inspected and pruned from the command line::
+
+    python -m project.cache info
+    python -m project.cache prune --maxbytes 1e9
+    python -m project.cache prune --older-than 30
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections.abc import Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+__all__ = ("ArrayCache", "cache_key")
+
+
+def cache_key(*parts: Any) -> str:
+    """Compute content digest of arrays and (JSON-serializable) values.
+
+    Arrays are hashed with their dtypes and shapes, so equal values of different
+    types give different keys.
+
+    Examples
+    --------
+    >>> x = np.arange(3.0)
+    >>> cache_key(x, {"a": 1}) == cache_key(x.copy(), {"a": 1})
+    True
+    >>> cache_key(x, {"a": 1}) == cache_key(x.astype(np.float32), {"a": 1})
+    False
+    """
+    sha = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray | pd.Series):
+            a = np.ascontiguousarray(part)
+            sha.update(f"{a.dtype.str}{a.shape}".encode())
+            sha.update(a.tobytes())
+        else:
+            sha.update(json.dumps(part, sort_keys=True, default=str).encode())
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+@dataclass(frozen=True)
+class ArrayCache:
+    """Cache of arrays in a directory.
+
+    Attributes
+    ----------
+    path
+        Cache directory. Entries are stored in subdirectories named by the
+        first two characters of their keys.
+    maxbytes
+        Size limit used by :meth:`prune`. No limit if ``None``.
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> cache = ArrayCache(tempfile.mkdtemp())
+    >>> key = cache_key("example", 1)
+    >>> cache.get(key) is None
+    True
+    >>> cache.put(key, np.array([1.0, 2.0]))
+    >>> cache.get(key).tolist()
+    [1.0, 2.0]
+    >>> len(cache.entries())
+    1
+    >>> cache.prune(maxbytes=0)
+    1
+    >>> key in cache
+    False
+    """
+
+    path: Path
+    maxbytes: int | None = None
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "path", Path(self.path))
+
+    def __contains__(self, key: str) -> bool:
+        return self._file(key).exists()
+
+    def get(self, key: str) -> np.ndarray | None:
+        """Get entry or ``None`` if it is not cached."""
+        file = self._file(key)
+        try:
+            value = np.load(file, allow_pickle=False)
+        except FileNotFoundError:
+            return None
+        # Modification time records the last use of the entry.
+        os.utime(file)
+        return value
+
+    def put(self, key: str, value: np.ndarray) -> None:
+        """Store entry."""
+        file = self._file(key)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        # Entries appear atomically, so partially written files are never read.
+        tmp = file.with_name(f"{file.stem}.{os.getpid()}.tmp")
+        with tmp.open("wb") as fh:
+            np.save(fh, np.asarray(value), allow_pickle=False)
+        tmp.replace(file)
+
+    def entries(self) -> pd.DataFrame:
+        """List entries with their sizes and times of last use, most recent first."""
+        stats = [(f.stem, f.stat()) for f in self.path.glob("*/*.npy")]
+        return (
+            pd.DataFrame(
+                {
+                    "key": [k for k, _ in stats],
+                    "size": np.array([s.st_size for _, s in stats], dtype=np.int64),
+                    "used": pd.to_datetime([s.st_mtime_ns for _, s in stats], unit="ns"),
+                }
+            )
+            .sort_values("used", ascending=False, kind="stable")
+            .reset_index(drop=True)
+        )
+
+    def prune(
+        self, maxbytes: int | None = None, *, older_than: pd.Timedelta | None = None
+    ) -> int:
+        """Evict least recently used entries.
+
+        Parameters
+        ----------
+        maxbytes
+            Size limit. Defaults to :attr:`maxbytes`.
+        older_than
+            Evict also all entries not used for longer than this.
+
+        Returns
+        -------
+        Number of evicted entries.
+        """
+        maxbytes = self.maxbytes if maxbytes is None else maxbytes
+        entries = self.entries()
+        evict = np.zeros(len(entries), dtype=bool)
+        if maxbytes is not None:
+            evict |= entries["size"].cumsum().to_numpy() > maxbytes
+        if older_than is not None:
+            cutoff = pd.Timestamp(time.time_ns(), unit="ns") - older_than
+            evict |= (entries["used"] < cutoff).to_numpy()
+        for key in entries["key"][evict]:
+            self._file(key).unlink(missing_ok=True)
+        return int(evict.sum())
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    # Internals ----------------------------------------------------------------------
+
+    def _file(self, key: str) -> Path:
+        return self.path / key[:2] / f"{key}.npy"
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    """Inspect or prune a cache (by default the cache of BEAST fits)."""
+    parser = argparse.ArgumentParser(
+        prog="python -m project.cache", description=main.__doc__
+    )
+    parser.add_argument("--path", type=Path, help="cache directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("info", help="show number, size and age of entries")
+    prune = commands.add_parser("prune", help="evict least recently used entries")
+    prune.add_argument("--maxbytes", type=float, help="size limit (defaults to config)")
+    prune.add_argument(
+        "--older-than", type=float, metavar="DAYS", help="evict unused entries"
+    )
+    prune.add_argument("--all", action="store_true", help="remove all entries")
+    args = parser.parse_args(argv)
+
+    if args.path is None:
+        from project import config, paths
+
+        cache = ArrayCache(paths.beast_cache, config.cache.beast.maxbytes)
+    else:
+        cache = ArrayCache(args.path)
+
+    if args.command == "prune":
+        if args.all:
+            n = len(cache.entries())
+            cache.clear()
+        else:
+            n = cache.prune(
+                None if args.maxbytes is None else int(args.maxbytes),
+                older_than=None
+                if args.older_than is None
+                else pd.Timedelta(days=args.older_than),
+            )
+        print(f"evicted {n} entries")
+    entries = cache.entries()
+    print(
+        f"{cache.path}: {len(entries)} entries, {entries['size'].sum() / 1024**2:.1f} MiB"
+    )
+    if len(entries):
+        print(f"last used: {entries['used'].iloc[-1]} .. {entries['used'].iloc[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Weekly calendar of the study period.
+
+All weekly data share one grid of ISO weeks (Monday to Sunday) covering the
+study period (``period`` in ``params.yaml``). :func:`week_index` builds it once
+per process and :class:`WeekIndex` maps timestamps and fractional-year time
+coordinates to week numbers (``week_t``) with binary searches over the sorted
+grid, so no stage needs to compute ISO calendars of individual observations.
+
+The fractional-year time coordinate used by BEAST advances by exactly ``1/52``
+per week, starting from the middle of the first week counted from the start of
+its ISO year (52-week years), so consecutive weeks are always equally spaced.
+"""
+
+from dataclasses import dataclass
+from datetime import date
+from functools import cache
+from typing import Self
+
+import numpy as np
+import pandas as pd
+
+__all__ = ("WeekIndex", "week_index")
+
+
+@dataclass(frozen=True)
+class WeekIndex:
+    """Consecutive ISO weeks.
+
+    Attributes
+    ----------
+    weeks
+        Data frame with one row per week and columns ``week_t`` (week number
+        starting from ``0``), ``week_start`` (Monday), ``iso_year``, ``iso_week``
+        and ``time`` (fractional-year time of the middle of the week).
+    start, end
+        First and last day covered by the index.
+    """
+
+    weeks: pd.DataFrame
+    start: pd.Timestamp
+    end: pd.Timestamp
+
+    @classmethod
+    def from_period(cls, start: str | date, end: str | date) -> Self:
+        """Build index of weeks overlapping the period from ``start`` to ``end``."""
+        start = pd.Timestamp(start).normalize()
+        end = pd.Timestamp(end).normalize()
+        if end < start:
+            errmsg = f"period end '{end.date()}' is before its start '{start.date()}'"
+            raise ValueError(errmsg)
+        week_start = pd.date_range(
+            start - pd.Timedelta(days=start.weekday()), end, freq="7D"
+        )
+        iso = week_start.isocalendar()
+        week_t = np.arange(len(week_start))
+        origin = iso["year"].iloc[0] + (iso["week"].iloc[0] - 0.5) / 52
+        weeks = pd.DataFrame(
+            {
+                "week_t": week_t,
+                "week_start": week_start,
+                "iso_year": iso["year"].to_numpy(dtype=np.int64),
+                "iso_week": iso["week"].to_numpy(dtype=np.int64),
+                "time": origin + week_t / 52,
+            }
+        )
+        return cls(weeks=weeks, start=start, end=end)
+
+    def __len__(self) -> int:
+        return len(self.weeks)
+
+    @property
+    def week_start(self) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(self.weeks["week_start"])
+
+    @property
+    def time(self) -> np.ndarray:
+        return self.weeks["time"].to_numpy()
+
+    def week_of(self, timestamps: object) -> np.ndarray:
+        """Get week numbers of timestamps (or dates).
+
+        Time zone aware timestamps are converted to UTC first.
+
+        Raises
+        ------
+        ValueError
+            If some timestamps are outside of the period.
+        """
+        ts = pd.DatetimeIndex(pd.to_datetime(timestamps))
+        if ts.tz is not None:
+            ts = ts.tz_convert(None)
+        if ts.hasnans:
+            errmsg = "cannot find weeks of missing timestamps"
+            raise ValueError(errmsg)
+        if len(ts) and (
+            ts.min() < self.start or ts.max() >= self.end + pd.Timedelta(days=1)
+        ):
+            errmsg = (
+                f"timestamps outside of the period {self.start.date()}-{self.end.date()}"
+            )
+            raise ValueError(errmsg)
+        starts = self.week_start.as_unit("ns").asi8
+        return np.searchsorted(starts, ts.as_unit("ns").asi8, side="right") - 1
+
+    def week_of_time(self, time: object) -> np.ndarray:
+        """Get week numbers of the nearest grid points of fractional-year time values.
+
+        Raises
+        ------
+        ValueError
+            If some values are more than half a week away from the grid.
+        """
+        time = np.asarray(time, dtype=np.float64)
+        grid = self.time
+        if len(time) and (
+            np.nanmin(time) < grid[0] - 0.5 / 52 or np.nanmax(time) > grid[-1] + 0.5 / 52
+        ):
+            errmsg = "time values outside of the period"
+            raise ValueError(errmsg)
+        return np.searchsorted((grid[1:] + grid[:-1]) / 2, time, side="left")
+
+
+@cache
+def week_index(start: str | date, end: str | date) -> WeekIndex:
+    """Get (cached) index of weeks of the period from ``start`` to ``end``.
+
+    Examples
+    --------
+    >>> weeks = week_index("2016-01-01", "2016-01-20")
+    >>> weeks.weeks[["week_t", "week_start", "iso_year", "iso_week"]]
+       week_t week_start  iso_year  iso_week
+    0       0 2015-12-28      2015        53
+    1       1 2016-01-04      2016         1
+    2       2 2016-01-11      2016         2
+    3       3 2016-01-18      2016         3
+    >>> weeks.week_of(["2016-01-01 12:00", "2016-01-04 00:00", "2016-01-10 23:59"]).tolist()
+    [0, 1, 1]
+    >>> weeks.week_of_time(weeks.time + 0.2 / 52).tolist()
+    [0, 1, 2, 3]
+    """
+    return WeekIndex.from_period(start, end)
@@ -0,0 +1,529 @@
+"""Combination of changepoint probabilities.
+
+Changepoint probabilities from BEAST runs, variables and neighbouring weeks are
+combined with the noisy-OR rule, i.e. as the probability that at least one of
+approximately independent events occurs::
+
+    P(any) = 1 - prod(1 - p_i) = -expm1(sum(log1p(-p_i)))
+
+The right-hand side is evaluated with grouped sums of ``log1p(-p)``, so one
+vectorized pass handles any number of groups. Working in log space also keeps
+results accurate for probabilities close to ``1``, where ``1 - p`` loses
+precision, and ``p == 1`` correctly yields ``1``. Rolling noisy-OR over
+windows of weeks (:func:`rolling_noisy_or`) uses differences of cumulative
+sums, so its cost does not depend on the window size.
+
+:func:`probability_curves` turns raw BEAST output into weekly consensus
+probability curves and :func:`find_changepoints` detects changepoints as peaks
+of (smoothed) curves. :func:`changepoint_intervals` quantifies uncertainty of
+changepoint dates with peaks of curves of single runs, which are detected for
+all runs in one batched pass (:func:`find_run_peaks`).
+:class:`ConsensusAccumulator` computes the same curves online, folding in one
+run at a time with memory proportional to the number of weeks, and
+:class:`StoppingRule` decides when curves and their peaks have stabilized, so
+that the ensemble can stop early.
+"""
+
+import math
+from collections.abc import Hashable, Iterable, Mapping, Sequence
+from dataclasses import dataclass, field
+from typing import Any, Self, TypeVar
+
+import numpy as np
+import pandas as pd
+from scipy import signal
+
+from project.calendar import WeekIndex
+from project.fill import _aslist
+
+__all__ = (
+    "ConsensusAccumulator",
+    "StoppingRule",
+    "changepoint_intervals",
+    "find_changepoints",
+    "find_run_peaks",
+    "noisy_or",
+    "probability_curves",
+    "rolling_noisy_or",
+)
+
+T = TypeVar("T", pd.Series, pd.DataFrame)
+
+
+def noisy_or(
+    df: pd.DataFrame,
+    by: Hashable | Sequence[Hashable],
+    column: Hashable = "prob",
+) -> pd.Series:
+    """Combine probabilities within groups with the noisy-OR rule.
+
+    Parameters
+    ----------
+    df
+        Data frame with probabilities.
+    by
+        Column(s) defining groups.
+    column
+        Column with probabilities.
+
+    Returns
+    -------
+    Combined probabilities named ``column`` and indexed by sorted group keys,
+    as ``df.groupby(by)[column].apply(lambda p: 1 - (1 - p).prod())``.
+
+    Examples
+    --------
+    >>> df = pd.DataFrame({"g": [1, 1, 2, 2], "prob": [0.5, 0.5, 1.0, 0.2]})
+    >>> noisy_or(df, "g").tolist()
+    [0.75, 1.0]
+    """
+    with np.errstate(divide="ignore"):
+        logq = np.log1p(-df[column].to_numpy(dtype=np.float64))
+    return (
+        pd.Series(logq, index=df.index, name=column)
+        .groupby([df[c] for c in _aslist(by)], observed=True)
+        .sum()
+        .pipe(lambda s: 0.0 - np.expm1(s))
+    )
+
+
+def rolling_noisy_or(p: T, window: int) -> T:
+    """Combine probabilities in rolling windows with the noisy-OR rule.
+
+    Equivalent to ``p.rolling(window).apply(lambda p: 1 - np.prod(1 - p))``,
+    but computed in linear time from cumulative sums of ``log1p(-p)``.
+    Probabilities equal to ``1`` are counted separately, so they do not turn
+    cumulative sums infinite.
+
+    Parameters
+    ----------
+    p
+        Probabilities, combined along the index (separately for every column).
+    window
+        Window size. Results for the first ``window - 1`` rows and windows with
+        missing values are missing.
+
+    Examples
+    --------
+    >>> rolling_noisy_or(pd.Series([0.5, 0.5, 1.0, 0.0, 0.0, 0.2]), 2).round(6).tolist()
+    [nan, 0.75, 1.0, 1.0, 0.0, 0.2]
+    """
+    values = p.to_numpy(dtype=np.float64).reshape(len(p), -1)
+    missing = np.isnan(values)
+    with np.errstate(divide="ignore"):
+        logq = np.log1p(-values)
+    ones = np.isneginf(logq)
+    logq[missing | ones] = 0.0
+
+    def window_sum(x: np.ndarray) -> np.ndarray:
+        cs = np.cumsum(np.vstack([np.zeros((1, x.shape[1]), dtype=x.dtype), x]), axis=0)
+        return cs[window:] - cs[:-window]
+
+    out = np.full(values.shape, np.nan)
+    if 0 < window <= len(values):
+        # Differences of cumulative sums may be slightly positive due to rounding.
+        combined = np.where(
+            window_sum(ones.astype(np.int64)) > 0,
+            1.0,
+            np.clip(0.0 - np.expm1(window_sum(logq)), 0.0, 1.0),
+        )
+        out[window - 1 :] = np.where(
+            window_sum(missing.astype(np.int64)) > 0, np.nan, combined
+        )
+    if isinstance(p, pd.DataFrame):
+        return p._constructor(out, index=p.index, columns=p.columns)
+    return p._constructor(out[:, 0], index=p.index, name=p.name)
+
+
+def probability_curves(beast: pd.DataFrame, weeks: WeekIndex) -> pd.DataFrame:
+    """Compute weekly changepoint probability curves from raw BEAST output.
+
+    Probabilities of different variables at the same time point and of time points
+    falling into the same week are combined with the noisy-OR rule within runs,
+    and then averaged over runs (weeks without changepoints count as zeros).
+
+    Parameters
+    ----------
+    beast
+        Raw BEAST output with ``subset``, ``idx`` (run), ``date`` (fractional-year
+        time) and ``prob`` columns.
+    weeks
+        Weekly grid. BEAST time points are snapped to the nearest week.
+
+    Returns
+    -------
+    Data frame with one column per subset indexed by week start timestamps.
+    """
+    return (
+        noisy_or(beast, ["subset", "idx", "date"])
+        .reset_index()
+        .assign(week_t=lambda df: weeks.week_of_time(df["date"]))
+        .pipe(noisy_or, ["subset", "idx", "week_t"])
+        .groupby(["subset", "week_t"], observed=True)
+        .sum()
+        .div(beast["idx"].max())
+        .unstack("subset", fill_value=0.0)
+        .reindex(weeks.weeks["week_t"], fill_value=0.0)
+        .set_axis(weeks.week_start.rename("timestamp"))
+    )
+
+
+def find_changepoints(curves: pd.DataFrame, **kwds: Any) -> pd.DataFrame:
+    """Find changepoints as peaks of probability curves.
+
+    Parameters
+    ----------
+    curves
+        Probability curves (columns) indexed by week start timestamps.
+    **kwds
+        Passed to :func:`scipy.signal.find_peaks`.
+
+    Returns
+    -------
+    Data frame with ``subset`` (curve name), ``timestamp``, ``height`` and
+    ``width`` of peaks and ``left`` and ``right`` ends of the week range
+    around every peak at half of its prominence.
+    """
+    peaksdata = {}
+    for col in curves:
+        tsdata = curves[col]
+        time = tsdata.index
+        peaks, _ = signal.find_peaks(tsdata, **kwds)
+        width, _, left, right = signal.peak_widths(tsdata, peaks)
+        peaksdata[col] = pd.DataFrame(
+            {
+                "height": tsdata.iloc[peaks],
+                "width": width,
+                "left": time[np.round(left).astype(int)],
+                "right": time[np.round(right).astype(int)] + pd.Timedelta(days=6),
+            }
+        )
+    return pd.concat(peaksdata, names=["subset"]).reset_index()
+
+
+def find_run_peaks(curves: np.ndarray, **kwds: Any) -> tuple[np.ndarray, np.ndarray]:
+    """Find peaks of many curves with a single call of :func:`scipy.signal.find_peaks`.
+
+    Rows of ``curves`` are concatenated with blocks of a value above any
+    probability between them. Blocks stop searches for bases of peaks at ends
+    of rows, as ends of arrays do, and are long enough for their own peaks not
+    to suppress peaks of rows closer than ``distance``. Hence peaks are the same
+    as from separate calls for every row, with one exception: of peaks of equal
+    heights (e.g. plateaus of the same value) closer than ``distance``,
+    :func:`scipy.signal.find_peaks` keeps the one which comes first in an
+    unstable sort of heights of all peaks, which may differ between one call
+    for all rows and separate calls. Plateaus themselves are single peaks at
+    their middles, as in separate calls. Windows for prominences of peaks
+    (``wlen``) are limited to two rows, so the cost is linear in the number of
+    rows.
+
+    Parameters
+    ----------
+    curves
+        Probability curves (rows).
+    **kwds
+        Passed to :func:`scipy.signal.find_peaks`.
+
+    Returns
+    -------
+    Rows and positions of peaks.
+
+    Examples
+    --------
+    >>> curves = np.array([[0.0, 0.5, 0.1, 0.4, 0.0], [0.2, 0.1, 0.0, 0.3, 0.0]])
+    >>> rows, pos = find_run_peaks(curves, distance=3)
+    >>> rows.tolist(), pos.tolist()
+    ([0, 1], [1, 3])
+    >>> plateaus = np.array([[0.0, 0.4, 0.4, 0.4, 0.0, 0.3, 0.0, 0.0]])
+    >>> find_run_peaks(plateaus, distance=2)[1].tolist()
+    [2, 5]
+
+    Only one of two peaks of equal heights closer than ``distance`` is kept,
+    but which one is not defined.
+
+    >>> ties = np.array([[0.0, 0.3, 0.3, 0.0, 0.3, 0.3, 0.0, 0.0]])
+    >>> find_run_peaks(ties, distance=2)[1].tolist()
+    [1, 4]
+    >>> find_run_peaks(ties, distance=4)[1].tolist() in ([1], [4])
+    True
+    """
+    curves = np.asarray(curves, dtype=np.float64)
+    n_rows, n_cols = curves.shape
+    gap = 2 * math.ceil(kwds.get("distance") or 1) + 1
+    stride = gap + n_cols
+    x = np.full((n_rows + 1, stride), 2.0)
+    x[:-1, gap:] = curves
+    kwds = {"wlen": 2 * stride + 1, **kwds}
+    peaks, _ = signal.find_peaks(x.ravel()[: n_rows * stride + gap], **kwds)
+    rows, pos = np.divmod(peaks, stride)
+    keep = pos >= gap
+    return rows[keep], pos[keep] - gap
+
+
+def changepoint_intervals(
+    changepoints: pd.DataFrame,
+    runs: pd.DataFrame,
+    weeks: WeekIndex,
+    *,
+    n_runs: Mapping[str, int],
+    timescale: float,
+    level: float = 0.9,
+    tolerance: float | None = None,
+    **kwds: Any,
+) -> pd.DataFrame:
+    """Quantify uncertainty of changepoint dates with peaks of single runs.
+
+    Weekly curves of single runs are smoothed and their peaks detected as for
+    consensus curves. Every peak of a run is matched with the nearest
+    changepoint of its subset not more than ``tolerance`` weeks away, keeping
+    the nearest peak of a run per changepoint. Intervals are quantiles of
+    matched peaks over runs, in the spirit of bootstrap percentile intervals.
+
+    Parameters
+    ----------
+    changepoints
+        Changepoints detected in consensus curves (see :func:`find_changepoints`).
+    runs
+        Weekly probabilities of single runs with ``subset``, ``idx`` (run),
+        ``week_t`` and ``prob`` columns. Missing weeks count as zeros.
+    weeks
+        Weekly grid.
+    n_runs
+        Numbers of runs of subsets.
+    timescale
+        Smoothing window in weeks.
+    level
+        Coverage of intervals.
+    tolerance
+        Maximum distance in weeks of matched peaks. Defaults to ``distance``
+        in ``kwds`` or ``timescale``.
+    **kwds
+        Passed to :func:`scipy.signal.find_peaks`.
+
+    Returns
+    -------
+    Copy of ``changepoints`` with ``stability`` (fraction of runs with a matched
+    peak) and ``lower`` and ``upper`` ends of the week range of the interval
+    (missing if no peak was matched).
+    """
+    if tolerance is None:
+        tolerance = kwds.get("distance") or timescale
+    window = round(timescale)
+    week_start = weeks.week_start
+    out = []
+    for subset, cps in changepoints.groupby("subset", observed=True, sort=False):
+        n = int(n_runs[subset])
+        curves = np.zeros((len(weeks), n))
+        df = runs[runs["subset"] == subset]
+        curves[df["week_t"].to_numpy(), df["idx"].to_numpy() - 1] = df["prob"]
+        smoothed = rolling_noisy_or(pd.DataFrame(curves), window).bfill()
+        rows, pos = find_run_peaks(smoothed.to_numpy().T, **kwds)
+
+        # Nearest changepoint of every peak and nearest peak of every run.
+        dist = np.abs(pos[:, None] - week_start.get_indexer(cps["timestamp"])[None, :])
+        matched = (
+            pd.DataFrame(
+                {
+                    "cp": dist.argmin(axis=1),
+                    "run": rows,
+                    "pos": pos,
+                    "dist": dist.min(axis=1, initial=len(weeks)),
+                }
+            )
+            .query(f"dist <= {tolerance}")
+            .sort_values(["cp", "run", "dist"], kind="stable")
+            .drop_duplicates(["cp", "run"])
+            .groupby("cp")["pos"]
+        )
+        lower = matched.quantile((1 - level) / 2, interpolation="lower")
+        upper = matched.quantile((1 + level) / 2, interpolation="higher")
+        positions = np.arange(len(cps))
+        out.append(
+            cps.assign(
+                stability=matched.size().reindex(positions, fill_value=0).to_numpy() / n,
+                lower=_week(week_start, lower.reindex(positions)),
+                upper=_week(week_start, upper.reindex(positions)) + pd.Timedelta(days=6),
+            )
+        )
+    return pd.concat(out).loc[changepoints.index]
+
+
+@dataclass
+class ConsensusAccumulator:
+    """Running weekly consensus probability curves of ensembles of BEAST runs.
+
+    Runs are folded in one at a time. Probabilities of a run are combined with
+    the noisy-OR rule within time points and then within weeks, as in
+    :func:`probability_curves`, and added to running sums, so the state holds
+    one value per week and subset regardless of the number of runs.
+
+    Attributes
+    ----------
+    weeks
+        Weekly grid. BEAST time points are snapped to the nearest week.
+    subsets
+        Names of subsets.
+    total
+        Sums of weekly probabilities over runs (weeks by subsets).
+    n_runs
+        Numbers of runs folded into the curves of subsets.
+
+    Examples
+    --------
+    >>> from project.calendar import week_index
+    >>> weeks = week_index("2016-01-01", "2016-01-20")
+    >>> acc = ConsensusAccumulator(weeks, ["a"])
+    >>> acc.add("a", weeks.time[[1, 1, 2]], np.array([0.5, 0.5, 1.0])).tolist()
+    [0.0, 0.75, 1.0, 0.0]
+    >>> _ = acc.add("a", weeks.time[[1]], np.array([0.5]))
+    >>> acc.curves["a"].tolist()
+    [0.0, 0.625, 0.5, 0.0]
+    >>> ConsensusAccumulator.from_frame(acc.to_frame(), weeks).curves.equals(acc.curves)
+    True
+    """
+
+    weeks: WeekIndex
+    subsets: Sequence[str]
+    total: np.ndarray = field(init=False, repr=False)
+    n_runs: np.ndarray = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.subsets = list(self.subsets)
+        self.total = np.zeros((len(self.weeks), len(self.subsets)))
+        self.n_runs = np.zeros(len(self.subsets), dtype=np.int64)
+
+    def add(self, subset: str, date: Iterable[float], prob: Iterable[float]) -> np.ndarray:
+        """Fold changepoint times (``date``) and probabilities of one run into
+        the curve of ``subset``.
+
+        Returns
+        -------
+        Weekly probabilities of the run.
+        """
+        date = np.asarray(date, dtype=np.float64)
+        prob = np.asarray(prob, dtype=np.float64)
+        times, inverse = np.unique(date, return_inverse=True)
+        with np.errstate(divide="ignore"):
+            logq = np.bincount(inverse, weights=np.log1p(-prob), minlength=len(times))
+            p = 0.0 - np.expm1(logq)
+            logq = np.bincount(
+                self.weeks.week_of_time(times),
+                weights=np.log1p(-p),
+                minlength=len(self.weeks),
+            )
+        curve = 0.0 - np.expm1(logq)
+        j = self.subsets.index(subset)
+        self.total[:, j] += curve
+        self.n_runs[j] += 1
+        return curve
+
+    @property
+    def curves(self) -> pd.DataFrame:
+        """Consensus curves as returned by :func:`probability_curves`."""
+        with np.errstate(invalid="ignore"):
+            curves = self.total / self.n_runs
+        return pd.DataFrame(
+            curves,
+            index=self.weeks.week_start.rename("timestamp"),
+            columns=pd.Index(self.subsets, name="subset"),
+        ).sort_index(axis=1)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Get curves in long format.
+
+        Returns
+        -------
+        Data frame with ``subset``, ``week_t``, ``timestamp``, ``prob`` and
+        ``n_runs`` columns.
+        """
+        n_runs = pd.Series(self.n_runs, index=self.subsets)
+        return (
+            self.curves.set_axis(self.weeks.weeks["week_t"])
+            .rename_axis(columns="subset")
+            .melt(ignore_index=False, value_name="prob")
+            .reset_index()
+            .assign(
+                timestamp=lambda df: self.weeks.week_start[df["week_t"]],
+                n_runs=lambda df: n_runs[df["subset"]].to_numpy(),
+            )[["subset", "week_t", "timestamp", "prob", "n_runs"]]
+        )
+
+    @classmethod
+    def from_frame(cls, consensus: pd.DataFrame, weeks: WeekIndex) -> Self:
+        """Restore accumulator from curves in long format (see :meth:`to_frame`)."""
+        probs = consensus.pivot(index="week_t", columns="subset", values="prob").reindex(
+            weeks.weeks["week_t"], fill_value=0.0
+        )
+        n_runs = consensus.groupby("subset", observed=True)["n_runs"].first()
+        acc = cls(weeks, list(probs.columns))
+        acc.n_runs = n_runs[probs.columns].to_numpy(dtype=np.int64)
+        acc.total = probs.to_numpy(dtype=np.float64) * acc.n_runs
+        return acc
+
+
+@dataclass
+class StoppingRule:
+    """Convergence-based stopping rule for ensembles of BEAST runs.
+
+    Consensus curves are checked every ``every`` runs. They are smoothed with
+    :func:`rolling_noisy_or` and their peaks are detected with
+    :func:`find_changepoints`, as in the postprocessing of the ensemble. A check
+    is stable if no smoothed curve moved by more than ``tol`` (maximum absolute
+    difference) since the previous check and peaks were found at the same weeks.
+    The ensemble has converged after ``patience`` consecutive stable checks.
+
+    Attributes
+    ----------
+    timescale
+        Smoothing window in weeks (``changepoints.timescale``).
+    peaks
+        Peak detection parameters (``changepoints.peaks``).
+    every
+        Number of runs between checks.
+    tol
+        Tolerance for changes of smoothed curves.
+    patience
+        Number of consecutive stable checks required.
+    """
+
+    timescale: float
+    peaks: Mapping[str, Any]
+    every: int = 50
+    tol: float = 0.01
+    patience: int = 3
+    stable: int = field(default=0, init=False)
+    _last: tuple[pd.DataFrame, pd.DataFrame] | None = field(
+        default=None, init=False, repr=False
+    )
+
+    def update(self, consensus: ConsensusAccumulator) -> bool:
+        """Check whether the ensemble has converged.
+
+        Curves are checked only if every subset has a multiple of :attr:`every`
+        runs, so the rule can be updated after every run.
+        """
+        n_runs = consensus.n_runs
+        if not n_runs.min() or (n_runs % self.every).any():
+            return False
+        smoothed = rolling_noisy_or(consensus.curves, round(self.timescale)).bfill()
+        peaks = find_changepoints(smoothed, **self.peaks)[["subset", "timestamp"]]
+        if self._last is not None:
+            last_smoothed, last_peaks = self._last
+            diff = (smoothed - last_smoothed).abs().to_numpy()
+            if np.nanmax(diff, initial=0.0) <= self.tol and peaks.equals(last_peaks):
+                self.stable += 1
+            else:
+                self.stable = 0
+        self._last = (smoothed, peaks)
+        return self.stable >= self.patience
+
+
+# Internals --------------------------------------------------------------------------
+
+
+def _week(week_start: pd.DatetimeIndex, pos: pd.Series) -> np.ndarray:
+    # Week start timestamps of positions, missing for missing positions.
+    out = pd.Series(pd.NaT, index=pos.index, dtype=week_start.dtype)
+    valid = pos.notna()
+    out[valid] = week_start[pos[valid].to_numpy(dtype=np.int64)]
+    return out.to_numpy()
@@ -0,0 +1,422 @@
+"""Text classification of posts on CPU.
+
+Posts are scored by sequence classification models (``ml.labels`` in
+``params.yaml``) loaded from local snapshots of pinned revisions, which are
+downloaded once with::
+
+    python -m project.classify download
+
+:func:`classify` tokenizes texts in the main process and groups posts sorted by
+their numbers of tokens into batches of at most ``max_tokens`` padded tokens
+(:func:`token_batches`), so short posts are scored in large batches and long
+posts in small ones, and little compute is spent on padding. Batches are scored
+in a pool of worker processes, each with its own copy of the model and a fixed
+number of intra-op threads, longest batches first, so that workers finish at
+about the same time.
+
+Scores are stored in a persistent :class:`ScoreCache` keyed by post keys and
+model revisions as soon as batches are done. Hence interrupted runs resume,
+reruns read all scores from the cache and after new posts are added only the
+new ones are scored. The cache is independent of DVC, so scores survive
+changes of stage outputs and are shared by all branches of a checkout.
+
+``transformers`` and ``torch`` are optional dependencies (the ``ml`` extra)
+needed only when some posts are not cached yet.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+__all__ = ("ScoreCache", "classify", "snapshot_path", "token_batches")
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_path(root: str | Path, name: str, revision: str) -> Path:
+    """Get directory of a local snapshot of a model revision.
+
+    Examples
+    --------
+    >>> snapshot_path("models/hf", "org/model", "abc123").as_posix()
+    'models/hf/org/model/abc123'
+    """
+    return Path(root) / name / revision
+
+
+def token_batches(
+    lengths: Sequence[int] | np.ndarray, max_tokens: int, max_size: int | None = None
+) -> list[np.ndarray]:
+    """Group sequences into batches of similar lengths.
+
+    Sequences are sorted by length and batches are filled greedily as long as
+    the number of padded tokens (size of the batch times its longest sequence)
+    does not exceed ``max_tokens``. A sequence longer than ``max_tokens`` forms
+    a batch of its own.
+
+    Parameters
+    ----------
+    lengths
+        Numbers of tokens of sequences.
+    max_tokens
+        Maximum number of padded tokens of a batch.
+    max_size
+        Maximum number of sequences of a batch. No limit if ``None``.
+
+    Returns
+    -------
+    Positions of sequences of batches, from the shortest to the longest ones.
+
+    Examples
+    --------
+    >>> [b.tolist() for b in token_batches([5, 1, 3, 2, 8], max_tokens=8)]
+    [[1, 3], [2], [0], [4]]
+    >>> [b.tolist() for b in token_batches([1, 1, 1], max_tokens=8, max_size=2)]
+    [[0, 1], [2]]
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    order = np.argsort(lengths, kind="stable")
+    bounds = [0]
+    size = 0
+    for i, length in enumerate(lengths[order]):
+        # Lengths are sorted, so the current sequence is the longest of the batch.
+        if size and ((size + 1) * length > max_tokens or size == max_size):
+            bounds.append(i)
+            size = 0
+        size += 1
+    bounds.append(len(order))
+    return [order[a:b] for a, b in zip(bounds[:-1], bounds[1:], strict=True) if b > a]
+
+
+@dataclass(frozen=True)
+class ScoreCache:
+    """Cache of scores of posts keyed by post keys and model revisions.
+
+    Scores are stored in Parquet shards in subdirectories of model revisions
+    (``revision=<revision>/part-*.parquet``) with ``key`` and ``scores``
+    (list of class probabilities) columns. Each :meth:`put` writes a new shard
+    atomically and :meth:`compact` merges shards of a revision into one.
+
+    Attributes
+    ----------
+    path
+        Cache directory.
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> cache = ScoreCache(tempfile.mkdtemp())
+    >>> cache.put("rev", ["a", "b"], np.array([[0.9, 0.1], [0.2, 0.8]]))
+    >>> cache.put("rev", ["c"], np.array([[0.5, 0.5]]))
+    >>> keys, scores = cache.get("rev", ["c", "a", "d"])
+    >>> keys.tolist(), scores.astype(float).round(1).tolist()
+    (['c', 'a'], [[0.5, 0.5], [0.9, 0.1]])
+    >>> cache.compact("rev")
+    >>> len(list(cache.path.glob("revision=rev/*.parquet")))
+    1
+    >>> cache.get("other", ["a"])[0].tolist()
+    []
+    """
+
+    path: Path
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "path", Path(self.path))
+
+    def get(
+        self, revision: str, keys: Sequence[str] | np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Get cached scores of posts.
+
+        Returns
+        -------
+        Keys of cached posts (in the order of ``keys``) and their scores
+        (one row per post).
+        """
+        keys = pd.Index(keys)
+        cached, scores = _latest(self._read(revision, keys))
+        found = keys[keys.isin(cached)]
+        return found.to_numpy(dtype=object), scores[cached.get_indexer(found)]
+
+    def put(
+        self, revision: str, keys: Sequence[str] | np.ndarray, scores: np.ndarray
+    ) -> None:
+        """Store scores of posts in a new shard."""
+        table = pa.table(
+            {
+                "key": pa.array(np.asarray(keys, dtype=object), type=pa.string()),
+                "scores": _lists(np.asarray(scores, dtype=np.float32)),
+            }
+        )
+        directory = self._directory(revision)
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"part-{time.time_ns()}-{os.getpid()}"
+        tmp = directory / f".{name}.tmp"
+        pq.write_table(table, tmp, compression="zstd")
+        tmp.replace(directory / f"{name}.parquet")
+
+    def compact(self, revision: str) -> None:
+        """Merge shards of a revision into one."""
+        shards = sorted(self._directory(revision).glob("part-*.parquet"))
+        if len(shards) <= 1:
+            return
+        keys, scores = _latest(self._read(revision))
+        self.put(revision, keys, scores)
+        for shard in shards:
+            shard.unlink()
+
+    # Internals ----------------------------------------------------------------------
+
+    def _directory(self, revision: str) -> Path:
+        return self.path / f"revision={revision}"
+
+    def _read(self, revision: str, keys: pd.Index | None = None) -> pa.Table:
+        # Shards are read in the order of writing.
+        shards = sorted(self._directory(revision).glob("part-*.parquet"))
+        if not shards:
+            return pa.table({"key": pa.array([], pa.string()), "scores": _lists(None)})
+        dataset = ds.dataset([str(s) for s in shards], format="parquet")
+        filter = None if keys is None else ds.field("key").isin(keys.tolist())
+        return dataset.to_table(filter=filter)
+
+
+def classify(
+    keys: Sequence[str] | np.ndarray,
+    texts: Sequence[str] | np.ndarray,
+    model: str | Path,
+    *,
+    revision: str,
+    cache: ScoreCache | None = None,
+    max_tokens: int = 8192,
+    max_size: int | None = None,
+    max_length: int = 512,
+    max_workers: int | None = None,
+    threads: int = 1,
+    flush: int = 10_000,
+) -> pd.DataFrame:
+    """Score posts with a sequence classification model.
+
+    Parameters
+    ----------
+    keys
+        Unique keys of posts.
+    texts
+        Texts of posts.
+    model
+        Local snapshot of the model (see :func:`snapshot_path`).
+    revision
+        Revision of the model, used as part of cache keys.
+    cache
+        Cache of scores. Only posts not cached are scored.
+    max_tokens, max_size
+        Maximum numbers of padded tokens and posts of a batch
+        (see :func:`token_batches`).
+    max_length
+        Maximum number of tokens of a post (longer posts are truncated).
+    max_workers
+        Number of worker processes. Defaults to the number of CPUs divided by
+        ``threads``.
+    threads
+        Number of intra-op threads of a worker.
+    flush
+        Number of scored posts after which scores are stored in the cache.
+
+    Returns
+    -------
+    Frame with ``key`` and probabilities of classes (columns named by labels of
+    classes of the model) in the order of ``keys``.
+
+    Raises
+    ------
+    ValueError
+        If ``keys`` are not unique.
+    ImportError
+        If some posts must be scored and ``transformers`` is not installed.
+    """
+    keys = pd.Index(np.asarray(keys, dtype=object))
+    if not keys.is_unique:
+        errmsg = "keys of posts to classify are not unique"
+        raise ValueError(errmsg)
+    texts = np.asarray(texts, dtype=object)
+    model = Path(model)
+    labels = _labels(model)
+    scores = np.full((len(keys), len(labels)), np.nan, dtype=np.float32)
+
+    if cache is not None:
+        found, cached = cache.get(revision, keys)
+        if len(found):
+            scores[keys.get_indexer(found)] = cached
+    missing = np.flatnonzero(np.isnan(scores).all(axis=1))
+    logger.info(
+        "scoring %d of %d posts with '%s' (others are cached)",
+        len(missing),
+        len(keys),
+        model,
+    )
+
+    if len(missing):
+        tokenizer = _transformers().AutoTokenizer.from_pretrained(
+            model, local_files_only=True
+        )
+        ids = tokenizer(
+            [str(t) if pd.notna(t) else "" for t in texts[missing]],
+            truncation=True,
+            max_length=max_length,
+        )["input_ids"]
+        batches = token_batches([len(i) for i in ids], max_tokens, max_size)
+        tasks = [(missing[b], [ids[i] for i in b]) for b in reversed(batches)]
+        results = _score_all(tasks, model, tokenizer.pad_token_id, max_workers, threads)
+        done, unsaved = 0, []
+        for pos, values in results:
+            scores[pos] = values
+            done += len(pos)
+            unsaved.append(pos)
+            if cache is not None and (
+                done == len(missing) or sum(map(len, unsaved)) >= flush
+            ):
+                pos = np.concatenate(unsaved)
+                cache.put(revision, keys[pos], scores[pos])
+                unsaved = []
+            logger.info("[%d/%d] posts scored", done, len(missing))
+        if cache is not None:
+            cache.compact(revision)
+
+    columns = dict(zip(labels, scores.T, strict=True))
+    return pd.DataFrame({"key": keys.to_numpy(), **columns})
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    """Download snapshots of pinned revisions of models (``ml.labels``)."""
+    parser = argparse.ArgumentParser(
+        prog="python -m project.classify", description=main.__doc__
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    download = commands.add_parser("download", help="download model snapshots")
+    download.add_argument("labels", nargs="*", help="labels to download (all by default)")
+    args = parser.parse_args(argv)
+
+    from project import config, paths
+
+    labels = args.labels or list(config.ml.labels)
+    try:
+        from huggingface_hub import snapshot_download
+    except ImportError as exc:
+        errmsg = "downloading models requires 'huggingface_hub' (the 'ml' extra)"
+        raise ImportError(errmsg) from exc
+    for label in labels:
+        spec = config.ml.labels[label]
+        path = snapshot_path(paths.hf, spec.name, spec.revision)
+        snapshot_download(spec.name, revision=spec.revision, local_dir=path)
+        print(f"{label}: {path}")
+
+
+# Internals --------------------------------------------------------------------------
+
+_worker: dict[str, Any] = {}
+
+
+def _transformers() -> Any:
+    try:
+        import transformers
+    except ImportError as exc:
+        errmsg = (
+            "classification requires 'transformers' and 'torch' "
+            "(install the 'ml' extra of the project)"
+        )
+        raise ImportError(errmsg) from exc
+    return transformers
+
+
+def _labels(model: Path) -> list[str]:
+    # Labels of classes are read from the model configuration, so no optional
+    # dependencies are needed when all scores are cached.
+    id2label = json.loads((model / "config.json").read_text())["id2label"]
+    return [str(id2label[str(i)]) for i in range(len(id2label))]
+
+
+def _latest(table: pa.Table) -> tuple[pd.Index, np.ndarray]:
+    # Shards may overlap after interrupted runs; later shards take precedence.
+    keys = pd.Index(table["key"].to_numpy(zero_copy_only=False))
+    last = ~keys.duplicated(keep="last")
+    if not last.any():
+        return keys[last], np.empty((0, 0), dtype=np.float32)
+    lists = table["scores"].combine_chunks()
+    values = lists.flatten().to_numpy(zero_copy_only=False).astype(np.float32)
+    return keys[last], values.reshape(len(lists), -1)[last]
+
+
+def _lists(values: np.ndarray | None) -> pa.Array:
+    # Rows of a matrix as a list array without copying rows one by one.
+    if values is None:
+        return pa.array([], pa.list_(pa.float32()))
+    offsets = np.arange(len(values) + 1, dtype=np.int32) * values.shape[1]
+    return pa.ListArray.from_arrays(pa.array(offsets), pa.array(values.ravel()))
+
+
+def _score_all(
+    tasks: Sequence[tuple[np.ndarray, list[list[int]]]],
+    model: Path,
+    pad_token_id: int,
+    max_workers: int | None,
+    threads: int,
+) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    if max_workers is None:
+        max_workers = max((os.cpu_count() or 1) // threads, 1)
+    # Workers are forked, as stage scripts cannot be imported by new interpreters.
+    # The main process only tokenizes texts, so no thread pools of torch are
+    # forked, and models are loaded by workers.
+    pool = ProcessPoolExecutor(
+        max_workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_worker,
+        initargs=(model, pad_token_id, threads),
+    )
+    try:
+        futures = {pool.submit(_score_task, ids): pos for pos, ids in tasks}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def _init_worker(model: Path, pad_token_id: int, threads: int) -> None:
+    import torch
+
+    torch.set_num_threads(threads)
+    net = _transformers().AutoModelForSequenceClassification.from_pretrained(
+        model, local_files_only=True
+    )
+    _worker.update(torch=torch, model=net.eval(), pad_token_id=pad_token_id)
+
+
+def _score_task(ids: list[list[int]]) -> np.ndarray:
+    torch = _worker["torch"]
+    width = max(map(len, ids))
+    input_ids = np.full((len(ids), width), _worker["pad_token_id"], dtype=np.int64)
+    mask = np.zeros((len(ids), width), dtype=np.int64)
+    for i, seq in enumerate(ids):
+        input_ids[i, : len(seq)] = seq
+        mask[i, : len(seq)] = 1
+    with torch.inference_mode():
+        logits = _worker["model"](
+            input_ids=torch.from_numpy(input_ids), attention_mask=torch.from_numpy(mask)
+        ).logits
+    return torch.softmax(logits.float(), dim=-1).numpy()
+
+
+if __name__ == "__main__":
+    main()
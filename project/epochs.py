@@ -0,0 +1,85 @@
+"""Assignment of posts to epochs delimited by changepoints.
+
+Changepoint dates partition the study period into sequential epochs
+(``0, 1, 2, ...``). :func:`assign_epochs` labels posts with a single binary
+search of post timestamps in the sorted changepoint dates, so the cost is
+``O(n log k)`` for ``n`` posts and ``k`` changepoints and post data can be
+reused for any number of candidate changepoint sets.
+"""
+
+from collections.abc import Hashable, Iterable, Sequence
+
+import numpy as np
+import pandas as pd
+
+from project.fill import _aslist
+
+__all__ = ("assign_epochs",)
+
+
+def assign_epochs(
+    posts: pd.DataFrame,
+    changepoints: Iterable[pd.Timestamp],
+    *,
+    by: Hashable | Sequence[Hashable] = ("country", "name"),
+    min_posts: int | None = None,
+    timestamp: Hashable = "timestamp",
+    origin: pd.Timestamp | None = None,
+) -> pd.DataFrame:
+    """Assign posts to epochs.
+
+    A post belongs to epoch ``i`` if exactly ``i`` changepoints are not later
+    than its timestamp.
+
+    Parameters
+    ----------
+    posts
+        Post data. It is not modified.
+    changepoints
+        Changepoint dates, in any order.
+    by
+        Columns identifying outlets for the ``min_posts`` filter.
+    min_posts
+        If not ``None``, only posts of outlets with more than ``min_posts``
+        posts in an epoch are kept.
+    timestamp
+        Timestamp column.
+    origin
+        Start of the first epoch. Defaults to the earliest post timestamp.
+
+    Returns
+    -------
+    Copy of ``posts`` with ``epoch``, ``epoch_start`` and ``epoch_t`` (time since
+    the start of the epoch in weeks) columns, with a default index.
+
+    Examples
+    --------
+    >>> posts = pd.DataFrame({
+    ...     "name": ["a", "a", "a", "b"],
+    ...     "timestamp": pd.date_range("2020-01-01", periods=4, freq="14D"),
+    ... })
+    >>> cps = [pd.Timestamp("2020-01-15")]
+    >>> epochs = assign_epochs(posts, cps, by="name")
+    >>> epochs["epoch"].tolist()
+    [0, 1, 1, 1]
+    >>> epochs["epoch_t"].tolist()
+    [0.0, 0.0, 2.0, 4.0]
+    >>> assign_epochs(posts, cps, by="name", min_posts=1)["name"].tolist()
+    ['a', 'a']
+    """
+    ts = pd.DatetimeIndex(posts[timestamp])
+    starts = pd.DatetimeIndex(sorted(changepoints)).as_unit(ts.unit)
+    epoch = np.searchsorted(starts.asi8, ts.asi8, side="right")
+    origin = ts.min() if origin is None else pd.Timestamp(origin)
+    epoch_start = starts.insert(0, origin)[epoch]
+
+    out = posts.assign(
+        epoch=epoch,
+        epoch_start=epoch_start,
+        epoch_t=(ts - epoch_start).total_seconds() / (60 * 60 * 24 * 7),
+    )
+    if min_posts is not None:
+        groups = out.groupby([*_aslist(by), "epoch"], observed=True)
+        n_posts = groups["epoch"].transform("size")
+        out = out[n_posts.to_numpy() > min_posts]
+    return out.reset_index(drop=True)
@@ -0,0 +1,87 @@
+"""Per-country runs of stages.
+
+Stages of the chain ``news`` → ``weekly`` → ``signal`` → ``timeseries``
+process either all countries at once or a single country given on the
+command line::
+
+    python stages/make_weekly.py pl
+
+``dvc.yaml`` expands these stages over ``countries`` from ``params.yaml``
+with ``foreach``, so every country is processed by its own DVC stages
+(e.g. ``weekly@pl``), which run independently of other countries (also in
+parallel). DVC skips a stage when inputs of its country did not change, but
+``dataset`` depends on the pooled reactions GLMM fitted on news of all
+countries, so in practice only ``news`` is skipped for unchanged countries.
+
+Outputs of the stages are datasets partitioned by country (see
+:data:`project.schema.LAYOUTS`) and a per-country run replaces only the
+partition of its country (see :func:`project.io.write`), so partitions of all
+countries together form the complete outputs read by downstream stages and
+no separate merge step is needed.
+"""
+
+import argparse
+import sys
+from collections.abc import Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Self
+
+__all__ = ("Fanout",)
+
+
+@dataclass(frozen=True)
+class Fanout:
+    """Country processed by a run of a stage.
+
+    Attributes
+    ----------
+    country
+        Country code or ``None`` for all countries.
+
+    Examples
+    --------
+    >>> fanout = Fanout("pl")
+    >>> fanout.stage("weekly"), fanout.filters, fanout.partition
+    ('weekly-pl', {'country': ['pl']}, {'country': 'pl'})
+    >>> fanout.path(Path("news-state")).as_posix()
+    'news-state/country=pl'
+    >>> fanout = Fanout()
+    >>> fanout.stage("weekly"), fanout.filters, fanout.partition
+    ('weekly', {}, None)
+    """
+
+    country: str | None = None
+
+    @classmethod
+    def from_argv(cls, argv: Sequence[str] | None = None) -> Self:
+        """Get country from command line arguments of a stage script.
+
+        ``argv`` defaults to arguments of the script, which are ignored in
+        interactive (Jupyter) sessions running cells of the script.
+        """
+        if argv is None:
+            argv = [] if "ipykernel" in sys.modules else sys.argv[1:]
+        parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+        parser.add_argument(
+            "country", nargs="?", default=None, help="country to process (all by default)"
+        )
+        return cls(parser.parse_args(argv).country)
+
+    def stage(self, name: str) -> str:
+        """Get name of the stage run (and of its metrics file)."""
+        return name if self.country is None else f"{name}-{self.country}"
+
+    @property
+    def filters(self) -> dict[str, list[str]]:
+        """Get row filters of inputs for :func:`project.io.scan`."""
+        return {} if self.country is None else {"country": [self.country]}
+
+    @property
+    def partition(self) -> dict[str, Any] | None:
+        """Get partition of outputs for :func:`project.io.write`."""
+        return None if self.country is None else {"country": self.country}
+
+    def path(self, path: Path) -> Path:
+        """Get path of the part of a (partitioned) output of the run."""
+        return path if self.country is None else path / f"country={self.country}"
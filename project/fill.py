@@ -0,0 +1,102 @@
+"""Vectorized grouped forward/backward filling.
+
+:func:`grouped_fill` is a drop-in replacement for patterns like
+``df.groupby(by).apply(lambda g: g.ffill(limit=...).bfill(limit=...))``. Instead
+of materializing one data frame per group it (optionally) sorts the frame once
+and fills all columns with a single grouped pass over integer group codes in each
+direction, so the cost does not depend on the number of groups.
+"""
+
+from collections.abc import Hashable, Sequence
+from typing import Literal
+
+import numpy as np
+import pandas as pd
+
+__all__ = ("grouped_fill",)
+
+Direction = Literal["forward", "backward", "both"]
+
+
+def grouped_fill(
+    df: pd.DataFrame,
+    by: Hashable | Sequence[Hashable],
+    columns: Hashable | Sequence[Hashable] | None = None,
+    *,
+    direction: Direction = "forward",
+    limit: int | None = None,
+    sort_by: Hashable | Sequence[Hashable] | None = None,
+) -> pd.DataFrame:
+    """Fill missing values within groups.
+
+    Parameters
+    ----------
+    df
+        Data frame to fill. It is not modified.
+    by
+        Column(s) defining groups. Values are never propagated between groups.
+    columns
+        Column(s) to fill. Defaults to all columns not used in ``by`` and ``sort_by``.
+    direction
+        Fill forward, backward or forward and then backward
+        (as ``ffill(limit=limit).bfill(limit=limit)``).
+    limit
+        Maximum number of consecutive missing values filled in each direction.
+    sort_by
+        Column(s) defining the order of rows within groups.
+        The current row order is used by default.
+
+    Returns
+    -------
+    Copy of ``df`` with filled columns, in the original row order.
+
+    Examples
+    --------
+    >>> df = pd.DataFrame({
+    ...     "g": ["a", "a", "a", "b", "b"],
+    ...     "x": [1.0, None, None, None, 2.0],
+    ... })
+    >>> grouped_fill(df, "g", limit=1)["x"].tolist()
+    [1.0, 1.0, nan, nan, 2.0]
+    >>> grouped_fill(df, "g", direction="both")["x"].tolist()
+    [1.0, 1.0, 1.0, 2.0, 2.0]
+    """
+    by = _aslist(by)
+    sort_by = _aslist(sort_by)
+    if columns is None:
+        columns = [c for c in df.columns if c not in {*by, *sort_by}]
+    columns = _aslist(columns)
+
+    # Rows are visited once per direction by cythonized grouped fills over integer
+    # group codes; ordering columns only require a single stable sort up front.
+    codes = df.groupby(by, sort=False, dropna=False).ngroup().to_numpy()
+    order = None
+    if sort_by:
+        keys = pd.DataFrame({i: df[c].array for i, c in enumerate(sort_by, start=1)})
+        keys.insert(0, 0, codes)
+        order = keys.sort_values(list(keys.columns), kind="stable").index.to_numpy()
+        codes = codes[order]
+
+    values = df[columns] if order is None else df[columns].iloc[order]
+    if direction in ("forward", "both"):
+        values = values.groupby(codes, sort=False).ffill(limit=limit)
+    if direction in ("backward", "both"):
+        values = values.groupby(codes, sort=False).bfill(limit=limit)
+    if order is not None:
+        values = values.iloc[np.argsort(order)]
+
+    out = df.copy()
+    for c in columns:
+        out[c] = values[c].array
+    return out
+
+
+# Internals --------------------------------------------------------------------------
+
+
+def _aslist(x) -> list:
+    if x is None:
+        return []
+    if isinstance(x, str) or not isinstance(x, Sequence):
+        return [x]
+    return list(x)
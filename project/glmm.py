@@ -0,0 +1,185 @@
+"""Predictions of negative binomial GLMMs exported from R.
+
+``stages/glmm_export.R`` writes fixed effects and conditional modes (BLUPs) of
+random effects of the conditional and dispersion models of a fitted glmmTMB
+``nbinom2`` model to Parquet files. :class:`NB2Model` computes the same
+predictions as ``predict(glmm, newdata, allow.new.levels = TRUE)`` in R as sums
+of products of design columns and coefficients. Design matrices are never
+materialized (random effects are looked up by levels of grouping factors), so
+memory use is a few vectors of the length of the data, which can be processed in
+chunks of any size and in parallel.
+
+Design columns are derived from terms of coefficients in the same way as by R
+with treatment contrasts: ``(Intercept)`` is a column of ones, a term equal to
+a column name is the (numeric) column and other terms are indicators of levels
+of categorical columns (e.g. ``qualityhigh`` is ``quality == "high"``). Levels of
+grouping factors of interactions (e.g. ``country:name``) are values of their
+columns joined with ``:``.
+"""
+
+from collections.abc import Mapping
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Self
+
+import numpy as np
+import pandas as pd
+
+__all__ = ("NB2Model",)
+
+COMPONENTS = ("cond", "disp")
+
+
+@dataclass(frozen=True)
+class NB2Model:
+    """Negative binomial (``nbinom2``) GLMM with log links of means and dispersions.
+
+    Attributes
+    ----------
+    fixed
+        Fixed effects of model components (``cond`` and ``disp``) indexed by terms.
+    random
+        Conditional modes of random effects of model components by grouping
+        factors (e.g. ``country:name``), indexed by levels with columns of terms.
+
+    Examples
+    --------
+    >>> fixed = pd.DataFrame({
+    ...     "model": ["cond", "cond", "disp"],
+    ...     "term": ["(Intercept)", "qualityhigh", "(Intercept)"],
+    ...     "estimate": [1.0, 0.5, 0.0],
+    ... })
+    >>> random = pd.DataFrame({
+    ...     "model": "cond", "group": "country:name",
+    ...     "level": ["us:a", "us:b"], "term": "(Intercept)", "estimate": [0.1, -0.1],
+    ... })
+    >>> model = NB2Model.from_frames(fixed, random)
+    >>> df = pd.DataFrame({
+    ...     "country": "us", "name": ["a", "b", "c"], "quality": ["high", "low", "low"],
+    ... })
+    >>> model.predict(df)["link"].round(2).tolist()
+    [1.6, 0.9, 1.0]
+    """
+
+    fixed: Mapping[str, pd.Series]
+    random: Mapping[str, Mapping[str, pd.DataFrame]]
+
+    @classmethod
+    def from_frames(cls, fixed: pd.DataFrame, random: pd.DataFrame) -> Self:
+        """Make model from frames of coefficients.
+
+        Parameters
+        ----------
+        fixed
+            Fixed effects with ``model`` (component), ``term`` and ``estimate``
+            columns.
+        random
+            Conditional modes of random effects with ``model``, ``group``
+            (grouping factor), ``level``, ``term`` and ``estimate`` columns.
+        """
+        return cls(
+            {
+                model: fixed.loc[fixed["model"] == model].set_index("term")["estimate"]
+                for model in COMPONENTS
+            },
+            {
+                model: {
+                    str(group): df.pivot(index="level", columns="term", values="estimate")
+                    for group, df in random[random["model"] == model].groupby(
+                        "group", observed=True
+                    )
+                }
+                for model in COMPONENTS
+            },
+        )
+
+    @classmethod
+    def read(cls, path: str | Path) -> Self:
+        """Read model exported to ``fixed.parquet`` and ``random.parquet`` in ``path``."""
+        path = Path(path)
+        return cls.from_frames(
+            pd.read_parquet(path / "fixed.parquet"),
+            pd.read_parquet(path / "random.parquet"),
+        )
+
+    def linear_predictor(self, df: pd.DataFrame, model: str = "cond") -> np.ndarray:
+        """Compute linear predictor of a model component for rows of ``df``.
+
+        Random effects of levels not present in the model are zero
+        (as with ``allow.new.levels = TRUE`` in R).
+
+        Raises
+        ------
+        KeyError
+            If a term or a grouping factor refers to columns missing from ``df``.
+        """
+        return self._linear_predictor(df, model, {})
+
+    def predict(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Predict means and dispersions for rows of ``df``.
+
+        Returns
+        -------
+        Frame with the index of ``df`` and columns ``link`` (linear predictor
+        of the conditional model), ``mu`` (mean), ``disp`` (dispersion parameter
+        ``k``) and ``var`` (variance ``mu * (1 + mu / k)``).
+        """
+        columns: dict[str, np.ndarray] = {}
+        link = self._linear_predictor(df, "cond", columns)
+        disp = np.exp(self._linear_predictor(df, "disp", columns))
+        mu = np.exp(link)
+        return pd.DataFrame(
+            {"link": link, "mu": mu, "disp": disp, "var": mu * (1 + mu / disp)},
+            index=df.index,
+        )
+
+    # Internals ----------------------------------------------------------------------
+
+    def _linear_predictor(
+        self, df: pd.DataFrame, model: str, columns: dict[str, np.ndarray]
+    ) -> np.ndarray:
+        # Design columns are cached in 'columns', so they are computed once for
+        # all model components.
+        def column(term: str) -> np.ndarray:
+            if term not in columns:
+                columns[term] = _design_column(df, term)
+            return columns[term]
+
+        eta = np.zeros(len(df))
+        for term, beta in self.fixed[model].items():
+            eta += beta * column(str(term))
+        for group, modes in self.random[model].items():
+            idx = _level_index(df, group, modes.index)
+            for term in modes.columns:
+                # Index -1 (a new level) picks the appended zero.
+                b = np.append(modes[term].fillna(0).to_numpy(dtype=np.float64), 0.0)
+                eta += b[idx] * column(str(term))
+        return eta
+
+
+# Internals --------------------------------------------------------------------------
+
+
+def _design_column(df: pd.DataFrame, term: str) -> np.ndarray:
+    if term == "(Intercept)":
+        return np.ones(len(df))
+    if term in df.columns:
+        return df[term].to_numpy(dtype=np.float64)
+    for col in df.columns:
+        level = term.removeprefix(str(col))
+        if level != term and not pd.api.types.is_numeric_dtype(df[col]):
+            return (df[col] == level).to_numpy(dtype=np.float64)
+    errmsg = f"cannot find design column of term '{term}'"
+    raise KeyError(errmsg)
+
+
+def _level_index(df: pd.DataFrame, group: str, levels: pd.Index) -> np.ndarray:
+    # Levels are formatted only for unique combinations of values of columns.
+    cols = group.split(":")
+    missing = [c for c in cols if c not in df.columns]
+    if missing:
+        errmsg = f"cannot find columns {missing} of grouping factor '{group}'"
+        raise KeyError(errmsg)
+    codes, uniques = pd.MultiIndex.from_frame(df[cols]).factorize()
+    names = pd.Index([":".join(map(str, values)) for values in uniques])
+    return np.where(codes >= 0, levels.get_indexer(names)[codes], -1)
@@ -0,0 +1,218 @@
+"""Persistent state for incremental (append-only) ingestion of raw data.
+
+An :class:`IngestState` remembers which raw files were already processed, which
+posts they contained and enough per-post and per-outlet information to merge new
+rows into existing outputs without reprocessing the full corpus:
+
+* ``sources`` -- content digests of raw input files and of the parameters
+  used to process them;
+* ``index`` -- ``(key, digest)`` pairs of every raw post row seen so far,
+  where ``digest`` is a hash of the raw row content, so modified rows are
+  detected as well as new ones;
+* ``ledger`` -- narrow post-level table with grouping columns and engagement
+  counts, which is sufficient to recompute daily post counts and per-outlet
+  averages exactly;
+* ``outlets`` -- last known metadata of every outlet, used to forward-fill
+  metadata of appended rows.
+
+Keys in the index and the ledger are packed into ``key_hi`` and ``key_lo``
+columns (see :mod:`project.keys`) and sorted by key, so the index stored on
+disk is a sorted key index, which is loaded without sorting. Rows are looked up
+and added by packed keys as well.
+
+The state is stored as a directory with one Parquet file per table and a JSON
+file with source digests.
+"""
+
+import hashlib
+import json
+from collections.abc import Hashable, Iterable, Mapping
+from dataclasses import dataclass, field
+from functools import cache
+from pathlib import Path
+from typing import Any, Self
+
+import numpy as np
+import pandas as pd
+
+from project.keys import KEYCOLS, KeyIndex, Keys
+
+__all__ = ("IngestState", "hash_rows")
+
+
+def hash_rows(df: pd.DataFrame) -> np.ndarray:
+    """Hash content of data frame rows (ignoring the index) into ``uint64`` values."""
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+@dataclass
+class IngestState:
+    """Incremental ingestion state.
+
+    Attributes
+    ----------
+    sources
+        Mapping from source names to content digests.
+    index
+        Packed keys and row digests of all raw rows processed so far.
+    ledger
+        Packed keys and post-level grouping and aggregation columns of all
+        ingested posts.
+    outlets
+        Last known metadata per outlet.
+    """
+
+    sources: dict[str, str] = field(default_factory=dict)
+    index: pd.DataFrame = field(
+        default_factory=lambda: pd.DataFrame(
+            {c: pd.Series(dtype="uint64") for c in [*KEYCOLS, "digest"]}
+        )
+    )
+    ledger: pd.DataFrame = field(default_factory=pd.DataFrame)
+    outlets: pd.DataFrame = field(default_factory=pd.DataFrame)
+    _keys: KeyIndex | None = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def empty(self) -> bool:
+        return not self.sources
+
+    @classmethod
+    def load(cls, path: str | Path) -> Self:
+        """Load state from ``path`` or return an empty state if it does not exist."""
+        path = Path(path)
+        if not (path / "sources.json").exists():
+            return cls()
+        return cls(
+            sources=json.loads((path / "sources.json").read_text()),
+            **{
+                name: pd.read_parquet(path / f"{name}.parquet")
+                for name in ("index", "ledger", "outlets")
+            },
+        )
+
+    def save(self, path: str | Path) -> None:
+        """Save state to ``path``."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ("index", "ledger", "outlets"):
+            getattr(self, name).to_parquet(path / f"{name}.parquet", index=False)
+        (path / "sources.json").write_text(json.dumps(self.sources, indent=2))
+
+    # Sources ------------------------------------------------------------------------
+
+    @staticmethod
+    def digest(source: str | Path | Mapping[str, Any]) -> str:
+        """Compute digest of a file or a (JSON-serializable) parameter mapping."""
+        if isinstance(source, Mapping):
+            data = json.dumps(source, sort_keys=True, default=str).encode()
+            return hashlib.md5(data, usedforsecurity=False).hexdigest()
+        stat = Path(source).stat()
+        return _file_digest(Path(source).resolve(), stat.st_size, stat.st_mtime_ns)
+
+    def is_changed(self, name: str, source: str | Path | Mapping[str, Any]) -> bool:
+        """Check whether ``source`` changed since it was last recorded as ``name``."""
+        return self.sources.get(name) != self.digest(source)
+
+    def record(self, name: str, source: str | Path | Mapping[str, Any]) -> None:
+        """Record the current digest of ``source`` under ``name``."""
+        self.sources[name] = self.digest(source)
+
+    # Rows ---------------------------------------------------------------------------
+
+    def is_new(self, keys: Keys, digests: Iterable[int]) -> np.ndarray:
+        """Select rows which are not yet indexed or whose content has changed.
+
+        ``keys`` are packed keys of rows (e.g. a frame with ``key_hi`` and
+        ``key_lo`` columns; see :meth:`project.keys.KeyIndex.from_keys`).
+        """
+        digests = np.asarray(digests, dtype="uint64")
+        if self.index.empty:
+            return np.ones(len(digests), dtype=bool)
+        pos = self._indexed().get_indexer(keys)
+        previous = self.index["digest"].to_numpy()[pos]
+        return (pos < 0) | (previous != digests)
+
+    def is_indexed(self, keys: Keys) -> np.ndarray:
+        """Select rows whose keys are indexed, whatever their content."""
+        return self._indexed().isin(keys)
+
+    def add(
+        self,
+        rows: pd.DataFrame,
+        digests: Iterable[int],
+        *,
+        ledger: Iterable[Hashable],
+        outlets: Iterable[Hashable],
+        by: Hashable = "name",
+        keys: KeyIndex | None = None,
+    ) -> None:
+        """Add ingested rows to the index, ledger and outlet metadata.
+
+        Rows with keys already present in the state replace the old entries.
+
+        Parameters
+        ----------
+        rows
+            Processed rows with packed keys (``key_hi`` and ``key_lo`` columns).
+        digests
+            Raw content digests of ``rows``.
+        ledger
+            Columns of ``rows`` stored in the ledger (with packed keys).
+        outlets
+            Outlet metadata columns; last non-missing values per ``by`` group
+            are stored.
+        by
+            Outlet identifier column.
+        keys
+            Index of keys of ``rows`` (built if not given).
+        """
+        rows = rows.reset_index(drop=True)
+        if keys is None:
+            keys = KeyIndex.from_keys(rows)
+        index = rows[KEYCOLS].assign(digest=np.asarray(digests, dtype="uint64"))
+        self.index = _upsert_keys(self.index, index, keys)
+        self.ledger = _upsert_keys(self.ledger, rows[[*KEYCOLS, *ledger]], keys)
+        self._keys = None
+        outlets = [by, *outlets]
+        self.outlets = _upsert(
+            self.outlets,
+            rows[outlets].groupby(by, sort=False).last().reset_index(),
+            by,
+        )
+
+    # Internals ----------------------------------------------------------------------
+
+    def _indexed(self) -> KeyIndex:
+        # Index of keys of the index, built once until rows are added.
+        if self._keys is None:
+            self._keys = KeyIndex.from_keys(self.index)
+        return self._keys
+
+
+@cache
+def _file_digest(path: Path, size: int, mtime: int) -> str:  # noqa: ARG001
+    # Size and modification time are part of the cache key only.
+    with path.open("rb") as fh:
+        return hashlib.file_digest(fh, "md5").hexdigest()
+
+
+def _sorted(df: pd.DataFrame) -> pd.DataFrame:
+    return df.iloc[KeyIndex.from_keys(df).order].reset_index(drop=True)
+
+
+def _upsert_keys(old: pd.DataFrame, new: pd.DataFrame, keys: KeyIndex) -> pd.DataFrame:
+    # Upsert on packed keys indexed by 'keys'; the result is sorted by key. New
+    # rows are taken in the order of keys, so old and new rows are two sorted runs,
+    # which are merged without a full sort (see 'project/keys.py').
+    new = new.iloc[keys.order[~keys.duplicated(keep="last")[keys.order]]]
+    if not old.empty:
+        old = old[~keys.isin(old)]
+    return _sorted(pd.concat([old, new], ignore_index=True))
+
+
+def _upsert(old: pd.DataFrame, new: pd.DataFrame, on: Hashable) -> pd.DataFrame:
+    if old.empty:
+        return new.reset_index(drop=True)
+    return pd.concat([old[~old[on].isin(new[on])], new], ignore_index=True).drop_duplicates(
+        subset=on, keep="last", ignore_index=True
+    )
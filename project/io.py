@@ -0,0 +1,312 @@
+"""Input/output utilities for Parquet data.
+
+:func:`scan` is a thin layer on top of :meth:`newsuse.data.DataFrame.from_`
+which pushes column selection (projection) and row filters (predicates) down
+into the Parquet scan. Arrow then reads only the requested column chunks and
+skips row groups whose statistics exclude the filter values, so rows and columns
+discarded by a stage are never materialized in memory. Column types declared
+for the file in :mod:`project.schema` are applied on read, and :func:`write`
+applies them before writing.
+
+Files with a layout declared in :data:`project.schema.LAYOUTS` are written by
+:func:`write` as hive-partitioned datasets sorted within partitions. Both
+single files and partitioned datasets are read by :func:`scan`, which prunes
+whole partitions with filters on partition columns (e.g. ``year``) and row
+groups with filters on other columns. Stages declare the time range they need
+with ``period``, which becomes filters on ``timestamp`` and ``year``.
+
+:func:`read_many` reads several sources concurrently through a thread pool.
+Decoding happens in Arrow, which releases the GIL and decodes column chunks on
+its own thread pool, so I/O and decoding of different files overlap. The total
+size of files being read at the same time is capped to bound peak memory.
+"""
+
+import logging
+import shutil
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Hashable, Iterable, Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date
+from pathlib import Path
+from typing import Any, TypeVar
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from newsuse.data import DataFrame
+
+from project.schema import CATEGORY, Layout, apply_schema, get_layout, get_schema
+
+__all__ = ("read_many", "scan", "write")
+
+K = TypeVar("K", bound=Hashable)
+
+logger = logging.getLogger(__name__)
+
+
+def scan(
+    path: str | Path,
+    *,
+    columns: Iterable[str] | None = None,
+    exclude: Iterable[str] = (),
+    filters: Mapping[str, Iterable[Any]] | None = None,
+    period: tuple[str | date, str | date] | None = None,
+    **kwds: Any,
+) -> DataFrame:
+    """Read a Parquet file or dataset with projection and predicate pushdown.
+
+    Parameters
+    ----------
+    path
+        Path to a Parquet file or a hive-partitioned dataset.
+    columns
+        Columns to read. Columns not present in the file are ignored,
+        so the same list (e.g. ``data.usecols`` from ``params.yaml``) can be
+        used for files with different schemas. All columns are read by default.
+        Columns are returned in the file order.
+    exclude
+        Columns not to read.
+    filters
+        Mapping from column names to allowed values. Rows are kept only if
+        values in all columns are among the allowed ones.
+    period
+        First and last day of posts to read. Rows are kept only if their
+        ``timestamp`` is within the period, and partitions of other years
+        are skipped.
+    **kwds
+        Passed to :meth:`newsuse.data.DataFrame.from_`.
+        Categorical columns of the schema of the file are read as dictionaries
+        (``read_dictionary``) unless given.
+
+    Raises
+    ------
+    KeyError
+        If a filter refers to a column not present in the file.
+    """
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    schema = _column_names(dataset.schema)
+    if columns is not None:
+        columns = set(columns)
+    exclude = set(exclude)
+    columns = [c for c in schema if (columns is None or c in columns) and c not in exclude]
+    predicates = []
+    for col, values in (filters or {}).items():
+        if col not in schema:
+            errmsg = f"cannot filter '{path}' on missing column '{col}'"
+            raise KeyError(errmsg)
+        predicates.append((col, "in", list(values)))
+    if period is not None:
+        if "timestamp" not in schema:
+            errmsg = f"cannot filter '{path}' by period without 'timestamp' column"
+            raise KeyError(errmsg)
+        predicates.extend(_period_predicates(dataset.schema, *period))
+    # Partition columns are not stored in files, so they cannot be read as dictionaries.
+    partitions = dataset.partitioning.schema.names if dataset.partitioning else []
+    dtypes = get_schema(path)
+    kwds.setdefault(
+        "read_dictionary",
+        [c for c in columns if dtypes.get(c) == CATEGORY and c not in partitions] or None,
+    )
+    df = DataFrame.from_(path, columns=columns, filters=predicates or None, **kwds)
+    if df.columns.tolist() != columns:
+        # Partition columns are read after columns stored in files.
+        df = df[columns]
+    return DataFrame(apply_schema(df, dtypes))
+
+
+def write(
+    df: pd.DataFrame, path: str | Path, *, partition: Mapping[str, Any] | None = None
+) -> DataFrame:
+    """Write data frame to a Parquet file with its schema applied.
+
+    Files with a declared layout (see :data:`project.schema.LAYOUTS`) are written
+    as hive-partitioned datasets replacing previous files or datasets on ``path``.
+
+    Parameters
+    ----------
+    df
+        Data frame to write.
+    path
+        Path to a Parquet file or a partitioned dataset.
+    partition
+        Values of leading partition columns of a partitioned dataset
+        (e.g. ``{"country": "us"}``). Only this partition is replaced and
+        other partitions of the dataset are kept.
+
+    Returns
+    -------
+    Written data frame (with the schema of the file).
+
+    Raises
+    ------
+    ValueError
+        If ``partition`` is given for a file without a layout, does not match
+        leading partition columns of the layout or some rows of ``df``.
+    """
+    df = DataFrame(apply_schema(df, get_schema(path)))
+    layout = get_layout(path)
+    if layout is None:
+        if partition:
+            errmsg = f"cannot write partition of '{path}' without a declared layout"
+            raise ValueError(errmsg)
+        df.to_(path)
+    else:
+        _write_dataset(df, Path(path), layout, partition or {})
+    return df
+
+
+def read_many(
+    sources: Mapping[K, str | Path],
+    reader: Callable[..., DataFrame] = scan,
+    *,
+    options: Mapping[K, Mapping[str, Any]] | None = None,
+    max_workers: int | None = None,
+    max_bytes: int | None = None,
+) -> dict[K, DataFrame]:
+    """Read multiple sources concurrently.
+
+    Parameters
+    ----------
+    sources
+        Mapping from arbitrary keys to file paths.
+    reader
+        Function called as ``reader(path, **options[key])``.
+    options
+        Optional keyword arguments for ``reader`` per source key.
+    max_workers
+        Maximum number of sources read at the same time.
+        Defaults to the :class:`~concurrent.futures.ThreadPoolExecutor` default.
+    max_bytes
+        Maximum total size (on disk) of sources read at the same time.
+        A source larger than the limit is read alone. No limit by default.
+
+    Returns
+    -------
+    Mapping from source keys to data frames, in the order of ``sources``.
+    Per-source read times are logged at the ``INFO`` level.
+    """
+    options = options or {}
+    budget = _ByteBudget(max_bytes)
+
+    def read(key: K, path: Path) -> DataFrame:
+        size = _size(path)
+        with budget(size):
+            start = time.perf_counter()
+            df = reader(path, **options.get(key, {}))
+            elapsed = time.perf_counter() - start
+        logger.info(
+            "read '%s' (%.1f MB, %d rows) in %.2fs",
+            path.name,
+            size / 2**20,
+            len(df),
+            elapsed,
+        )
+        return df
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {k: pool.submit(read, k, Path(p)) for k, p in sources.items()}
+        return {k: f.result() for k, f in futures.items()}
+
+
+# Internals --------------------------------------------------------------------------
+
+
+def _column_names(schema: pa.Schema) -> list[str]:
+    # Columns in the order of the written data frame (partition columns are
+    # appended to schemas of datasets).
+    names = schema.names
+    if not schema.pandas_metadata:
+        return names
+    order = {c["name"]: i for i, c in enumerate(schema.pandas_metadata["columns"])}
+    return sorted(names, key=lambda c: order.get(c, len(order)))
+
+
+def _period_predicates(
+    schema: pa.Schema, start: str | date, end: str | date
+) -> list[tuple[str, str, Any]]:
+    tz = getattr(schema.field("timestamp").type, "tz", None)
+    start, end = (pd.Timestamp(d).tz_localize(tz) for d in (start, end))
+    predicates = [
+        ("timestamp", ">=", start),
+        ("timestamp", "<", end + pd.Timedelta(days=1)),
+    ]
+    if "year" in schema.names:
+        predicates += [("year", ">=", start.year), ("year", "<=", end.year)]
+    return predicates
+
+
+def _write_dataset(
+    df: pd.DataFrame, path: Path, layout: Layout, partition: Mapping[str, Any]
+) -> None:
+    # Partition columns missing from data (e.g. 'country' of signals not grouped
+    # by country) are skipped.
+    partition_by = [c for c in layout.partition_by if c in df.columns]
+    if list(partition) != partition_by[: len(partition)]:
+        errmsg = f"{list(partition)} are not leading partition columns of '{path}'"
+        raise ValueError(errmsg)
+    for col, value in partition.items():
+        if not df[col].astype(str).eq(str(value)).all():
+            errmsg = f"some rows do not belong to partition {col}={value} of '{path}'"
+            raise ValueError(errmsg)
+    keys = [*partition_by, *(c for c in layout.sort_by if c in df.columns)]
+    table = pa.Table.from_pandas(
+        df.sort_values(keys, kind="stable", ignore_index=True), preserve_index=False
+    )
+    # Write next to the target first, so readers never see partial datasets.
+    # Partitions are written with all partition columns, so schemas of their
+    # files are the same as of files of whole datasets.
+    tmp = Path(tempfile.mkdtemp(prefix=f".{path.name}.", dir=path.parent))
+    ds.write_dataset(
+        table,
+        tmp / "data",
+        format="parquet",
+        partitioning=partition_by,
+        partitioning_flavor="hive",
+        basename_template="part-{i}.parquet",
+        min_rows_per_group=layout.row_group_size,
+        max_rows_per_group=layout.row_group_size,
+        preserve_order=True,
+        file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+    )
+    subdir = [f"{k}={v}" for k, v in partition.items()]
+    source, target = tmp.joinpath("data", *subdir), path.joinpath(*subdir)
+    if path.is_file():
+        path.unlink()
+    elif target.is_dir():
+        shutil.rmtree(target)
+    if source.exists():
+        target.parent.mkdir(parents=True, exist_ok=True)
+        source.rename(target)
+    shutil.rmtree(tmp)
+
+
+def _size(path: Path) -> int:
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size
+
+
+class _ByteBudget:
+    # Counting semaphore over bytes. A reservation larger than the limit is granted
+    # once nothing else is reserved, so oversized sources are read alone.
+
+    def __init__(self, limit: int | None) -> None:
+        self.limit = limit
+        self.used = 0
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def __call__(self, size: int) -> Iterator[None]:
+        with self.cond:
+            if self.limit is not None:
+                self.cond.wait_for(lambda: not self.used or self.used + size <= self.limit)
+            self.used += size
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.used -= size
+                self.cond.notify_all()
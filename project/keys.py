@@ -0,0 +1,583 @@
+"""Batch construction of deterministic post keys.
+
+Post keys have the form ``sotrender@{hash}``, where the hash was historically
+computed with :func:`joblib.hash` called once per row. :func:`hash_keys` produces
+the same digests for whole string columns at once: values are moved into Arrow
+buffers, split into chunks and hashed in a pool of worker processes.
+
+In compatibility mode (the default) the digest of a string is the MD5 of its
+protocol 3 pickle, which is exactly what :func:`joblib.hash` computes, so keys
+stay stable across runs and existing joins on ``key`` remain valid. Without
+compatibility mode strings are hashed directly with BLAKE2b (128-bit digests),
+which is faster but yields keys that differ from the historical ones.
+
+Digests of keys are 128-bit values, so :func:`pack_keys` stores them as two
+``uint64`` halves (``key_hi`` and ``key_lo``) instead of 42-character strings,
+and :func:`hash_packed` hashes strings into packed keys directly. Keys not of
+the form ``sotrender@{hash}`` are packed as their BLAKE2b digests.
+Deduplication, uniqueness checks and lookups of keys run on packed keys with a
+:class:`KeyIndex`, which sorts them once and answers queries by binary search.
+Stages carry packed keys in their frames and :class:`KeyCodec` turns them back
+into strings (restoring keys which are not digests) where they are written out.
+"""
+
+import hashlib
+import struct
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import Literal, Self
+
+import joblib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+__all__ = (
+    "KEYCOLS",
+    "KeyCodec",
+    "KeyIndex",
+    "hash_keys",
+    "hash_packed",
+    "pack_keys",
+    "unpack_keys",
+)
+
+Keys = (
+    Iterable[str]
+    | pd.Series
+    | np.ndarray
+    | pa.Array
+    | pa.ChunkedArray
+    | pd.DataFrame
+    | tuple[np.ndarray, np.ndarray]
+)
+
+PREFIX = "sotrender@"
+KEYCOLS = ["key_hi", "key_lo"]
+
+# Protocol 3 pickle of a 'str' object: PROTO 3, BINUNICODE opcode with a 4-byte
+# little-endian length, UTF-8 payload and STOP. 'joblib.Hasher' disables
+# memoization of strings, so no BINPUT opcode is emitted.
+_PICKLE_PROTO = b"\x80\x03X"
+_PICKLE_STOP = b"."
+
+
+def hash_keys(
+    values: Iterable[str] | pd.Series | np.ndarray | pa.Array | pa.ChunkedArray,
+    *,
+    compat: bool = True,
+    n_jobs: int | None = -1,
+    chunksize: int = 250_000,
+) -> np.ndarray:
+    """Hash a column of strings into 32-character hexadecimal digests.
+
+    Parameters
+    ----------
+    values
+        String column to hash. Missing values and non-string objects are hashed
+        with :func:`joblib.hash` as they would be by ``Series.map(joblib.hash)``.
+    compat
+        Reproduce :func:`joblib.hash` digests exactly.
+        If ``False``, BLAKE2b digests of the UTF-8 encoded strings are used.
+    n_jobs
+        Number of worker processes passed to :class:`joblib.Parallel`.
+        Inputs shorter than ``chunksize`` are always hashed in the main process.
+    chunksize
+        Number of values hashed by a single task.
+
+    Returns
+    -------
+    Object array of hexadecimal digests aligned with ``values``.
+
+    Examples
+    --------
+    >>> hash_keys(["a", "b"], n_jobs=1).tolist() == [joblib.hash("a"), joblib.hash("b")]
+    True
+    >>> len(hash_keys(["a"], compat=False)[0])
+    32
+    """
+    return _hash(values, compat, n_jobs, chunksize, packed=False)
+
+
+def hash_packed(
+    values: Iterable[str] | pd.Series | np.ndarray | pa.Array | pa.ChunkedArray,
+    *,
+    compat: bool = True,
+    n_jobs: int | None = -1,
+    chunksize: int = 250_000,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Hash a column of strings into packed keys.
+
+    Same as packing keys ``sotrender@{hash}`` with digests of :func:`hash_keys`,
+    but digests are packed as they are computed, without formatting and parsing
+    hexadecimal strings. Parameters are those of :func:`hash_keys`.
+
+    Returns
+    -------
+    High and low 64 bits of the keys (``key_hi`` and ``key_lo``).
+
+    Examples
+    --------
+    >>> hi, lo = hash_packed(["a", None], n_jobs=1)
+    >>> unpack_keys(hi, lo).tolist() == (PREFIX + hash_keys(["a", None], n_jobs=1)).tolist()
+    True
+    """
+    halves = _hash(values, compat, n_jobs, chunksize, packed=True)
+    return halves[:, 0].copy(), halves[:, 1].copy()
+
+
+def pack_keys(
+    keys: Iterable[str] | pd.Series | np.ndarray | pa.Array | pa.ChunkedArray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Pack string keys into pairs of ``uint64`` values.
+
+    Hexadecimal digests of keys ``sotrender@{hash}`` are parsed, so
+    :func:`unpack_keys` restores such keys exactly. Other keys are packed as
+    BLAKE2b digests of their UTF-8 encodings.
+
+    Returns
+    -------
+    High and low 64 bits of the keys (``key_hi`` and ``key_lo``). Their
+    lexicographic order is the order of hexadecimal digests.
+
+    Raises
+    ------
+    ValueError
+        If some keys are missing.
+
+    Examples
+    --------
+    >>> hi, lo = pack_keys(["sotrender@" + "0" * 31 + "f", "sotrender@" + "f" * 32])
+    >>> hi.tolist(), lo.tolist()
+    ([0, 18446744073709551615], [15, 18446744073709551615])
+    >>> unpack_keys(*pack_keys(["sotrender@" + "ab" * 16]))[0] == "sotrender@" + "ab" * 16
+    True
+    """
+    halves, _ = _pack(_as_strings(keys))
+    return halves[:, 0].copy(), halves[:, 1].copy()
+
+
+def unpack_keys(
+    hi: np.ndarray | pd.Series, lo: np.ndarray | pd.Series, *, prefix: str = PREFIX
+) -> np.ndarray:
+    """Format packed keys as strings ``{prefix}{hash}``.
+
+    Returns
+    -------
+    Object array of keys.
+    """
+    return _format(hi, lo, prefix).to_numpy(zero_copy_only=False)
+
+
+@dataclass
+class KeyCodec:
+    """Replace string keys of data frames with packed keys and back.
+
+    Keys which are not digests (see :func:`pack_keys`) cannot be restored from
+    packed keys, so they are remembered when they are packed and restored by
+    :meth:`unpack`.
+
+    Attributes
+    ----------
+    aliases
+        Packed keys (``key_hi`` and ``key_lo``) and strings (``key``) of packed
+        keys which are not digests.
+
+    Examples
+    --------
+    >>> codec = KeyCodec()
+    >>> keys = ["sotrender@" + "ab" * 16, "sotrender@x"]
+    >>> df = codec.pack(pd.DataFrame({"key": keys, "x": [1, 2]}))
+    >>> df.columns.tolist(), len(codec.aliases)
+    (['key_hi', 'key_lo', 'x'], 1)
+    >>> codec.unpack(df)["key"].tolist() == keys
+    True
+    >>> codec.unpack(df, dtype="string[pyarrow]")["key"].tolist() == keys
+    True
+    """
+
+    aliases: pd.DataFrame = field(
+        default_factory=lambda: pd.DataFrame(
+            {"key_hi": [], "key_lo": [], "key": []}
+        ).astype({"key_hi": "uint64", "key_lo": "uint64", "key": object})
+    )
+
+    def pack(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Replace the ``key`` column of ``df`` with ``key_hi`` and ``key_lo``."""
+        strings = _as_strings(df["key"])
+        halves, valid = _pack(strings)
+        if valid is not None:
+            other = pd.DataFrame(halves[~valid], columns=KEYCOLS).assign(
+                key=strings.filter(~valid).to_numpy(zero_copy_only=False)
+            )
+            self.aliases = pd.concat([self.aliases, other], ignore_index=True)
+        return _replace(df, ["key"], dict(zip(KEYCOLS, halves.T.copy(), strict=True)))
+
+    def unpack(self, df: pd.DataFrame, *, dtype: str = "object") -> pd.DataFrame:
+        """Replace ``key_hi`` and ``key_lo`` columns of ``df`` with ``key``.
+
+        Parameters
+        ----------
+        df
+            Data frame with packed keys.
+        dtype
+            Type of the ``key`` column. Keys of type ``"string[pyarrow]"`` are
+            kept in Arrow buffers instead of Python strings.
+        """
+        hi, lo = df["key_hi"].to_numpy(), df["key_lo"].to_numpy()
+        keys = _format(hi, lo, PREFIX)
+        if not self.aliases.empty:
+            pos = KeyIndex.from_keys(self.aliases).get_indexer((hi, lo))
+            found = pos >= 0
+            aliases = self.aliases["key"].to_numpy()[pos[found]]
+            keys = pc.replace_with_mask(
+                keys, pa.array(found), pa.array(aliases, pa.large_string())
+            )
+        if dtype == "object":
+            keys = keys.to_numpy(zero_copy_only=False)
+        else:
+            keys = pd.array(keys, dtype=dtype)
+        return _replace(df, KEYCOLS, {"key": keys})
+
+
+@dataclass(frozen=True)
+class KeyIndex:
+    """Sorted index of packed keys.
+
+    Attributes
+    ----------
+    hi, lo
+        Packed keys in lexicographic order.
+    order
+        Positions of sorted keys among the indexed keys
+        (stable, so equal keys are in the order of their positions).
+
+    Examples
+    --------
+    >>> keys = ["sotrender@" + c * 32 for c in "cabc"]
+    >>> index = KeyIndex.from_keys(keys)
+    >>> index.is_unique
+    False
+    >>> index.duplicated().tolist(), index.duplicated(keep="last").tolist()
+    ([False, False, False, True], [True, False, False, False])
+    >>> unique = KeyIndex.from_keys(keys[1:])
+    >>> unique.get_indexer(["sotrender@" + c * 32 for c in "cde"]).tolist()
+    [2, -1, -1]
+    >>> unique.isin(keys).tolist()
+    [True, True, True, True]
+    """
+
+    hi: np.ndarray
+    lo: np.ndarray
+    order: np.ndarray
+
+    @classmethod
+    def from_keys(cls, keys: Keys) -> Self:
+        """Index keys.
+
+        Parameters
+        ----------
+        keys
+            String keys, packed keys as a ``(key_hi, key_lo)`` pair or a frame
+            with ``key_hi`` and ``key_lo`` columns (e.g. :meth:`to_frame`).
+            Packed keys which are already sorted are not sorted again.
+        """
+        hi, lo = _packed(keys)
+        order = _argsort(hi, lo)
+        return cls(hi[order], lo[order], order)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    @property
+    def is_unique(self) -> bool:
+        """Check whether keys are unique."""
+        return not self._repeated().any()
+
+    def duplicated(self, keep: Literal["first", "last"] = "first") -> np.ndarray:
+        """Mark repeated keys (as :meth:`pandas.Series.duplicated`).
+
+        Returns
+        -------
+        Mask of indexed keys, in the order of their positions.
+        """
+        repeated = self._repeated()
+        sorted_mask = np.zeros(len(self), dtype=bool)
+        if keep == "first":
+            sorted_mask[1:] = repeated
+        else:
+            sorted_mask[:-1] = repeated
+        mask = np.empty(len(self), dtype=bool)
+        mask[self.order] = sorted_mask
+        return mask
+
+    def get_indexer(self, keys: Keys) -> np.ndarray:
+        """Find positions of keys among the indexed keys.
+
+        Returns
+        -------
+        Positions of the first occurrences of ``keys`` or ``-1`` for keys not
+        in the index.
+        """
+        hi, lo = _packed(keys)
+        if not len(self):
+            return np.full(len(hi), -1, dtype=np.int64)
+        # Keys are searched in sorted order, which accesses the index sequentially
+        # and is several times faster for many keys.
+        sort = np.argsort(hi)
+        hi, lo = hi[sort], lo[sort]
+        left = np.searchsorted(self.hi, hi, side="left")
+        right = np.searchsorted(self.hi, hi, side="right")
+        pos = np.minimum(left, len(self) - 1)
+        found = (right > left) & (self.lo[pos] == lo)
+        # Distinct keys with equal high bits are practically absent from hashed
+        # keys, so runs of equal high bits (repeated keys) are searched one by one.
+        for i in np.flatnonzero(right - left > 1):
+            j = left[i] + np.searchsorted(self.lo[left[i] : right[i]], lo[i])
+            pos[i] = j = min(j, right[i] - 1)
+            found[i] = self.lo[j] == lo[i]
+        indexer = np.empty(len(hi), dtype=np.int64)
+        indexer[sort] = np.where(found, self.order[pos], -1)
+        return indexer
+
+    def isin(self, keys: Keys) -> np.ndarray:
+        """Check which of ``keys`` are in the index."""
+        return self.get_indexer(keys) >= 0
+
+    def take(self, positions: np.ndarray | pd.Index) -> Self:
+        """Index keys at ``positions`` without sorting them again.
+
+        Parameters
+        ----------
+        positions
+            Distinct positions of indexed keys, e.g. the index of rows left after
+            filtering and sorting a frame with a default index. Keys are indexed
+            at their positions in ``positions``.
+
+        Examples
+        --------
+        >>> index = KeyIndex.from_keys(["sotrender@" + c * 32 for c in "cab"])
+        >>> index.take([2, 0]).get_indexer(["sotrender@" + c * 32 for c in "abc"]).tolist()
+        [-1, 0, 1]
+        """
+        rank = np.full(len(self), -1, dtype=np.int64)
+        rank[np.asarray(positions)] = np.arange(len(positions))
+        rank = rank[self.order]
+        kept = rank >= 0
+        hi, lo, order = self.hi[kept], self.lo[kept], rank[kept]
+        # Equal keys are ordered by their new positions.
+        tied = np.zeros(len(order), dtype=bool)
+        tied[1:] = (hi[1:] == hi[:-1]) & (lo[1:] == lo[:-1])
+        tied[:-1] |= tied[1:]
+        if tied.any():
+            sub = np.flatnonzero(tied)
+            order[sub] = order[sub][np.lexsort((order[sub], lo[sub], hi[sub]))]
+        return type(self)(hi, lo, order)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Get sorted packed keys as ``key_hi`` and ``key_lo`` columns."""
+        return pd.DataFrame({"key_hi": self.hi, "key_lo": self.lo})
+
+    # Internals ----------------------------------------------------------------------
+
+    def _repeated(self) -> np.ndarray:
+        # Whether sorted keys are equal to the next ones.
+        return (self.hi[1:] == self.hi[:-1]) & (self.lo[1:] == self.lo[:-1])
+
+
+# Internals --------------------------------------------------------------------------
+
+_HEXDIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+_PREFIX = np.frombuffer(PREFIX.encode(), dtype=np.uint8)
+# Maximum number of sorted runs of keys merged by the stable sort.
+_MAX_RUNS = 16
+
+
+def _packed(keys: Keys) -> tuple[np.ndarray, np.ndarray]:
+    if isinstance(keys, pd.DataFrame):
+        keys = keys["key_hi"], keys["key_lo"]
+    if isinstance(keys, tuple):
+        return tuple(np.asarray(k, dtype=np.uint64) for k in keys)
+    return pack_keys(keys)
+
+
+def _argsort(hi: np.ndarray, lo: np.ndarray) -> np.ndarray:
+    # Keys are sorted by their high bits and only runs of equal high bits (e.g.
+    # repeated keys) are sorted further, which is much faster than 'lexsort'.
+    # Concatenations of a few sorted runs (e.g. upserts of sorted keys) are
+    # merged by the stable sort (timsort) in linear time.
+    runs = np.count_nonzero(hi[1:] < hi[:-1]) + 1
+    if runs == 1:
+        order = np.arange(len(hi))
+    else:
+        order = np.argsort(hi, kind="stable" if runs <= _MAX_RUNS else None)
+    hs, ls = hi[order], lo[order]
+    tied = np.zeros(len(hi), dtype=bool)
+    tied[1:] = hs[1:] == hs[:-1]
+    tied[:-1] |= tied[1:]
+    if tied.any():
+        sub = np.flatnonzero(tied)
+        order[sub] = order[sub][np.lexsort((order[sub], ls[sub], hs[sub]))]
+    return order
+
+
+def _pack(strings: pa.LargeStringArray) -> tuple[np.ndarray, np.ndarray | None]:
+    # Packed keys as rows of a matrix and mask of keys which are digests
+    # (or None if all keys are digests).
+    if strings.null_count:
+        errmsg = f"cannot pack {strings.null_count} missing keys"
+        raise ValueError(errmsg)
+    width = len(PREFIX) + 32
+    lengths = pc.binary_length(strings).to_numpy(zero_copy_only=False)
+    if (lengths == width).all():
+        # Usually all keys are digests and are parsed at once.
+        chars = _fixed_width(strings, width)
+        if (chars[:, : len(PREFIX)] == _PREFIX).all():
+            halves = _parse_hex(chars[:, len(PREFIX) :])
+            if halves is not None:
+                return halves, None
+    valid = lengths == width
+    chars = _fixed_width(strings.filter(valid), width)
+    digits = chars[:, len(PREFIX) :]
+    valid[valid] = (chars[:, : len(PREFIX)] == _PREFIX).all(axis=1) & (
+        ((digits >= ord("0")) & (digits <= ord("9")))
+        | ((digits >= ord("a")) & (digits <= ord("f")))
+    ).all(axis=1)
+    halves = np.empty((len(strings), 2), dtype=np.uint64)
+    halves[valid] = _parse_hex(digits[valid[lengths == width]])
+    halves[~valid] = _hash(strings.filter(~valid), False, 1, len(strings), packed=True)
+    return halves, valid
+
+
+def _format(hi: np.ndarray, lo: np.ndarray, prefix: str) -> pa.LargeStringArray:
+    # Packed keys formatted as strings directly into Arrow buffers.
+    halves = np.column_stack([np.asarray(hi), np.asarray(lo)]).astype(">u8")
+    octets = halves.view(np.uint8).reshape(len(halves), 16)
+    chars = np.empty((len(halves), len(prefix) + 32), dtype=np.uint8)
+    chars[:, : len(prefix)] = np.frombuffer(prefix.encode(), dtype=np.uint8)
+    chars[:, len(prefix) :: 2] = _HEXDIGITS[octets >> 4]
+    chars[:, len(prefix) + 1 :: 2] = _HEXDIGITS[octets & 15]
+    offsets = np.arange(len(chars) + 1, dtype=np.int64) * chars.shape[1]
+    return pa.Array.from_buffers(
+        pa.large_string(), len(chars), [None, pa.py_buffer(offsets), pa.py_buffer(chars)]
+    )
+
+
+def _replace(
+    df: pd.DataFrame, columns: list[str], values: dict[str, np.ndarray]
+) -> pd.DataFrame:
+    # Columns replaced by new ones at the position of the first of them. Other
+    # columns are shared with 'df' rather than copied.
+    idx = df.columns.get_loc(columns[0])
+    df = df.copy(deep=False)
+    for name in columns:
+        del df[name]
+    for i, (name, value) in enumerate(values.items()):
+        df.insert(idx + i, name, value)
+    return df
+
+
+def _as_strings(keys: Keys) -> pa.LargeStringArray:
+    if isinstance(keys, pa.ChunkedArray):
+        keys = keys.combine_chunks()
+    if not isinstance(keys, pa.Array):
+        keys = pa.array(pd.Series(keys, copy=False), from_pandas=True)
+    return keys.cast(pa.large_string())
+
+
+def _parse_hex(digits: np.ndarray) -> np.ndarray | None:
+    # Rows of 32 lowercase hexadecimal digits as pairs of 64-bit values or None
+    # if some digits are invalid. 'bytes.fromhex' rejects characters other than
+    # digits, letters and whitespace (which changes the number of parsed bytes);
+    # the remaining ones (e.g. capital letters) are between '9' and 'a'.
+    if ((digits - np.uint8(ord(":"))) < ord("a") - ord(":")).any():
+        return None
+    try:
+        octets = bytes.fromhex(np.ascontiguousarray(digits).tobytes().decode("ascii"))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if len(octets) * 2 != digits.size:
+        return None
+    return np.frombuffer(octets, dtype=">u8").reshape(-1, 2).astype(np.uint64)
+
+
+def _fixed_width(strings: pa.Array, width: int) -> np.ndarray:
+    # Characters of ASCII strings of equal lengths as rows of a matrix.
+    strings = strings.cast(pa.large_binary())
+    offsets = np.frombuffer(strings.buffers()[1], dtype=np.int64)
+    offsets = offsets[strings.offset : strings.offset + len(strings) + 1]
+    data = np.frombuffer(strings.buffers()[2] or b"", dtype=np.uint8)
+    return data[offsets[0] : offsets[-1]].reshape(len(strings), width)
+
+
+def _as_objects(values) -> np.ndarray:
+    # 'Series.map' passes elements as produced by 'astype(object)', so the exact
+    # missing value sentinel (None, NaN or pd.NA) and therefore its hash depends
+    # on the column dtype.
+    if isinstance(values, pa.Array | pa.ChunkedArray):
+        values = values.to_pandas()
+    return pd.Series(values, copy=False).astype(object).to_numpy()
+
+
+def _hash(
+    values, compat: bool, n_jobs: int | None, chunksize: int, *, packed: bool
+) -> np.ndarray:
+    # Hexadecimal digests or packed digests as rows of a matrix.
+    objs = _as_objects(values)
+    isna = pd.isna(objs)
+    if packed:
+        digests = np.empty((len(objs), 2), dtype=np.uint64)
+    else:
+        digests = np.empty(len(objs), dtype=object)
+    try:
+        strings = pa.array(objs[~isna], type=pa.large_string())
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed or non-string columns are rare; keep exact semantics.
+        digests[:] = _joblib_hash(objs, packed)
+        return digests
+
+    chunks = [strings.slice(i, chunksize) for i in range(0, len(strings), chunksize)]
+    if n_jobs == 1 or len(chunks) <= 1:
+        results = [_hash_chunk(c, compat, packed) for c in chunks]
+    else:
+        results = joblib.Parallel(n_jobs=n_jobs)(
+            joblib.delayed(_hash_chunk)(c, compat, packed) for c in chunks
+        )
+    if results:
+        digests[~isna] = np.concatenate(results)
+    digests[isna] = _joblib_hash(objs[isna], packed)
+    return digests
+
+
+def _joblib_hash(objs: np.ndarray, packed: bool) -> list[str] | np.ndarray:
+    digests = [joblib.hash(o) for o in objs]
+    return _unhex(b"".join(bytes.fromhex(d) for d in digests)) if packed else digests
+
+
+def _unhex(octets: bytes) -> np.ndarray:
+    # Concatenated 16-byte digests as pairs of 64-bit values.
+    return np.frombuffer(octets, dtype=">u8").reshape(-1, 2).astype(np.uint64)
+
+
+def _hash_chunk(strings: pa.LargeStringArray, compat: bool, packed: bool) -> np.ndarray:
+    offsets = np.frombuffer(strings.buffers()[1], dtype=np.int64)
+    offsets = offsets[strings.offset : strings.offset + len(strings) + 1].tolist()
+    data = strings.buffers()[2]
+    data = memoryview(data) if data is not None else memoryview(b"")
+    out = np.empty(len(strings), dtype=object)
+    digest = "digest" if packed else "hexdigest"
+    if compat:
+        pack = struct.Struct("<I").pack
+        md5 = hashlib.md5
+        for i, (start, stop) in enumerate(zip(offsets[:-1], offsets[1:], strict=True)):
+            h = md5(_PICKLE_PROTO, usedforsecurity=False)
+            h.update(pack(stop - start))
+            h.update(data[start:stop])
+            h.update(_PICKLE_STOP)
+            out[i] = getattr(h, digest)()
+    else:
+        blake2b = hashlib.blake2b
+        for i, (start, stop) in enumerate(zip(offsets[:-1], offsets[1:], strict=True)):
+            out[i] = getattr(blake2b(data[start:stop], digest_size=16), digest)()
+    return _unhex(b"".join(out)) if packed else out
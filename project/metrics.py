@@ -0,0 +1,253 @@
+"""Performance metrics of pipeline stages.
+
+A :class:`StageMetrics` object records wall time, CPU time (including finished
+child processes, e.g. workers of process pools), peak resident set size and
+numbers of rows and bytes read and written for named sections of a stage. Stage
+scripts start a section at the top of each ``# %%`` cell, so sections need no
+indentation and cells can still be run one by one::
+
+    metrics = StageMetrics("signal")
+
+    # %% ----
+    metrics.section("read")
+    weekly = metrics.input(DataFrame.from_(paths.weekly), paths.weekly)
+
+    # %% ----
+    metrics.section("write")
+    metrics.output(signal, paths.signal).to_(paths.signal)
+    metrics.dump(paths.metrics)
+
+A section ends when the next one starts or when metrics are dumped.
+:meth:`StageMetrics.section` also works as a context manager and
+:meth:`StageMetrics.timed` as a function decorator. Metrics are written to
+``<stage>.json`` files declared as ``metrics`` of stages in ``dvc.yaml``, so
+``dvc metrics diff`` compares performance of stages between commits.
+
+Peak RSS of a section is measured on Linux by resetting the peak of the process
+at its start (``/proc/self/clear_refs``). Elsewhere it is the peak of the whole
+process up to the end of the section.
+"""
+
+import json
+import resource
+import sys
+import time
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass, field
+from functools import wraps
+from pathlib import Path
+from typing import Any, ParamSpec, Self, TypeVar
+
+import numpy as np
+import pandas as pd
+
+__all__ = ("StageMetrics",)
+
+P = ParamSpec("P")
+R = TypeVar("R")
+T = TypeVar("T")
+
+_Paths = str | Path | Sequence[str | Path]
+
+
+@dataclass
+class StageMetrics:
+    """Metrics of sections of a stage.
+
+    Attributes
+    ----------
+    stage
+        Name of the stage (and of the metrics file).
+    sections
+        Metrics of finished sections by names.
+
+    Examples
+    --------
+    >>> metrics = StageMetrics("example")
+    >>> metrics.section("make")
+    _Section('make')
+    >>> df = metrics.output(pd.DataFrame({"x": np.arange(10)}))
+    >>> with metrics.section("sum"):
+    ...     total = metrics.input(df)["x"].sum()
+    >>> [(name, m["rows_in"], m["rows_out"]) for name, m in metrics.sections.items()]
+    [('make', 0, 10), ('sum', 10, 0)]
+    """
+
+    stage: str
+    sections: dict[str, dict[str, float]] = field(default_factory=dict)
+    _start: tuple[float, float] = field(init=False, repr=False)
+    _current: "_Section | None" = field(default=None, init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self._start = _clock()
+
+    def section(self, name: str) -> "_Section":
+        """Start section ``name``, ending the current one.
+
+        Metrics of sections started more than once are summed up (and peak RSS
+        is the maximum).
+        """
+        self.end()
+        self._current = _Section(self, name)
+        return self._current
+
+    def end(self) -> None:
+        """End the current section (if any)."""
+        if self._current is None:
+            return
+        name, values = self._current.finish()
+        self._current = None
+        if name in self.sections:
+            old = self.sections[name]
+            values = {
+                k: max(v, old[k]) if k == "peak_rss" else v + old[k]
+                for k, v in values.items()
+            }
+        self.sections[name] = values
+
+    def input(self, obj: T, path: _Paths | None = None) -> T:
+        """Count rows and bytes of data read in the current section.
+
+        Bytes are sizes of files (or directories) on ``path`` (one or more) if
+        given and sizes of data in memory otherwise. ``obj`` is returned unchanged.
+        """
+        self._count("in", obj, path)
+        return obj
+
+    def output(self, obj: T, path: _Paths | None = None) -> T:
+        """Count rows and bytes of data written in the current section.
+
+        See :meth:`input`. Sizes of files can be counted only after they
+        are written.
+        """
+        self._count("out", obj, path)
+        return obj
+
+    def timed(self, func: Callable[P, R]) -> Callable[P, R]:
+        """Decorate function to record each of its calls as a section named by it."""
+
+        @wraps(func)
+        def wrapper(*args: P.args, **kwds: P.kwargs) -> R:
+            with self.section(func.__name__):
+                return func(*args, **kwds)
+
+        return wrapper
+
+    def to_dict(self) -> dict[str, Any]:
+        """Get metrics of sections and of the whole stage (``total``)."""
+        self.end()
+        wall, cpu = np.subtract(_clock(), self._start)
+        sections = self.sections.values()
+        total = {
+            "wall": round(float(wall), 3),
+            "cpu": round(float(cpu), 3),
+            # Peaks of sections are reset, so the peak of the stage is their maximum.
+            "peak_rss": max([_peak_rss(), *(s["peak_rss"] for s in sections)]),
+            **{
+                k: sum(s[k] for s in sections)
+                for k in ("rows_in", "bytes_in", "rows_out", "bytes_out")
+            },
+        }
+        return {"total": total, "sections": self.sections}
+
+    def dump(self, directory: str | Path) -> Path:
+        """Write metrics to ``<stage>.json`` in ``directory``.
+
+        Returns
+        -------
+        Path of the metrics file.
+        """
+        file = Path(directory) / f"{self.stage}.json"
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(json.dumps(self.to_dict(), indent=2) + "\n")
+        return file
+
+    # Internals ----------------------------------------------------------------------
+
+    def _count(self, direction: str, obj: Any, path: _Paths | None) -> None:
+        if self._current is None:
+            errmsg = "no section is started"
+            raise RuntimeError(errmsg)
+        counts = self._current.counts
+        counts[f"rows_{direction}"] += _rows(obj)
+        counts[f"bytes_{direction}"] += _nbytes(obj) if path is None else _size(path)
+
+
+# Internals --------------------------------------------------------------------------
+
+
+class _Section:
+    def __init__(self, metrics: StageMetrics, name: str) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.counts = dict.fromkeys(("rows_in", "bytes_in", "rows_out", "bytes_out"), 0)
+        _reset_peak_rss()
+        self.start = _clock()
+
+    def finish(self) -> tuple[str, dict[str, float]]:
+        wall, cpu = np.subtract(_clock(), self.start)
+        return self.name, {
+            "wall": round(float(wall), 3),
+            "cpu": round(float(cpu), 3),
+            "peak_rss": _peak_rss(),
+            **self.counts,
+        }
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.name!r})"
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        if self.metrics._current is self:
+            self.metrics.end()
+
+
+def _clock() -> tuple[float, float]:
+    # Wall time and CPU time of the process and its finished children.
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.perf_counter(), time.process_time() + usage.ru_utime + usage.ru_stime
+
+
+def _maxrss() -> int:
+    # Peak RSS of the process in bytes ('ru_maxrss' is in kilobytes on Linux).
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def _reset_peak_rss() -> None:
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        pass
+
+
+def _peak_rss() -> int:
+    try:
+        status = Path("/proc/self/status").read_text()
+    except OSError:
+        return _maxrss()
+    for line in status.splitlines():
+        if line.startswith("VmHWM:"):
+            return int(line.split()[1]) * 1024
+    return _maxrss()
+
+
+def _rows(obj: Any) -> int:
+    return int(obj.shape[0]) if hasattr(obj, "shape") else len(obj)
+
+
+def _nbytes(obj: Any) -> int:
+    if isinstance(obj, pd.DataFrame | pd.Series):
+        return int(np.sum(obj.memory_usage(index=True)))
+    return int(getattr(obj, "nbytes", 0))
+
+
+def _size(path: _Paths) -> int:
+    if not isinstance(path, str | Path):
+        return sum(_size(p) for p in path)
+    path = Path(path)
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size if path.exists() else 0
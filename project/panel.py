@@ -0,0 +1,96 @@
+"""Dense panels from sparse long-format observations.
+
+:func:`reindex_panel` turns observations of entities (e.g. outlets) at irregular
+time points into a dense entity-by-time panel. The full product of entities and
+time grid points is built directly as a :class:`pandas.MultiIndex` and the data
+are reindexed onto it once, so the cost is linear in the size of the panel and
+does not depend on the grid frequency (monthly, weekly or daily). Because every
+entity occupies a contiguous block of rows of equal length, per-entity
+quantities such as the first observed time point are computed on a 2-D view of
+the observation mask instead of with grouped operations.
+"""
+
+from collections.abc import Hashable, Sequence
+
+import numpy as np
+import pandas as pd
+
+from project.fill import Direction, _aslist, grouped_fill
+
+__all__ = ("reindex_panel",)
+
+
+def reindex_panel(
+    df: pd.DataFrame,
+    entity: Hashable,
+    time: Hashable,
+    grid: Sequence | pd.Index,
+    columns: Hashable | Sequence[Hashable] | None = None,
+    *,
+    origin: object | None = None,
+    max_offset: object | None = None,
+    direction: Direction | None = "both",
+    limit: int | None = None,
+) -> pd.DataFrame:
+    """Reindex observations onto a dense entity-by-time panel.
+
+    Parameters
+    ----------
+    df
+        Long-format data with at most one row per ``(entity, time)`` pair.
+    entity
+        Entity identifier column.
+    time
+        Time column. Values must be comparable with ``grid``.
+    grid
+        Time grid points. Observations at other time points are dropped.
+    columns
+        Value column(s). Defaults to all columns except ``entity`` and ``time``.
+    origin
+        Reference time point for ``max_offset``. Defaults to the first grid point.
+    max_offset
+        If not ``None``, entities whose first observation (a row with any
+        non-missing value) is later than ``origin + max_offset`` are dropped,
+        as are entities with no observations at all.
+    direction
+        Direction of bounded imputation within entities
+        (see :func:`project.fill.grouped_fill`). ``None`` disables imputation.
+    limit
+        Maximum number of consecutive missing values imputed in each direction.
+
+    Returns
+    -------
+    Data frame with ``entity``, ``time`` and value columns, sorted by entity
+    and time, with one row per retained entity and grid point.
+
+    Examples
+    --------
+    >>> df = pd.DataFrame({"e": ["b", "a", "a"], "t": [1, 1, 3], "x": [1.0, 2.0, 4.0]})
+    >>> reindex_panel(df, "e", "t", [1, 2, 3, 4], limit=1)["x"].tolist()
+    [2.0, 2.0, 4.0, 4.0, 1.0, 1.0, nan, nan]
+    >>> reindex_panel(df, "e", "t", [0, 1, 2], origin=0, max_offset=0)
+    Empty DataFrame
+    Columns: [e, t, x]
+    Index: []
+    """
+    if columns is None:
+        columns = [c for c in df.columns if c not in (entity, time)]
+    columns = _aslist(columns)
+    grid = pd.Index(grid, name=time)
+    entities = pd.Index(df[entity].unique(), name=entity).sort_values()
+    index = pd.MultiIndex.from_product([entities, grid])
+    panel = df.set_index([entity, time])[columns].reindex(index)
+
+    if max_offset is not None:
+        # Rows form an (entities x grid) matrix, so the first observed grid point
+        # of every entity is the position of the first true value in its row.
+        observed = panel.notna().any(axis=1).to_numpy().reshape(len(entities), len(grid))
+        first = grid[observed.argmax(axis=1)]
+        origin = grid[0] if origin is None else origin
+        keep = observed.any(axis=1) & np.asarray(first - origin <= max_offset)
+        panel = panel[np.repeat(keep, len(grid))]
+
+    panel = panel.reset_index()
+    if direction is not None and not panel.empty:
+        panel = grouped_fill(panel, entity, columns, direction=direction, limit=limit)
+    return panel
@@ -0,0 +1,125 @@
+"""Random numbers compatible with R.
+
+Seeds of BEAST runs were historically drawn in R with::
+
+    set.seed(seed)
+    sample.int(1e9, size = n_runs)
+
+:func:`sample_int` reproduces this sequence exactly, so Python stages use the
+same seeds for the same ``params.yaml``. Only R's defaults since version 3.6 are
+supported: the Mersenne-Twister generator (:class:`MersenneTwister`) with
+rejection sampling of integers (``sample.kind = "Rejection"``).
+"""
+
+import math
+
+import numpy as np
+
+__all__ = ("MersenneTwister", "sample_int")
+
+_N = 624
+_M = 397
+
+
+class MersenneTwister:
+    """Mersenne-Twister generator seeded as by R's ``set.seed()``.
+
+    Examples
+    --------
+    >>> rng = MersenneTwister(1)
+    >>> [round(rng.unif_rand(), 7) for _ in range(3)]
+    [0.2655087, 0.3721239, 0.5728534]
+    """
+
+    def __init__(self, seed: int) -> None:
+        # Initial scrambling of the seed with a linear congruential generator,
+        # followed by filling the state with its next values.
+        seed = int(seed) & 0xFFFFFFFF
+        for _ in range(50):
+            seed = (69069 * seed + 1) & 0xFFFFFFFF
+        state = []
+        for _ in range(_N + 1):
+            seed = (69069 * seed + 1) & 0xFFFFFFFF
+            state.append(seed)
+        # The first value is the position in the state, which R resets.
+        self._mt = state[1:]
+        self._mti = _N
+
+    def unif_rand(self) -> float:
+        """Draw a number from the open unit interval as R's ``unif_rand()``."""
+        value = self._genrand() * 2.3283064365386963e-10
+        if value <= 0.0:
+            return 0.5 * 2.328306437080797e-10
+        if 1.0 - value <= 0.0:
+            return 1.0 - 0.5 * 2.328306437080797e-10
+        return value
+
+    def unif_index(self, dn: float) -> int:
+        """Draw an integer from ``[0, dn)`` as R's ``R_unif_index()``."""
+        if dn <= 0:
+            return 0
+        bits = math.ceil(math.log2(dn))
+        while True:
+            v = 0
+            for _ in range(0, bits + 1, 16):
+                v = 65536 * v + math.floor(self.unif_rand() * 65536)
+            v &= (1 << bits) - 1
+            if v < dn:
+                return v
+
+    # Internals ----------------------------------------------------------------------
+
+    def _genrand(self) -> int:
+        mt = self._mt
+        if self._mti >= _N:
+            for kk in range(_N):
+                y = (mt[kk] & 0x80000000) | (mt[(kk + 1) % _N] & 0x7FFFFFFF)
+                mt[kk] = mt[(kk + _M) % _N] ^ (y >> 1) ^ (0x9908B0DF if y & 1 else 0)
+            self._mti = 0
+        y = mt[self._mti]
+        self._mti += 1
+        y ^= y >> 11
+        y ^= (y << 7) & 0x9D2C5680
+        y ^= (y << 15) & 0xEFC60000
+        y ^= y >> 18
+        return y
+
+
+def sample_int(n: int, size: int, *, seed: int) -> np.ndarray:
+    """Sample integers from ``1`` to ``n`` without replacement as R.
+
+    Equivalent to ``set.seed(seed); sample.int(n, size)`` in R.
+
+    Raises
+    ------
+    ValueError
+        If ``size`` is larger than ``n``.
+
+    Examples
+    --------
+    >>> sample_int(10, 10, seed=42).tolist()
+    [1, 5, 10, 8, 2, 4, 6, 9, 7, 3]
+    >>> sample_int(10, 10, seed=123).tolist()
+    [3, 10, 2, 8, 6, 9, 1, 7, 5, 4]
+    """
+    if size > n:
+        errmsg = f"cannot take a sample of size {size} larger than the population {n}"
+        raise ValueError(errmsg)
+    rng = MersenneTwister(seed)
+    if n > 1e7 and size <= n / 2:
+        # R draws with a hash set of sampled values ('sample2') in this case.
+        seen: set[int] = set()
+        out = []
+        while len(out) < size:
+            v = rng.unif_index(n)
+            if v not in seen:
+                seen.add(v)
+                out.append(v + 1)
+        return np.array(out, dtype=np.int64)
+    pool = list(range(n))
+    out = []
+    for k in range(n, n - size, -1):
+        j = rng.unif_index(k)
+        out.append(pool[j] + 1)
+        pool[j] = pool[k - 1]
+    return np.array(out, dtype=np.int64)
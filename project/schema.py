@@ -0,0 +1,204 @@
+"""Compact column types of processed data.
+
+:data:`SCHEMAS` declares types of columns of processed data files by file
+names: low-cardinality labels (outlet names, countries, classifications,
+subsets) are dictionary encoded as categoricals, calendar fields and counts
+use narrow integers and probabilities of single BEAST runs are stored as
+``float32``. Columns not declared keep their types, so e.g. model predictions
+and weekly signals retain full precision.
+
+Schemas are applied on read by :func:`project.io.scan` and on write by
+:func:`project.io.write`. Categorical columns are read from Parquet dictionaries
+directly, so their string values are never materialized, and categories are
+always sorted and pruned to used values. Hence ordering and grouping by
+categorical columns give the same results as with plain strings.
+
+Frames with categorical columns of different categories (e.g. news and
+non-news posts) must be concatenated with :func:`concat`, which unifies the
+categories first, as :func:`pandas.concat` falls back to ``object`` columns.
+
+:data:`LAYOUTS` declares files written as hive-partitioned datasets
+(directories like ``dataset.parquet/country=pl/year=2016/part-0.parquet``)
+instead of single files. Rows are sorted within partitions, so statistics
+of row groups are narrow and readers skip partitions and row groups
+excluded by filters (see :func:`project.io.scan`).
+"""
+
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+
+__all__ = (
+    "CATEGORY",
+    "LAYOUTS",
+    "SCHEMAS",
+    "Layout",
+    "apply_schema",
+    "concat",
+    "get_layout",
+    "get_schema",
+)
+
+Schema = Mapping[str, str]
+
+CATEGORY = "category"
+
+_LABELS = dict.fromkeys(
+    ("country", "name", "quality", "media", "ideology", "sector", "type", "author"),
+    CATEGORY,
+)
+_DATE = {"year": "int16", "month": "int8", "day": "int8"}
+_REACTIONS = dict.fromkeys(
+    (
+        "comments",
+        "shares",
+        *(f"reactions_{r}" for r in ("LIKE", "LOVE", "WOW", "HAHA", "ANGRY", "SAD")),
+    ),
+    "Int32",
+)
+_POSTS = {**_LABELS, **_DATE, "n_posts": "int32", **_REACTIONS}
+_WEEKLY = {**_LABELS, "week_t": "int16", "n_posts": "int32"}
+_RUNS = {"subset": CATEGORY, "idx": "int32", "week_t": "int16", "prob": "float32"}
+
+SCHEMAS: dict[str, Schema] = {
+    "news.parquet": _POSTS,
+    "non-news.parquet": _POSTS,
+    "dataset.parquet": _POSTS,
+    "counts.parquet": _POSTS,
+    "text.parquet": {"country": CATEGORY},
+    "comscore.parquet": {"name": CATEGORY},
+    "weekly.parquet": _WEEKLY,
+    "weekly-non-news.parquet": _WEEKLY,
+    "timeseries.parquet": _WEEKLY,
+    "signal.parquet": {"country": CATEGORY, "week_t": "int16"},
+    "beast.parquet": {"subset": CATEGORY, "idx": "int32", "prob": "float32"},
+    "run-curves.parquet": _RUNS,
+    "consensus.parquet": {"subset": CATEGORY, "week_t": "int16", "n_runs": "int32"},
+    "changepoints.parquet": {"subset": CATEGORY},
+    "changepoints-sweep.parquet": {"subset": CATEGORY},
+    "epochs.parquet": {"epoch": "int16"},
+}
+
+
+@dataclass(frozen=True)
+class Layout:
+    """Layout of a partitioned dataset.
+
+    Attributes
+    ----------
+    partition_by
+        Columns defining (nested) hive partitions. Columns missing from
+        written data are skipped.
+    sort_by
+        Columns rows are sorted by within partitions (stable, so rows keep
+        their order otherwise).
+    row_group_size
+        Number of rows in row groups (except the last one in each file).
+    """
+
+    partition_by: tuple[str, ...] = ("country", "year")
+    sort_by: tuple[str, ...] = ("name", "timestamp")
+    row_group_size: int = 32_768
+
+
+_BY_COUNTRY = ("country",)
+
+LAYOUTS: dict[str, Layout] = {
+    "news.parquet": Layout(),
+    "non-news.parquet": Layout(),
+    "dataset.parquet": Layout(),
+    # Outputs of stages run per country (see 'project/fanout.py').
+    "counts.parquet": Layout(_BY_COUNTRY, ("quality", "name", "year", "month", "day")),
+    "text.parquet": Layout(_BY_COUNTRY, ("key",)),
+    "weekly.parquet": Layout(_BY_COUNTRY, ("name", "quality", "week_t")),
+    "weekly-non-news.parquet": Layout(_BY_COUNTRY, ("name", "quality", "week_t")),
+    "signal.parquet": Layout(_BY_COUNTRY, ()),
+    "timeseries.parquet": Layout(_BY_COUNTRY, ("name", "sector", "quality", "week_t")),
+}
+
+
+def get_schema(path: str | Path) -> Schema:
+    """Get schema of a data file (empty for files without a declared schema)."""
+    return SCHEMAS.get(Path(path).name, {})
+
+
+def get_layout(path: str | Path) -> Layout | None:
+    """Get layout of a partitioned dataset (``None`` for single files)."""
+    return LAYOUTS.get(Path(path).name)
+
+
+def apply_schema(df: pd.DataFrame, schema: Schema) -> pd.DataFrame:
+    """Cast columns to types declared in ``schema``.
+
+    Columns not present in ``df`` are ignored. Categories of categorical
+    columns are sorted and pruned to used values.
+
+    Examples
+    --------
+    >>> df = pd.DataFrame({"name": ["b", "a", "b"], "year": [2016, 2016, 2017]})
+    >>> df = apply_schema(df, {"name": "category", "year": "int16"})
+    >>> df.dtypes.astype(str).tolist()
+    ['category', 'int16']
+    >>> df["name"].cat.categories.tolist()
+    ['a', 'b']
+    """
+    dtypes = {}
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if dtype == CATEGORY:
+            dtypes[col] = _categorical(df[col])
+        elif df[col].dtype != dtype:
+            dtypes[col] = dtype
+    return df.astype(dtypes) if dtypes else df
+
+
+def concat(frames: Iterable[pd.DataFrame | None], **kwds: Any) -> pd.DataFrame:
+    """Concatenate frames keeping categorical columns categorical.
+
+    Columns categorical in any of the frames are cast to categoricals with the
+    union of their (sorted) values in all frames. ``None`` frames are skipped
+    and ``**kwds`` are passed to :func:`pandas.concat`.
+
+    Examples
+    --------
+    >>> a = pd.DataFrame({"name": pd.Categorical(["x", "y"])})
+    >>> b = pd.DataFrame({"name": ["z", "x"]})
+    >>> df = concat([a, b], ignore_index=True)
+    >>> df["name"].cat.categories.tolist(), df["name"].tolist()
+    (['x', 'y', 'z'], ['x', 'y', 'z', 'x'])
+    """
+    frames = [df for df in frames if df is not None]
+    columns = {
+        col
+        for df in frames
+        for col in df.columns
+        if isinstance(df[col].dtype, pd.CategoricalDtype)
+    }
+    for col in sorted(columns):
+        values = [
+            df[col].cat.categories
+            if isinstance(df[col].dtype, pd.CategoricalDtype)
+            else pd.Index(df[col].dropna().unique())
+            for df in frames
+            if col in df.columns
+        ]
+        dtype = pd.CategoricalDtype(values[0].append(values[1:]).unique().sort_values())
+        frames = [df.astype({col: dtype}) if col in df.columns else df for df in frames]
+    return pd.concat(frames, **kwds)
+
+
+# Internals --------------------------------------------------------------------------
+
+
+def _categorical(values: pd.Series) -> pd.CategoricalDtype:
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return pd.CategoricalDtype(pd.Index(values.dropna().unique()).sort_values())
+    categories = values.cat.categories
+    used = pd.unique(values.cat.codes[values.cat.codes >= 0])
+    if len(used) < len(categories):
+        categories = categories[used]
+    return pd.CategoricalDtype(categories.sort_values())
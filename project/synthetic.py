@@ -0,0 +1,357 @@
+"""Synthetic stand-ins of the input data of the pipeline.
+
+:func:`generate` writes files with the schemas of the raw inputs of Python stages
+(Sotrender exports of news and non-news posts and texts of news posts, outlet
+metadata, imputed reactions, 2025 data and ComScore audiences) and of
+intermediate files produced by R stages or by BEAST runs (coefficients of the
+GLMM of reactions exported to ``models/glmm/reactions-export``, ``beast.parquet``
+and the consensus curves derived from it), so that all Python stages can run
+without the DVC remote. Values are random, but satisfy the checks made by
+stages (e.g. the span of the study period and uniqueness of keys).
+
+Data size is controlled by a scale factor: scale ``1`` corresponds to
+``100_000`` news posts, and numbers of outlets and countries grow with the
+scale by default. Non-news exports follow the schema of ``2025.parquet``.
+
+Data can be generated from the command line::
+
+    python -m project.synthetic /tmp/synthetic --scale 10
+"""
+
+import argparse
+import math
+from collections.abc import Sequence
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from project.calendar import week_index
+from project.changepoints import ConsensusAccumulator
+from project.glmm import NB2Model
+from project.io import write
+
+__all__ = ("generate",)
+
+N_POSTS = 100_000
+COUNTRIES = ("us", "pl", "de", "fr", "es", "it", "nl", "se")
+REACTIONS = ("LIKE", "LOVE", "WOW", "HAHA", "ANGRY", "SAD")
+SUBSETS = ("reactions-mu-cv", "reactions-rel-mu-cv")
+
+
+def generate(
+    root: str | Path,
+    scale: float = 1,
+    *,
+    outlets: int | None = None,
+    countries: int | None = None,
+    runs: int = 100,
+    subsets: Sequence[str] = SUBSETS,
+    start: str | date = "2016-01-01",
+    end: str | date = "2025-12-16",
+    seed: int = 0,
+) -> None:
+    """Generate synthetic data in ``data/raw``, ``data/proc`` and ``models`` of ``root``.
+
+    Parameters
+    ----------
+    root
+        Project root.
+    scale
+        Scale factor of numbers of posts.
+    outlets
+        Number of news outlets. Defaults to ``20 * sqrt(scale)``. There are
+        four times fewer non-news pages.
+    countries
+        Number of countries. Defaults to ``1 + log10(scale)``.
+    runs
+        Number of BEAST runs.
+    subsets
+        Names of subsets of signal columns (``changepoints.subsets``).
+    start, end
+        Study period (``period``). Posts of news outlets span it exactly,
+        posts of non-news pages end a day earlier.
+    seed
+        Seed of the random number generator.
+    """
+    rng = np.random.default_rng(seed)
+    raw = Path(root) / "data" / "raw"
+    proc = Path(root) / "data" / "proc"
+    raw.mkdir(parents=True, exist_ok=True)
+    proc.mkdir(parents=True, exist_ok=True)
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    if countries is None:
+        countries = 1 + math.floor(math.log10(max(scale, 1)))
+    if outlets is None:
+        outlets = round(20 * math.sqrt(scale))
+    codes = list(COUNTRIES[: max(countries, 1)])
+    n_posts = round(N_POSTS * scale)
+
+    metadata = _outlets(rng, outlets, codes)
+    pages = _outlets(rng, max(outlets // 4, 1), codes, prefix="page")[["name", "country"]]
+    metadata.drop(columns="country").to_parquet(raw / "metadata.parquet")
+
+    # News posts until the end of 2024 come from the main exports and later ones
+    # from the 2025 file, which also has posts of non-news pages.
+    cutoff = pd.Timestamp("2025-01-01")
+    hour = pd.Timedelta(hours=1)
+    last = end + 23 * hour
+    news = _posts(rng, metadata, n_posts, start, cutoff - hour, "news")
+    extra = _posts(rng, metadata, n_posts // 9, cutoff, last, "news-2025")
+    nonnews = _posts(rng, pages, n_posts // 5, start, cutoff - hour, "page")
+    nonnews_extra = _posts(
+        rng, pages, n_posts // 45, cutoff, last - pd.Timedelta(days=1), "page-2025"
+    )
+
+    for country, df in news.groupby("country"):
+        _news_export(rng, df).to_parquet(raw / f"news-{country}.parquet")
+        _content(df).to_parquet(raw / f"content-news-{country}.parquet")
+    pd.DataFrame(
+        {
+            "key": news["raw_key"],
+            "reactions_combined": rng.negative_binomial(2, 0.01, len(news)).astype(float),
+        }
+    ).to_parquet(raw / "imputed-reactions.parquet")
+    for country, df in nonnews.groupby("country"):
+        _export(df).to_parquet(raw / f"non-news-{country}.parquet")
+    pd.concat([_export(extra), _export(nonnews_extra)], ignore_index=True).assign(
+        ini=1, link_title="title", content_type="text"
+    ).to_parquet(raw / "2025.parquet")
+    _comscore(rng, metadata["name"], start, cutoff).to_parquet(raw / "comscore.parquet")
+
+    _glmm_export(rng, metadata, start, end, Path(root) / "models" / "glmm")
+    _beast(rng, list(subsets), runs, start, end, proc)
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    """Generate synthetic input data of the pipeline."""
+    parser = argparse.ArgumentParser(
+        prog="python -m project.synthetic", description=main.__doc__
+    )
+    parser.add_argument("root", type=Path, help="project root of generated data")
+    parser.add_argument("--scale", type=float, default=1, help="scale of posts")
+    parser.add_argument("--outlets", type=int, help="number of news outlets")
+    parser.add_argument("--countries", type=int, help="number of countries")
+    parser.add_argument("--runs", type=int, default=100, help="number of BEAST runs")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args(argv)
+    generate(
+        args.root,
+        args.scale,
+        outlets=args.outlets,
+        countries=args.countries,
+        runs=args.runs,
+        seed=args.seed,
+    )
+
+
+# Internals --------------------------------------------------------------------------
+
+
+def _outlets(
+    rng: np.random.Generator, n: int, countries: list[str], prefix: str = "outlet"
+) -> pd.DataFrame:
+    country = np.resize(countries, n)
+    return pd.DataFrame(
+        {
+            "name": [f"{c} {prefix} {i}" for i, c in enumerate(country)],
+            "country": country,
+            "quality": rng.choice(["low", "medium", "high"], n),
+            "type": rng.choice(["tv", "print", "web"], n),
+            "bias": rng.choice(["left", "center", "right"], n),
+            "followers": rng.integers(10**3, 10**7, n).astype(float),
+        }
+    )
+
+
+def _posts(
+    rng: np.random.Generator,
+    outlets: pd.DataFrame,
+    n: int,
+    first: pd.Timestamp,
+    last: pd.Timestamp,
+    prefix: str,
+) -> pd.DataFrame:
+    # Posts of random outlets at random minutes from 'first' to 'last', which
+    # are times of the first and the last post (both by pages).
+    n = max(n, 2)
+    ts = np.sort(rng.integers(first.value, last.value, n))
+    ts[[0, -1]] = first.value, last.value
+    author = rng.choice(["page", "page", "page", "user"], n)
+    author[[0, -1]] = "page"
+    idx = rng.integers(len(outlets), size=n)
+    return pd.DataFrame(
+        {
+            "raw_key": np.char.add(f"{prefix}-", np.arange(n).astype(str)),
+            "name": outlets["name"].to_numpy()[idx],
+            "country": outlets["country"].to_numpy()[idx],
+            "timestamp": pd.to_datetime(ts, utc=True).floor("min"),
+            "type": rng.choice(["link", "photo", "video", "status"], n),
+            "author": author,
+            "likes": rng.negative_binomial(2, 0.01, n).astype(float),
+            "comments": rng.poisson(20, n),
+            "shares": rng.poisson(5, n),
+            **{f"reactions_{r}": rng.poisson(3, n) for r in REACTIONS},
+        }
+    )
+
+
+def _export(posts: pd.DataFrame) -> pd.DataFrame:
+    # Posts as exported by Sotrender with UTC timestamps and prefixed keys.
+    return posts.drop(columns=["raw_key", "country"]).assign(
+        key="sotrender@" + posts["raw_key"],
+        post_url="https://facebook.com/" + posts["raw_key"],
+    )[["key", *posts.columns.drop(["raw_key", "country"]), "post_url"]]
+
+
+def _news_export(rng: np.random.Generator, posts: pd.DataFrame) -> pd.DataFrame:
+    # Main news exports have post IDs, dates and hours instead of keys and
+    # timestamps. Some IDs are missing and some likes are to be imputed.
+    n = len(posts)
+    fb_post_id = ("1_" + posts["raw_key"]).mask(
+        rng.random(n) < 0.01, "NA_" + posts["raw_key"]
+    )
+    return pd.DataFrame(
+        {
+            "key": posts["raw_key"],
+            "fb_post_id": fb_post_id,
+            "check": rng.integers(10**6, size=n).astype(str),
+            "name": posts["name"],
+            "date": posts["timestamp"].dt.strftime("%Y-%m-%d"),
+            "hour": posts["timestamp"].dt.strftime("%H:%M:%S"),
+            **posts[["type", "author"]],
+            "likes": posts["likes"].mask(rng.random(n) < 0.05),
+            **posts[["comments", "shares", *(f"reactions_{r}" for r in REACTIONS)]],
+            "post_url": "https://facebook.com/" + posts["raw_key"],
+        }
+    )
+
+
+def _content(posts: pd.DataFrame) -> pd.DataFrame:
+    # Texts of posts with raw keys. Texts are made of words of various numbers
+    # (from counts of comments), and some posts have no text.
+    words = posts["type"] + " post of " + posts["name"] + " "
+    return pd.DataFrame(
+        {"key": posts["raw_key"], "text": words * (1 + posts["comments"] % 40)}
+    )[posts["shares"].to_numpy() % 50 != 0]
+
+
+def _comscore(
+    rng: np.random.Generator, names: pd.Series, start: pd.Timestamp, end: pd.Timestamp
+) -> pd.DataFrame:
+    # Monthly audiences with sporadic missing months (never the first one).
+    months = pd.date_range(start, end, freq="MS", inclusive="left")
+    df = pd.DataFrame(
+        {
+            "name": np.repeat(names.to_numpy(), len(months)),
+            "date": np.tile(months.strftime("%Y-%m-%d"), len(names)),
+            "comscore": rng.integers(10**5, 10**7, len(names) * len(months)).astype(float),
+        }
+    )
+    missing = (rng.random(len(df)) < 0.1) & (df["date"] != months[0].strftime("%Y-%m-%d"))
+    return df[~missing].reset_index(drop=True)
+
+
+def _glmm_export(
+    rng: np.random.Generator,
+    metadata: pd.DataFrame,
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    path: Path,
+) -> None:
+    # Coefficients of the preliminary GLMM ('glmm_export.R'): random intercepts of
+    # outlets and random intercepts and quality effects of days in both model
+    # components. Reference predictions come from 'NB2Model' itself.
+    terms = ["(Intercept)", "qualitymedium", "qualityhigh", "log_n_posts"]
+    fixed = pd.DataFrame(
+        {
+            "model": np.repeat(["cond", "disp"], len(terms)),
+            "term": terms * 2,
+            "estimate": [4.0, 0.3, 0.6, -0.1, 0.5, 0.1, 0.2, 0.05],
+        }
+    )
+    days = pd.date_range(start, end)
+    groups = {
+        "country:name": (metadata["country"] + ":" + metadata["name"], terms[:1]),
+        "year:month:day": ([f"{d.year}:{d.month}:{d.day}" for d in days], terms[:3]),
+    }
+    random = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "model": model,
+                    "group": group,
+                    "level": np.repeat(levels, len(names)),
+                    "term": np.tile(names, len(levels)),
+                    "estimate": rng.normal(0, scale, len(levels) * len(names)),
+                }
+            )
+            for model, scale in [("cond", 0.3), ("disp", 0.1)]
+            for group, (levels, names) in groups.items()
+        ],
+        ignore_index=True,
+    )
+    n = 1000
+    idx = rng.integers(len(metadata), size=n)
+    date = days[rng.integers(len(days), size=n)]
+    check = pd.DataFrame(
+        {
+            "country": metadata["country"].to_numpy()[idx],
+            "name": metadata["name"].to_numpy()[idx],
+            "quality": metadata["quality"].to_numpy()[idx],
+            "year": date.year,
+            "month": date.month,
+            "day": date.day,
+            "n_posts": rng.integers(1, 50, n),
+        }
+    ).assign(log_n_posts=lambda df: np.log(df["n_posts"]))
+    model = NB2Model.from_frames(fixed, random)
+    check = check.join(model.predict(check)[["link", "mu", "disp"]])
+    path = path / "reactions-export"
+    path.mkdir(parents=True, exist_ok=True)
+    fixed.to_parquet(path / "fixed.parquet")
+    random.to_parquet(path / "random.parquet")
+    check.to_parquet(path / "check.parquet")
+
+
+def _beast(
+    rng: np.random.Generator,
+    subsets: list[str],
+    runs: int,
+    start: pd.Timestamp,
+    end: pd.Timestamp,
+    proc: Path,
+) -> None:
+    # Likely changepoints of runs scatter around a few common dates (a year
+    # apart at least), unlikely ones are uniform noise.
+    weeks = week_index(start.date(), end.date())
+    consensus = ConsensusAccumulator(weeks, subsets)
+    true = rng.choice(np.arange(26, len(weeks) - 26, 52), size=4, replace=False)
+    beast, curves = [], []
+    for subset in subsets:
+        for idx in range(1, runs + 1):
+            week = np.r_[
+                true + rng.normal(0, 1, len(true)), rng.uniform(0, len(weeks) - 1, 5)
+            ]
+            week = np.clip(np.rint(week), 0, len(weeks) - 1).astype(np.int64)
+            prob = np.r_[rng.beta(8, 2, len(true)), rng.beta(1, 9, 5)]
+            order = np.argsort(week, kind="stable")
+            date, prob = weeks.time[week[order]], prob[order]
+            curve = consensus.add(subset, date, prob)
+            week_t = curve.nonzero()[0]
+            beast.append(
+                pd.DataFrame({"subset": subset, "idx": idx, "date": date, "prob": prob})
+            )
+            curves.append(
+                pd.DataFrame(
+                    {"subset": subset, "idx": idx, "week_t": week_t, "prob": curve[week_t]}
+                )
+            )
+    write(pd.concat(beast, ignore_index=True), proc / "beast.parquet")
+    write(pd.concat(curves, ignore_index=True), proc / "run-curves.parquet")
+    write(consensus.to_frame(), proc / "consensus.parquet")
+
+
+if __name__ == "__main__":
+    main()
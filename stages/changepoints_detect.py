@@ -0,0 +1,132 @@
+"""DVC stage 'changepoints-detect'. Runs the ensemble of 1000 independent BEAST
+changepoint detection runs (per subset of signal columns) in parallel worker
+processes. Runs use the same seeds as the original R implementation
+(``stages/changepoints_detect.R``, kept for reference). Results of single-variable
+fits are cached by content (see ``cache.beast``), so an interrupted stage resumes
+from the last finished fits and changes of ``changepoints.subsets`` or
+``changepoints.beast.n_runs`` compute only fits of new variables or runs.
+Runs are folded into weekly consensus probability curves as they finish and the
+ensemble optionally stops early once the curves and their peaks have stabilized
+(``changepoints.stopping``).
+Input: data/proc/signal.parquet.
+Outputs: data/proc/consensus.parquet, data/proc/run-curves.parquet (nonzero weekly
+probabilities of single runs if ``changepoints.intervals`` are enabled, empty
+otherwise), and data/proc/beast.parquet with results of all runs if
+``changepoints.archive`` is enabled.
+"""
+# %% ---------------------------------------------------------------------------------
+
+import logging
+from contextlib import closing
+
+import pandas as pd
+
+from project import config, paths
+from project.beast import iter_runs
+from project.cache import ArrayCache
+from project.calendar import week_index
+from project.changepoints import ConsensusAccumulator, StoppingRule
+from project.io import scan, write
+from project.metrics import StageMetrics
+
+metrics = StageMetrics("changepoints-detect")
+parallel = config.parallel.beast
+cache = ArrayCache(paths.beast_cache, maxbytes=config.cache.beast.maxbytes)
+weeks = week_index(config.period.start, config.period.end)
+config = config.changepoints
+
+logger = logging.getLogger("project")
+logging.basicConfig(format="%(asctime)s %(name)s %(message)s")
+logger.setLevel(logging.INFO)
+
+# %% ---------------------------------------------------------------------------------
+
+metrics.section("read")
+
+signal = metrics.input(scan(paths.signal), paths.signal)
+
+# %% ---------------------------------------------------------------------------------
+
+metrics.section("ensemble")
+
+# BEAST algorithm configuration:
+# - metadata: irregular time spacing, no seasonality, weekly resolution as fraction
+#   of year, with outlier detection enabled
+# - prior: constrains trend complexity to piecewise linear (order 0-1), up to 30 knots
+#   with minimum 13-week separation to prevent detecting spurious short-term
+#   fluctuations as structural breaks
+# Robustness strategy: running BEAST N times (default 1000) with independent random
+# seeds produces a distribution of changepoint probabilities. Aggregating across
+# runs yields stable, reproducible changepoint estimates that are robust to the
+# algorithm's internal stochastic MCMC sampling.
+consensus = ConsensusAccumulator(weeks, list(config.subsets))
+stopping = None
+if config.stopping.enabled:
+    stopping = StoppingRule(
+        config.timescale,
+        config.peaks,
+        every=config.stopping.every,
+        tol=config.stopping.tol,
+        patience=config.stopping.patience,
+    )
+
+# Results of runs by subset, kept only if the archive is enabled, and their curves,
+# kept only if intervals of changepoint dates are enabled.
+archive = {subset: [] for subset in config.subsets}
+curves = {subset: [] for subset in config.subsets}
+runs = iter_runs(
+    signal,
+    {subset: list(cols) for subset, cols in config.subsets.items()},
+    seed=config.beast.seed,
+    n_runs=config.beast.n_runs,
+    metadata=config.beast.metadata,
+    prior=config.beast.prior,
+    cache=cache,
+    max_workers=parallel.workers,
+)
+with closing(runs):
+    for idx, results in runs:
+        for subset, (date, prob) in results.items():
+            curve = consensus.add(subset, date, prob)
+            if config.intervals.enabled:
+                week_t = curve.nonzero()[0]
+                curves[subset].append(
+                    pd.DataFrame(
+                        {
+                            "subset": subset,
+                            "idx": idx,
+                            "week_t": week_t,
+                            "prob": curve[week_t],
+                        }
+                    )
+                )
+            if config.archive:
+                archive[subset].append(
+                    pd.DataFrame({"subset": subset, "idx": idx, "date": date, "prob": prob})
+                )
+        if stopping is not None and stopping.update(consensus):
+            logger.info("consensus curves converged after %d runs", idx)
+            break
+
+# %% ---------------------------------------------------------------------------------
+
+metrics.section("write")
+
+consensus = write(consensus.to_frame(), paths.consensus)
+metrics.output(consensus, paths.consensus)
+# Without intervals the file of curves is written empty, so that outputs of the
+# stage do not depend on parameters.
+frames = [df for dfs in curves.values() for df in dfs]
+curves = write(
+    pd.concat(frames, ignore_index=True)
+    if frames
+    else pd.DataFrame(columns=["subset", "idx", "week_t", "prob"]),
+    paths.run_curves,
+)
+metrics.output(curves, paths.run_curves)
+if config.archive:
+    frames = [df for dfs in archive.values() for df in dfs]
+    write(pd.concat(frames, ignore_index=True), paths.beast)
+metrics.dump(paths.metrics)
+
+# %% ---------------------------------------------------------------------------------
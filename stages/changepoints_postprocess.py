@@ -1,97 +1,62 @@
-"""DVC stage 'changepoints-postprocess'. Aggregates results from 1000 independent
-BEAST changepoint detection runs: combines per-variable changepoint probabilities
-into multivariate probabilities, maps to weekly grid, smooths with rolling
-window, detects peaks, and assigns sequential epoch labels.
+"""DVC stage 'changepoints-postprocess'. Postprocesses consensus changepoint
+probability curves of the ensemble of BEAST runs: smooths them with rolling
+window, detects peaks (optionally with intervals of their dates from peaks of
+single runs), and assigns sequential epoch labels.
 Outputs: data/proc/changepoints.parquet, data/proc/epochs.parquet.
 """
 # %% ---------------------------------------------------------------------------------
 
-from calendar import isleap
-from datetime import timedelta
-
 import matplotlib as mpl
 import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
 from newsuse.data import DataFrame
-from scipy import signal
 
 from project import config, paths
+from project.calendar import week_index
+from project.changepoints import (
+    ConsensusAccumulator,
+    changepoint_intervals,
+    find_changepoints,
+    rolling_noisy_or,
+)
+from project.epochs import assign_epochs
+from project.io import scan, write
+from project.keys import KeyIndex
+from project.metrics import StageMetrics
+from project.schema import concat
+
+metrics = StageMetrics("changepoints-postprocess")
 
 figpath = paths.figures / "changepoints"
 figpath.mkdir(parents=True, exist_ok=True)
 
 # %% Get and preprocess raw data -----------------------------------------------------
 
-# Multivariate probability aggregation: for each time point, individual variable
-# probabilities are combined as P(any changepoint) = 1 - prod(1 - P_i), assuming
-# approximate independence between signals.
-raw = (
-    DataFrame.from_(paths.beast)
-    .groupby(["subset", "idx", "date"])["prob"]
-    .apply(lambda s: 1 - (1 - s).prod())
-    .reset_index()
-    .pipe(
-        lambda df: df.sort_values(["subset", "idx", "date"], ignore_index=True)
-        .assign(year=lambda df: df["date"].astype(int))
-        .assign(
-            month=lambda df: (np.modf(df["date"].to_numpy())[0] * 12).astype(int) + 1,
-            day=lambda df: (
-                pd.to_datetime(df[["year"]].assign(month=1, day=1))
-                + (np.modf(df["date"].to_numpy())[0] * 365 + df["year"].map(isleap))
-                .astype(int)
-                .map(timedelta)
-            ).dt.day,
-        )
-        .assign(timestamp=lambda df: pd.to_datetime(df[["year", "month", "day"]]))
-        .assign(week=lambda df: df["timestamp"].dt.isocalendar().week)
-    )
-)
+metrics.section("read")
 
-dataset = DataFrame.from_(paths.dataset).assign(
+period = (config.period.start, config.period.end)
+dataset = metrics.input(scan(paths.dataset, columns=["timestamp"], period=period)).assign(
     timestamp=lambda df: df["timestamp"].dt.tz_localize(None)
 )
-tstart = dataset["timestamp"].min()
-tstop = dataset["timestamp"].max()
-nruns = max(raw["idx"])
 
 # %% Make time grid ------------------------------------------------------------------
 
-timegrid = (
-    DataFrame({"timestamp": pd.date_range(tstart, tstop)})
-    .assign(
-        year=lambda df: df["timestamp"].dt.year,
-        week=lambda df: df["timestamp"].dt.isocalendar().week,
-    )
-    .assign(time=lambda df: ((df["week"] != df["week"].shift(1)).cumsum().bfill()))
-    .drop_duplicates(["year", "week"], ignore_index=True)
-)
+weeks = week_index(config.period.start, config.period.end)
 
 # %% Prepare changepoints grid -------------------------------------------------------
 
+metrics.section("changepoints")
+
+# Multivariate probability aggregation: for each time point, individual variable
+# probabilities are combined as P(any changepoint) = 1 - prod(1 - P_i), assuming
+# approximate independence between signals.
 # Raw BEAST output uses continuous time coordinates; these are snapped to the
 # nearest weekly grid point and probabilities are normalized across runs to
 # produce a single consensus probability curve per variable subset.
-changepoints = (
-    raw.groupby("subset")
-    .apply(
-        lambda df: df.sort_values(["idx", "date"], ignore_index=True)
-        .drop(columns=["date", "month", "day", "timestamp"])
-        .merge(timegrid, on=["year", "week"], how="left")
-        .groupby(["idx", "time"])["prob"]
-        .apply(lambda p: 1 - np.prod(1 - p))
-        .reset_index()
-        .groupby(["time"])["prob"]
-        .sum()
-        .reset_index()
-        .pipe(lambda df: timegrid.merge(df, on="time", how="left"))
-        .fillna({"prob": 0.0})
-        .set_index("timestamp")["prob"]
-        .pipe(lambda s: s / raw["idx"].max()),
-        include_groups=False,
-    )
-    .T
+# Curves are accumulated run by run in the 'changepoints-detect' stage.
+consensus = ConsensusAccumulator.from_frame(
+    metrics.input(scan(paths.consensus), paths.consensus), weeks
 )
+changepoints = consensus.curves
 
 # %% Raw changepoints data -----------------------------------------------------------
 
@@ -99,36 +64,38 @@ changepoints = (
 # `find_peaks` with minimum distance and prominence thresholds (from params) to
 # identify distinct changepoint locations, filtering out noise while preserving
 # genuine structural breaks.
-data = changepoints.transform(
-    lambda s: (
-        s.rolling(window=round(config.changepoints.timescale))
-        .apply(lambda p: 1 - np.prod(1 - p))
-        .bfill()
-    )
-)
+data = rolling_noisy_or(changepoints, round(config.changepoints.timescale)).bfill()
 
 # %% Compute peaks data --------------------------------------------------------------
 
-peaksdata = {}
-for col in data:
-    tsdata = data[col]
-    time = tsdata.index
-    peaks, props = signal.find_peaks(tsdata, **config.changepoints.peaks)
-    width, _, left, right = signal.peak_widths(tsdata, peaks)
-    pdata = DataFrame(
-        {
-            "height": tsdata.iloc[peaks],
-            "width": width,
-            "left": time[np.round(left).astype(int)],
-            "right": time[np.round(right).astype(int)] + pd.Timedelta(days=6),
-        }
+peaksdata = DataFrame(find_changepoints(data, **config.changepoints.peaks))
+
+# %% Uncertainty of changepoint dates ------------------------------------------------
+
+metrics.section("intervals")
+
+# Peaks of smoothed curves of single runs are detected in one batched pass over
+# all runs and matched with the consensus changepoints. The fraction of runs with
+# a matched peak measures stability of a changepoint and quantiles of matched peak
+# dates give its interval (as bootstrap percentile intervals).
+if config.changepoints.intervals.enabled:
+    peaksdata = DataFrame(
+        changepoint_intervals(
+            peaksdata,
+            metrics.input(scan(paths.run_curves), paths.run_curves),
+            weeks,
+            n_runs=dict(zip(consensus.subsets, consensus.n_runs, strict=True)),
+            timescale=config.changepoints.timescale,
+            level=config.changepoints.intervals.level,
+            tolerance=config.changepoints.intervals.tolerance,
+            **config.changepoints.peaks,
+        )
     )
-    peaksdata[col] = pdata
-
-peaksdata = pd.concat(peaksdata, names=["subset"]).reset_index()
 
 # %% ---------------------------------------------------------------------------------
 
+metrics.section("plot")
+
 gpeaks = peaksdata.groupby("subset")
 nrows = len(gpeaks)
 fig, axes = plt.subplots(nrows=nrows, figsize=(7, 2 * nrows))
@@ -147,9 +114,8 @@ for ax, gdf in zip(axes.flat, gpeaks, strict=True):
 
     ax.set_ylim(-0.02, 1.02)
     ax.yaxis.set_major_formatter(mpl.ticker.PercentFormatter(1.0, decimals=0))
-    name, *metrics = col.split("-")
-    metrics = ", ".join(metrics)
-    title = f"{name.title()} [{metrics}]"
+    name, *measures = col.split("-")
+    title = f"{name.title()} [{', '.join(measures)}]"
     ax.set_title(title)
 
 fig.supylabel("Average posterior probability")
@@ -159,6 +125,8 @@ fig.savefig(figpath / "posterior.pdf")
 
 # %% Make epochs ---------------------------------------------------------------------
 
+metrics.section("epochs")
+
 # Detected changepoint dates partition the time series into sequential epochs
 # (0, 1, 2, ...); each outlet x epoch combination must meet a minimum post count
 # threshold (from params) to be included in downstream GLMM analyses.
@@ -168,41 +136,26 @@ cdf = peaksdata.query(f"subset.eq('{config.changepoints.use}')").reset_index(dro
 
 cols = ["key", "country", "name", "timestamp"]
 
-epochs = pd.concat(
+posts = concat(
     [
-        DataFrame.from_(paths.dataset, columns=cols),
-        DataFrame.from_(paths.nonnews, columns=cols),
+        metrics.input(scan(paths.dataset, columns=cols, period=period)),
+        metrics.input(scan(paths.nonnews, columns=cols, period=period)),
     ],
     ignore_index=True,
-).assign(
-    timestamp=lambda df: df["timestamp"].dt.tz_localize(None),
-    epoch=0,
-    epoch_start=lambda df: df["timestamp"].min(),
-)
-for ts in cdf["timestamp"]:
-    mask = epochs["timestamp"] >= ts
-    epochs.loc[mask, "epoch"] += 1  # type: ignore
-    epochs.loc[mask, "epoch_start"] = ts
-
-epochs["epoch_t"] = (
-    (epochs["timestamp"] - epochs["epoch_start"])
-    .astype("timedelta64[ns]")
-    .dt.total_seconds()
-    .div(60 * 60 * 24 * 7)
-)
-
-counts = epochs.groupby(["country", "name", "epoch"]).size().reset_index(name="n_posts")
+).assign(timestamp=lambda df: df["timestamp"].dt.tz_localize(None))
 
-epochs = (
-    epochs.merge(counts, on=["country", "name", "epoch"], how="left")
-    .query(f"n_posts > {config.epochs.min_posts}")
-    .reset_index(drop=True)
+epochs = assign_epochs(
+    posts,
+    cdf["timestamp"],
+    by=["country", "name"],
+    min_posts=config.epochs.min_posts,
 )
 
-assert epochs.key.is_unique, "keys are not unique in 'epochs' data."
+# Keys are unique, so numbers of posts of epochs are their sizes.
+assert KeyIndex.from_keys(epochs["key"]).is_unique, "keys are not unique in 'epochs' data."
 assert (
-    epochs.groupby(["country", "name", "epoch"])["key"]
-    .nunique()
+    epochs.groupby(["country", "name", "epoch"], observed=True)
+    .size()
     .ge(config.epochs.min_posts)
     .all()
 ), f"there are epochs with less than {config.epochs.min_posts} posts"
@@ -250,8 +203,11 @@ epochmeta.insert(1, "mid", epochmeta[["start", "end"]].mean(axis=1))
 
 # %% Save changepoint peaks ----------------------------------------------------------
 
-peaksdata.to_(paths.changepoints)
-epochs.to_(paths.epochs)
-epochmeta.to_(paths.epochmeta)
+metrics.section("write")
+
+metrics.output(write(peaksdata, paths.changepoints), paths.changepoints)
+metrics.output(write(epochs, paths.epochs), paths.epochs)
+metrics.output(write(epochmeta, paths.epochmeta), paths.epochmeta)
+metrics.dump(paths.metrics)
 
 # %% ---------------------------------------------------------------------------------
@@ -0,0 +1,68 @@
+"""DVC stage 'changepoints-sweep'. Sensitivity analysis of changepoint detection:
+evaluates a grid of smoothing timescales and peak detection settings
+(``changepoints.sweep``) on the same consensus probability curves of BEAST runs.
+Curves are smoothed once per timescale and peaks are detected for every setting.
+Output: data/proc/changepoints-sweep.parquet.
+"""
+# %% ---------------------------------------------------------------------------------
+
+from itertools import product
+
+import pandas as pd
+from newsuse.data import DataFrame
+
+from project import config, paths
+from project.calendar import week_index
+from project.changepoints import (
+    ConsensusAccumulator,
+    find_changepoints,
+    rolling_noisy_or,
+)
+from project.io import scan, write
+from project.metrics import StageMetrics
+
+metrics = StageMetrics("changepoints-sweep")
+
+sweep = config.changepoints.sweep
+
+# %% ---------------------------------------------------------------------------------
+
+metrics.section("read")
+
+weeks = week_index(config.period.start, config.period.end)
+changepoints = ConsensusAccumulator.from_frame(
+    metrics.input(scan(paths.consensus), paths.consensus), weeks
+).curves
+
+# %% ---------------------------------------------------------------------------------
+
+metrics.section("sweep")
+
+# One row per detected changepoint and setting. Setting columns precede the
+# columns of 'changepoints.parquet'; 'min_height' is the 'height' argument
+# of 'find_peaks', while 'height' is the height of a detected peak.
+results = {}
+for timescale in sweep.timescale:
+    data = rolling_noisy_or(changepoints, round(timescale)).bfill()
+    for distance, prominence, height in product(
+        sweep.peaks.distance, sweep.peaks.prominence, sweep.peaks.height
+    ):
+        distance = timescale if distance is None else distance
+        results[timescale, distance, prominence, height] = find_changepoints(
+            data, distance=distance, prominence=prominence, height=height
+        )
+
+results = DataFrame(
+    pd.concat(results, names=["timescale", "distance", "prominence", "min_height", None])
+    .reset_index(level=[0, 1, 2, 3])
+    .reset_index(drop=True)
+)
+
+# %% ---------------------------------------------------------------------------------
+
+metrics.section("write")
+
+metrics.output(write(results, paths.changepoints_sweep), paths.changepoints_sweep)
+metrics.dump(paths.metrics)
+
+# %% ---------------------------------------------------------------------------------
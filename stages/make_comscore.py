@@ -5,74 +5,59 @@ Output: data/proc/comscore.parquet.
 """
 # %% ---------------------------------------------------------------------------------
 
+from datetime import date
+
 import pandas as pd
 from newsuse.data import DataFrame
 
 from project import config, paths
+from project.io import write
+from project.metrics import StageMetrics
+from project.panel import reindex_panel
+
+metrics = StageMetrics("comscore")
 
 # %% ---------------------------------------------------------------------------------
 
-data = DataFrame.from_(paths.raw / "comscore.parquet")
+metrics.section("read")
 
-timegrid = (
-    pd.date_range(start=data["date"].min(), end=data["date"].max(), freq="MS")
-    .to_frame()
-    .rename(columns={0: "date"})
-    .assign(date=lambda df: df["date"].dt.date)
-)
-
-data = (
-    DataFrame({"name": data["name"].unique()})
-    .assign(date=lambda df: [timegrid["date"]] * len(df))
-    .explode("date")
-    .merge(data, on=["name", "date"], how="left")
-    .sort_values(["name", "date"], ignore_index=True)
-    .assign(date=lambda df: pd.to_datetime(df["date"]))
-    .convert_dtypes()
-    .assign(date=lambda df: df["date"].dt.date)
-)
+data = metrics.input(
+    DataFrame.from_(paths.raw / "comscore.parquet"), paths.raw / "comscore.parquet"
+).assign(date=lambda df: pd.to_datetime(df["date"]))
 
 # %% ---------------------------------------------------------------------------------
 
+metrics.section("impute")
+
+# Outlets are reindexed onto the full monthly grid. Outlets with data starting
+# later than mid 2016 are filtered out.
+# ComScore panel data has sporadic missing months; bounded ffill/bfill
+# (limit from params) interpolates short gaps while avoiding extrapolation
+# over long periods of genuinely missing coverage. Outlets not present
+# in the news dataset are dropped.
 comscore = (
-    data.groupby("name")[["name", "date", "comscore"]]
-    .apply(
-        lambda df: (
-            # Filter out outlets with data starting later than mid 2016
-            df.assign(
-                delta=lambda d: (
-                    pd.Timestamp(d["date"][d["comscore"].notnull()].min())
-                    - pd.Timestamp("2016-01-01")
-                ).total_seconds()
-                / (60 * 60 * 24 * 31)
-            )
-        ),
-    )
-    .query("delta <= 6")
-    .reset_index(drop=True)
-    .drop(columns="delta")
-    .set_index(["date"])
-    .groupby("name")
-    # ComScore panel data has sporadic missing months; bounded ffill/bfill
-    # (limit from params) interpolates short gaps while avoiding extrapolation
-    # over long periods of genuinely missing coverage. Outlets not present
-    # in the news dataset are dropped.
-    .apply(
-        lambda s: (
-            s.ffill(limit=config.comscore.imputation.limit).bfill(
-                limit=config.comscore.imputation.limit
-            )
-        ),
-        include_groups=False,
+    reindex_panel(
+        data,
+        "name",
+        "date",
+        pd.date_range(start=data["date"].min(), end=data["date"].max(), freq="MS"),
+        "comscore",
+        origin=pd.Timestamp("2016-01-01"),
+        max_offset=pd.Timedelta(days=6 * 31),
+        limit=config.comscore.imputation.limit,
     )
-    .reset_index(drop=False)
+    .convert_dtypes()
+    .assign(date=lambda df: df["date"].dt.date)
 )
 assert (
-    comscore.dropna().groupby("name")["date"].first().eq(pd.Timestamp("2016-01-01")).all()
+    comscore.dropna().groupby("name")["date"].first().eq(date(2016, 1, 1)).all()
 ), "Some outlets have data starting later than 2016-01-01."
 
 # %% ---------------------------------------------------------------------------------
 
-comscore.to_(paths.comscore)
+metrics.section("write")
+
+metrics.output(write(comscore, paths.comscore), paths.comscore)
+metrics.dump(paths.metrics)
 
 # %% ---------------------------------------------------------------------------------
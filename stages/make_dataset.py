@@ -0,0 +1,110 @@
+"""DVC stage 'dataset'. Augments news posts with predictions of the preliminary
+GLMM of reactions ('glmm@reactions'): expected reactions on the response and link
+scales, dispersion, variance and coefficient of variation, also relative to the
+average reactions of outlets. Predictions are computed in Python from coefficients
+exported by the 'glmm-export' stage (see 'project/glmm.py'), one partition of
+posts at a time in chunks of ``dataset.chunksize`` rows, and are checked against
+predictions of R for a sample of posts first. A single country may be processed
+with ``python stages/make_dataset.py <country>`` (see 'project/fanout.py').
+Inputs: data/proc/news.parquet, models/glmm/reactions-export.
+Output: data/proc/dataset.parquet.
+"""
+# %% ---------------------------------------------------------------------------------
+
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from project import config, paths
+from project.fanout import Fanout
+from project.glmm import NB2Model
+from project.io import scan, write
+from project.metrics import StageMetrics
+
+fanout = Fanout.from_argv()
+metrics = StageMetrics(fanout.stage("dataset"))
+
+# %% Get model -----------------------------------------------------------------------
+
+metrics.section("model")
+
+model = NB2Model.read(paths.glmm_export)
+check = metrics.input(pd.read_parquet(paths.glmm_export / "check.parquet"))
+if fanout.country is not None:
+    check = check[check["country"] == fanout.country].reset_index(drop=True)
+
+# %% Check predictions ---------------------------------------------------------------
+
+metrics.section("check")
+
+# Predictions must reproduce those of 'predict(glmm, ..., allow.new.levels = TRUE)'
+# in R, which are exported with the coefficients.
+predicted = model.predict(check)
+for col in ("link", "mu", "disp"):
+    assert np.allclose(predicted[col], check[col], rtol=config.dataset.check.rtol), (
+        f"'{col}' differs from predictions of R"
+    )
+
+# %% Define predictions --------------------------------------------------------------
+
+
+def augment(posts: pd.DataFrame) -> pd.DataFrame:
+    """Add predictions of the model to posts."""
+    size = config.dataset.chunksize
+    pred = pd.concat(
+        [model.predict(posts.iloc[i : i + size]) for i in range(0, len(posts), size)]
+    )
+    mu, var, avg = pred["mu"], pred["var"], posts["reactions_avg"]
+    cv = np.sqrt(var) / mu
+    reactions = posts["reactions"].to_numpy(dtype=np.float64, na_value=np.nan)
+    return posts.assign(
+        reactions=np.round(np.where(np.isnan(reactions), mu, reactions)),
+        reactions_mu=mu,
+        reactions_cv=cv,
+        reactions_var=var,
+        reactions_link=pred["link"],
+        reactions_disp=1 / pred["disp"],
+        # Dividing each outlet's values by its average reactions (reactions_avg)
+        # produces relative metrics that enable cross-outlet comparability despite
+        # large differences in absolute engagement levels between outlets.
+        reactions_rel=lambda df: df["reactions"] / avg,
+        reactions_rel_mu=mu / avg,
+        reactions_rel_cv=cv,
+        reactions_rel_var=var / avg**2,
+        reactions_rel_link=pred["link"] - np.log(avg),
+    )
+
+
+# %% Augment dataset -----------------------------------------------------------------
+
+metrics.section("read")
+
+# Partitions of posts (country and year) are processed one at a time, so memory
+# use is bounded by the largest partition. Partitions written previously are
+# removed first, so that no stale ones are left.
+partitions = scan(
+    paths.news, columns=["country", "year"], filters=fanout.filters
+).drop_duplicates(ignore_index=True)
+
+output = fanout.path(paths.dataset)
+if output.is_dir():
+    shutil.rmtree(output)
+elif output.exists():
+    output.unlink()
+
+for country, year in partitions.itertuples(index=False):
+    metrics.section("read")
+    posts = metrics.input(scan(paths.news, filters={"country": [country], "year": [year]}))
+    metrics.section("predict")
+    posts = augment(posts)
+    metrics.section("write")
+    partition = {"country": country, "year": year}
+    metrics.output(
+        write(posts, paths.dataset, partition=partition),
+        paths.dataset / f"country={country}" / f"year={year}",
+    )
+
+metrics.dump(paths.metrics)
+
+# %% ---------------------------------------------------------------------------------
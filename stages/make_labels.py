@@ -0,0 +1,68 @@
+"""DVC stage 'labels'. Classifies texts of posts with a model of ``ml.labels``
+(e.g. ``python stages/make_labels.py political``) loaded from a local snapshot of
+its pinned revision (see ``python -m project.classify download``) on CPU. Posts
+are batched by numbers of tokens (``ml.inference``) and scored in worker
+processes (see 'project/classify.py'). Scores are cached by post keys and model
+revisions in data/cache/labels (outside of DVC), so reruns and runs after new
+posts are added score only posts not scored before.
+Inputs: data/proc/text.parquet (``key`` and ``text`` of posts), models/hf.
+Output: data/proc/cls-<label>.parquet (``key`` and probabilities of classes).
+"""
+# %% ---------------------------------------------------------------------------------
+
+import argparse
+import logging
+import sys
+
+from project import config, paths
+from project.classify import ScoreCache, classify, snapshot_path
+from project.io import scan, write
+from project.keys import KeyIndex
+from project.metrics import StageMetrics
+
+# Arguments are ignored in interactive (Jupyter) sessions running cells of the script.
+parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+parser.add_argument("label", nargs="?", default=next(iter(config.ml.labels)))
+label = parser.parse_args([] if "ipykernel" in sys.modules else sys.argv[1:]).label
+
+metrics = StageMetrics(f"labels-{label}")
+model = config.ml.labels[label]
+inference = config.ml.inference
+output = paths.proc / f"cls-{label}.parquet"
+
+logger = logging.getLogger("project")
+logging.basicConfig(format="%(asctime)s %(name)s %(message)s")
+logger.setLevel(logging.INFO)
+
+# %% ---------------------------------------------------------------------------------
+
+metrics.section("read")
+
+texts = metrics.input(scan(paths.text, columns=["key", "text"]), paths.text)
+texts = texts[~KeyIndex.from_keys(texts["key"]).duplicated()].reset_index(drop=True)
+
+# %% ---------------------------------------------------------------------------------
+
+metrics.section("classify")
+
+scores = classify(
+    texts["key"],
+    texts["text"],
+    snapshot_path(paths.hf, model.name, model.revision),
+    revision=model.revision,
+    cache=ScoreCache(paths.labels_cache),
+    max_tokens=inference.max_tokens,
+    max_size=inference.batch_size,
+    max_length=inference.max_length,
+    max_workers=inference.workers,
+    threads=inference.threads,
+)
+
+# %% ---------------------------------------------------------------------------------
+
+metrics.section("write")
+
+metrics.output(write(scores, output), output)
+metrics.dump(paths.metrics)
+
+# %% ---------------------------------------------------------------------------------
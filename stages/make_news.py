@@ -1,177 +1,416 @@
 """DVC stage 'news'. Processes raw Facebook news post data: reads Sotrender
 exports, generates deterministic post keys (hash-based), merges imputed
-reaction counts, appends 2025 data with forward-filled metadata.
-Inputs: raw news parquet, metadata, imputed reactions, 2025 data.
-Outputs: data/proc/news.parquet, data/proc/counts.parquet.
+reaction counts, appends 2025 data with forward-filled metadata. Texts of posts
+(from content exports) are written separately for the 'labels' stages.
+In incremental mode (``data.incremental``) only raw files and rows that are new
+or changed since the previous run are processed and merged into existing outputs.
+A single country may be processed with ``python stages/make_news.py <country>``
+(see 'project/fanout.py').
+Inputs: raw news and content parquet, metadata, imputed reactions, 2025 data.
+Outputs: data/proc/news.parquet, data/proc/counts.parquet, data/proc/text.parquet,
+data/proc/news-state.
 """
 # %% ---------------------------------------------------------------------------------
 
+import logging
 from datetime import date
+from pathlib import Path
 
-import joblib
 import numpy as np
 import pandas as pd
 from newsuse.data import DataFrame
 
 from project import config, paths
+from project.fanout import Fanout
+from project.fill import grouped_fill
+from project.incremental import IngestState, hash_rows
+from project.io import read_many, scan, write
+from project.keys import KEYCOLS, KeyCodec, KeyIndex, hash_packed
+from project.metrics import StageMetrics
+from project.schema import concat
 
+parallel = config.parallel
 config = config.data
+fanout = Fanout.from_argv()
+metrics = StageMetrics(fanout.stage("news"))
+# Posts carry packed keys (see 'project/keys.py'), which are formatted as strings
+# only when outputs are written.
+codec = KeyCodec()
+
+METACOLS = ["country", "quality", "media", "ideology", "followers"]
+DAYKEYS = ["country", "quality", "name", "year", "month", "day"]
+OUTLETKEYS = ["country", "quality", "name"]
+AVGCOLS = ["reactions", "comments", "shares"]
+# Raw columns needed to construct keys, timestamps and reactions in addition
+# to 'data.usecols'.
+RAWCOLS = ["key", "fb_post_id", "check", "date", "hour", "likes"]
+# Columns of posts with packed keys in place of 'key'.
+USECOLS = [c for col in config.usecols for c in (KEYCOLS if col == "key" else [col])]
+TEXTCOLS = ["country", *KEYCOLS, "text"]
+
+
+def content(path: Path) -> Path:
+    """Get path of the content export (texts of posts) of a raw news file."""
+    return path.with_name(f"content-{path.name}")
+
+
+def post_keys(df: pd.DataFrame) -> pd.DataFrame:
+    """Replace raw keys with packed post keys hashed from Facebook post IDs."""
+    ids = df["fb_post_id"].str.strip()
+    ids = ids.mask(
+        ids.str.startswith("NA_") | ids.str.endswith("_NA"), ids + "__" + df["check"]
+    )
+    hi, lo = hash_packed(ids)
+    return df.drop(columns="key").assign(key_hi=hi, key_lo=lo)
+
+
+# %% Incremental state ---------------------------------------------------------------
+
+metrics.section("state")
+
+# The state records digests of raw inputs together with keys and content digests
+# of all ingested rows. Changes of inputs affecting all rows (parameters,
+# metadata, imputed reactions) or a missing state force a full rebuild.
+shared = {
+    "params": {k: v for k, v in dict(config).items() if k != "incremental"},
+    "metadata.parquet": paths.raw / "metadata.parquet",
+    "imputed-reactions.parquet": paths.raw / "imputed-reactions.parquet",
+}
+statepath = fanout.path(paths.news_state)
+state = IngestState.load(statepath) if config.incremental else IngestState()
+rebuild = (
+    state.empty
+    or not fanout.path(paths.news).exists()
+    or not fanout.path(paths.text).exists()
+    or any(state.is_changed(name, source) for name, source in shared.items())
+)
+if rebuild:
+    state = IngestState()
+
+# Raw news files are read again if they or their content exports changed.
+sources = [
+    p
+    for p in sorted(paths.raw.glob(f"news-{fanout.country or '*'}.parquet"))
+    if state.is_changed(p.name, p) or state.is_changed(content(p).name, content(p))
+]
+inputs = [*sources, *map(content, sources)]
 
 # %% Read and preprocess data --------------------------------------------------------
 
+metrics.section("read")
+
+logging.basicConfig(format="%(asctime)s %(name)s: %(message)s")
+logging.getLogger("project").setLevel(logging.INFO)
+
+# Raw news files, metadata and imputed reactions are read concurrently;
+# the 2025 file is read later, since its row filter depends on outlet names.
+frames = read_many(
+    {
+        "metadata": paths.raw / "metadata.parquet",
+        "imputed": paths.raw / "imputed-reactions.parquet",
+        **{p: p for p in inputs},
+    },
+    options={
+        "metadata": {"columns": ["name", "quality", "type", "bias", "followers"]},
+        "imputed": {"columns": ["key", config.imputation.target]},
+        **dict.fromkeys(
+            sources,
+            {
+                "columns": [*config.usecols, *RAWCOLS],
+                "filters": {"author": config.author},
+            },
+        ),
+        **dict.fromkeys(map(content, sources), {"columns": ["key", "text"]}),
+    },
+    max_workers=parallel.io.workers,
+    max_bytes=parallel.io.maxbytes,
+)
+for frame in frames.values():
+    metrics.input(frame)
+
 metadata = (
-    DataFrame.from_(
-        paths.raw / "metadata.parquet",
-        columns=["name", "quality", "type", "bias", "followers"],
-    )
+    frames.pop("metadata")
     .rename(columns={"type": "media", "bias": "ideology"})
     .dropna(ignore_index=True)
 )
 
 # %% --------------------------------------------------------------------------------
 
-imputed = DataFrame.from_(
-    paths.raw / "imputed-reactions.parquet", columns=["key", config.imputation.target]
-).dropna()
+imputed = frames.pop("imputed").dropna()
 
 # %% ---------------------------------------------------------------------------------
 
-data = (
-    pd.concat(
-        {
-            p.name.split(".")[0].split("-")[-1]: DataFrame.from_(p)
-            for p in paths.raw.glob("news-*.parquet")
-        }
-    )
-    .reset_index(level=0, names="country")
-    .reset_index(drop=True)
-    .merge(imputed, how="left", on="key")
-    .assign(key=lambda df: df["fb_post_id"].str.strip())
-    # Keys are constructed as `sotrender@{hash}` where hash is a deterministic
-    # joblib hash of (name, timestamp, type). The `sotrender@` prefix distinguishes
-    # synthetic keys from original Sotrender IDs. Posts with NA-based IDs include
-    # the 'check' field in the hash input to avoid collisions. NaN values are
-    # replaced with sentinel strings by joblib to ensure hash stability.
-    .assign(
-        key=lambda df: "sotrender@"
-        + np.where(
-            df["key"].str.startswith("NA_") | df["key"].str.endswith("_NA"),
-            (df["key"] + "__" + df["check"]).map(joblib.hash),
-            df["key"].map(joblib.hash),
+metrics.section("keys")
+
+if sources:
+    data = (
+        # Texts are joined by raw keys within countries, so that changes of texts
+        # change digests of rows.
+        pd.concat(
+            {
+                p.name.split(".")[0].split("-")[-1]: frames.pop(p).merge(
+                    frames.pop(content(p)), how="left", on="key"
+                )
+                for p in sources
+            }
         )
+        .reset_index(level=0, names="country")
+        .reset_index(drop=True)
+        # Digest of the raw row content, used to detect changed rows.
+        .assign(digest=hash_rows)
+        .merge(imputed, how="left", on="key")
+        # Keys are constructed as `sotrender@{hash}` where hash is a deterministic
+        # joblib hash of (name, timestamp, type). The `sotrender@` prefix distinguishes
+        # synthetic keys from original Sotrender IDs. Posts with NA-based IDs include
+        # the 'check' field in the hash input to avoid collisions. NaN values are
+        # replaced with sentinel strings by joblib to ensure hash stability.
+        # `hash_packed` reproduces `joblib.hash` digests in batches over a process
+        # pool and packs them right away.
+        .pipe(post_keys)
     )
-    .drop_duplicates(subset="key", ignore_index=True)
-    .set_index("key", verify_integrity=True)
-    .reset_index()
-    .rename(columns={"date": "timestamp"})
-    .assign(
-        timestamp=lambda df: pd.to_datetime(df["timestamp"] + " " + df["hour"], utc=True)
+    hashed = KeyIndex.from_keys(data)
+    data = (
+        data[~hashed.duplicated()]
+        .reset_index(drop=True)
+        .rename(columns={"date": "timestamp"})
+        .assign(
+            timestamp=lambda df: pd.to_datetime(
+                df["timestamp"] + " " + df["hour"], utc=True
+            )
+        )
     )
-)
+    # Texts of all posts of the raw files read are kept apart from posts (posts of
+    # 2025 data have no texts).
+    texts = data[TEXTCOLS].dropna(subset="text", ignore_index=True)
+    data = data.drop(columns="text")
 
 # %% ---------------------------------------------------------------------------------
 
-data = (
-    data.query(f"author.isin({config.author})")
-    .reset_index(drop=True)
-    .merge(metadata, on="name", how="left")
-    .rename(columns={"likes": "reactions"})
-    # `combine_first` gives priority to original non-null values, falling back
-    # to imputed values only where the original is missing.
-    .assign(
-        reactions=lambda df: (
-            df[config.imputation.source]
-            .combine_first(df.pop(config.imputation.target))
-            .round()
-            .astype("int64[pyarrow]")
-        )
-    )[config.usecols]
-)
+metrics.section("merge")
 
-assert data["key"].is_unique
+if sources:
+    data = (
+        data.merge(metadata, on="name", how="left", validate="many_to_one")
+        .rename(columns={"likes": "reactions"})
+        # `combine_first` gives priority to original non-null values, falling back
+        # to imputed values only where the original is missing.
+        .assign(
+            reactions=lambda df: (
+                df[config.imputation.source]
+                .combine_first(df.pop(config.imputation.target))
+                .round()
+                .astype("int64[pyarrow]")
+            )
+        )[[*USECOLS, "digest"]]
+        .pipe(lambda df: df[state.is_new(df[KEYCOLS], df["digest"])])
+        .reset_index(drop=True)
+    )
+else:
+    hashed = None
+    texts = DataFrame(columns=TEXTCOLS)
+    data = DataFrame(columns=[*USECOLS, "digest"])
 
 # %% Add 2025 data ----------------------------------------------------------------
 
+metrics.section("2025")
+
+# 2025 rows are limited to known outlets. They are reread only if the file changed
+# or new outlets appeared, since rows of new outlets were skipped previously, or if
+# rows of news files replace ingested posts. Posts of 2025 data take precedence over
+# posts of news files with the same keys (see below), so as in a full run, 2025 rows
+# of replaced posts are added again even if they did not change.
+known = state.outlets.get("name", pd.Series(dtype=object))
+names = pd.concat([known, data["name"]]).unique()
+updated = KeyIndex.from_keys(data[state.is_indexed(data[KEYCOLS])])
+if (
+    state.is_changed("2025.parquet", paths.raw / "2025.parquet")
+    or not data["name"].isin(known).all()
+    or len(updated)
+):
+    extra = (
+        metrics.input(
+            scan(
+                paths.raw / "2025.parquet",
+                exclude=["ini", "link_title", "content_type"],
+                filters={"name": names},
+            )
+        )
+        .rename(columns={"likes": "reactions"})
+        .assign(digest=hash_rows)
+        .pipe(codec.pack)
+        .pipe(lambda df: df[state.is_new(df[KEYCOLS], df["digest"]) | updated.isin(df)])
+    )
+else:
+    extra = None
+
+# Without new or changed rows outputs are up to date and only digests of sources
+# are updated in the state (see the last cell).
+changed = not data.empty or (extra is not None and not extra.empty)
+
 # 2025 data lacks metadata columns present in the main dataset; forward-fill
 # (ffill) propagates the last known metadata values per outlet, which is valid
 # because outlet-level metadata (quality, ideology, followers) changes
-# infrequently.
-with pd.option_context("future.no_silent_downcasting", True):
+# infrequently. In incremental mode last known values are seeded from the state,
+# cast to the types of read rows, so that 'convert_dtypes' converts them as in
+# a full run (e.g. integer 'followers' to 'Int64' rather than 'Float64').
+# Seeds are filled as leading rows of metadata only, since they have no keys.
+if changed:
+    data = pd.concat([data, extra], ignore_index=True)
+    seeds = state.outlets.astype(data[state.outlets.columns].dtypes.to_dict())
+    data[METACOLS] = (
+        pd.concat([seeds, data[["name", *METACOLS]]], ignore_index=True)
+        .pipe(grouped_fill, by="name", columns=METACOLS)
+        .iloc[len(seeds) :][METACOLS]
+        .set_axis(data.index)
+    )
     data = (
-        pd.concat(
-            [
-                data,
-                DataFrame.from_(paths.raw / "2025.parquet")
-                .rename(columns={"likes": "reactions"})
-                .drop(columns=["ini", "link_title", "content_type"])
-                .pipe(lambda df: df[df.name.isin(data.name.unique())]),
-            ]
-        )
-        .groupby(["name"])
-        .apply(
-            lambda df: df.assign(
-                **{
-                    col: df[col].ffill()
-                    for col in ["country", "quality", "media", "ideology", "followers"]
-                }
-            ),
-            include_groups=False,
-        )
-        .reset_index(drop=False)
-        .assign(timestamp=lambda df: pd.to_datetime(df["timestamp"], utc=True))
+        data.assign(timestamp=lambda df: pd.to_datetime(df["timestamp"], utc=True))
         .convert_dtypes()
-        .drop_duplicates(subset=["key"], keep="last")
-        .sort_values(["name", "timestamp"], ignore_index=True)
+        .astype(dict.fromkeys(KEYCOLS, "uint64"))
     )
+    # The key index of the combined posts is reused for the rows left after
+    # dropping duplicates and sorting.
+    keys = KeyIndex.from_keys(data)
+    data = data[~keys.duplicated(keep="last")].sort_values(["name", "timestamp"])
+    keys = keys.take(data.index)
+    data = data.reset_index(drop=True)
 
 # %% Postprocess ---------------------------------------------------------------------
 
-idx = data.columns.tolist().index("timestamp") + 1
-data.insert(idx, "day", data.timestamp.dt.day)
-data.insert(idx, "month", data.timestamp.dt.month)
-data.insert(idx, "year", data.timestamp.dt.year)
+metrics.section("postprocess")
 
-counts = (
-    data.groupby(["country", "quality", "name", "year", "month", "day"])
-    .size()
-    .reset_index()
-    .rename(columns={0: "n_posts"})
-)
-keys = counts.columns.tolist()[:-1]
+if changed:
+    idx = data.columns.tolist().index("timestamp") + 1
+    data.insert(idx, "day", data.timestamp.dt.day)
+    data.insert(idx, "month", data.timestamp.dt.month)
+    data.insert(idx, "year", data.timestamp.dt.year)
+
+# %% Update state --------------------------------------------------------------------
+
+metrics.section("update-state")
+
+# Posts replaced by new versions may have belonged to other groups, which then
+# need to be recomputed as well.
+if changed:
+    replaced = state.ledger[keys.isin(state.ledger)] if not state.ledger.empty else None
+    touched = pd.concat([replaced, data[DAYKEYS]], ignore_index=True)
+    state.add(
+        data,
+        data.pop("digest"),
+        ledger=[*DAYKEYS, *AVGCOLS],
+        outlets=METACOLS,
+        keys=keys,
+    )
+    for name, source in [*shared.items(), *((p.name, p) for p in inputs)]:
+        state.record(name, source)
+    counts = (
+        state.ledger.groupby(DAYKEYS).size().reset_index().rename(columns={0: "n_posts"})
+    )
+else:
+    for p in inputs:
+        state.record(p.name, p)
+state.record("2025.parquet", paths.raw / "2025.parquet")
 
 # %% ---------------------------------------------------------------------------------
 
-data = data.merge(counts, on=keys, how="left")
-idx = data.columns.tolist().index("reactions")
-data.insert(idx, "n_posts", data.pop("n_posts"))
-data.insert(idx + 1, "log_n_posts", np.log(data["n_posts"]))
+metrics.section("counts")
+
+# Rows of previously ingested posts are reused unless they belong to a day or
+# an outlet affected by the new rows; then their counts and averages are refreshed.
+if changed and not rebuild:
+    previous = metrics.input(
+        scan(paths.news, filters=fanout.filters), fanout.path(paths.news)
+    ).pipe(codec.pack)
+    previous = previous[~keys.isin(previous)]
+    stale = pd.MultiIndex.from_frame(previous[DAYKEYS]).isin(
+        pd.MultiIndex.from_frame(touched[DAYKEYS])
+    ) | pd.MultiIndex.from_frame(previous[OUTLETKEYS]).isin(
+        pd.MultiIndex.from_frame(touched[OUTLETKEYS])
+    )
+    data = concat(
+        [
+            data,
+            previous[stale].drop(
+                columns=["n_posts", "log_n_posts", *(f"{c}_avg" for c in AVGCOLS)]
+            ),
+        ],
+        ignore_index=True,
+    )
+    previous = previous[~stale]
+else:
+    previous = None
+
+if changed:
+    data = data.merge(counts, on=DAYKEYS, how="left")
+    idx = data.columns.tolist().index("reactions")
+    data.insert(idx, "n_posts", data.pop("n_posts"))
+    data.insert(idx + 1, "log_n_posts", np.log(data["n_posts"]))
+
+# %% ---------------------------------------------------------------------------------
+
+metrics.section("averages")
+
+if changed:
+    ledger = state.ledger.merge(touched[OUTLETKEYS].drop_duplicates(), on=OUTLETKEYS)
+    avg = ledger.groupby(OUTLETKEYS)[AVGCOLS].mean()
+    avg.columns = [f"{c}_avg" for c in avg.columns]
+    avg = avg.reset_index(OUTLETKEYS).reset_index(drop=True)
+
+    data = data.merge(avg, on=OUTLETKEYS)
 
 # %% ---------------------------------------------------------------------------------
 
-keys = ["country", "quality", "name"]
-avg = data.groupby(keys)[["reactions", "comments", "shares"]].mean()
-avg.columns = [f"{c}_avg" for c in avg.columns]
-avg = avg.reset_index(keys).reset_index(drop=True)
+metrics.section("combine")
 
-data = data.merge(avg, on=keys)
+if changed:
+    data = concat([previous, data], ignore_index=True)
+    data = data[data["reactions"].notnull()].reset_index(drop=True)
+    data = data.sort_values(["name", "timestamp"], ignore_index=True)
 
 # %% ---------------------------------------------------------------------------------
 
-data = data[data["reactions"].notnull()].reset_index(drop=True)
-data = data.sort_values(["name", "timestamp"], ignore_index=True)
+metrics.section("texts")
+
+# Texts of previously ingested posts are kept unless raw files of the posts were
+# read again.
+if changed and not rebuild:
+    kept = metrics.input(
+        scan(paths.text, filters=fanout.filters), fanout.path(paths.text)
+    ).pipe(codec.pack)
+    if hashed is not None:
+        kept = kept[~hashed.isin(kept)]
+    texts = concat([kept, texts], ignore_index=True)
 
 # %% Consistency checks --------------------------------------------------------------
 
-x = data["reactions"].to_numpy()
-assert (np.isnan(x) | (x % 1 == 0)).all()
+metrics.section("checks")
 
-assert data.timestamp.min().date() == date(2016, 1, 1), "Unexpected start date"
-assert data.timestamp.max().date() == date(2025, 12, 16), "Unexpected end date"
-assert data["key"].is_unique, "Keys are not unique"
+if changed:
+    x = data["reactions"].to_numpy()
+    assert (np.isnan(x) | (x % 1 == 0)).all()
+
+    assert data.timestamp.min().date() == date(2016, 1, 1), "Unexpected start date"
+    assert data.timestamp.max().date() == date(2025, 12, 16), "Unexpected end date"
+    assert KeyIndex.from_keys(data).is_unique, "Keys are not unique"
 
 # %% Save data -----------------------------------------------------------------------
 
-data.to_(paths.news)
-counts.to_(paths.counts)
+metrics.section("write")
+
+if changed:
+    # Texts are written first and not kept, so their keys formatted as strings are
+    # released before keys of posts are formatted.
+    metrics.output(
+        write(codec.unpack(texts), paths.text, partition=fanout.partition),
+        fanout.path(paths.text),
+    )
+    # Keys of posts are strings like other text columns converted by 'convert_dtypes'.
+    data = codec.unpack(data, dtype="string[pyarrow]")
+    data = write(data, paths.news, partition=fanout.partition)
+    counts = write(counts, paths.counts, partition=fanout.partition)
+    metrics.output(data, fanout.path(paths.news))
+    metrics.output(counts, fanout.path(paths.counts))
+state.save(statepath)
+metrics.dump(paths.metrics)
 
 # %% ---------------------------------------------------------------------------------
@@ -4,49 +4,79 @@ extraction from filenames. Output: data/proc/non-news.parquet.
 """
 # %% ---------------------------------------------------------------------------------
 
+import logging
 from datetime import date
+from functools import partial
 
-import joblib
 import numpy as np
 import pandas as pd
-from newsuse.data import DataFrame, sotrender
+from newsuse.data import sotrender
 
 from project import config, paths
+from project.io import read_many, scan, write
+from project.keys import KEYCOLS, KeyCodec, KeyIndex, hash_packed
+from project.metrics import StageMetrics
+
+metrics = StageMetrics("non-news")
+# Posts carry packed keys (see 'project/keys.py'), which are formatted as strings
+# only when outputs are written.
+codec = KeyCodec()
+USECOLS = [c for col in config.data.usecols for c in (KEYCOLS if col == "key" else [col])]
 
 # %% ---------------------------------------------------------------------------------
 
+metrics.section("read")
+
 # `read_data` automatically extracts outlet metadata (name, country, media type)
 # from standardized Sotrender export filenames using regex patterns, avoiding
 # the need for a separate metadata file.
-data = sotrender.read_data(
-    paths.raw / "non-news-*.parquet",
-    progress=True,
-    metadata={"country": r"^.+-(.+)\..+$"},
-    keycol="key",
+# Files are read concurrently, one 'read_data' call per file.
+logging.basicConfig(format="%(asctime)s %(name)s: %(message)s")
+logging.getLogger("project").setLevel(logging.INFO)
+
+files = sorted(paths.raw.glob("non-news-*.parquet"))
+data = pd.concat(
+    read_many(
+        dict(zip(files, files, strict=True)),
+        partial(sotrender.read_data, metadata={"country": r"^.+-(.+)\..+$"}, keycol="key"),
+        max_workers=config.parallel.io.workers,
+        max_bytes=config.parallel.io.maxbytes,
+    ).values(),
+    ignore_index=True,
 ).assign(
     name=lambda df: df["name"].str.strip().str.lower(),
-    key=lambda df: "sotrender@" + df["key"].str.removeprefix("sotrender@").map(joblib.hash),
 )
+hi, lo = hash_packed(data.pop("key").str.removeprefix("sotrender@"))
+data = data.assign(key_hi=hi, key_lo=lo)
+metrics.input(data, files)
 
 # %% ---------------------------------------------------------------------------------
 
+metrics.section("merge")
+
 data = (
     pd.concat(
         [
             data,
-            DataFrame.from_(paths.raw / "2025.parquet").pipe(
-                lambda df: df[df["name"].isin(data["name"].unique())]
-            ),
+            metrics.input(
+                scan(
+                    paths.raw / "2025.parquet",
+                    columns=[*config.data.usecols, "likes"],
+                    filters={"name": data["name"].unique(), "author": config.data.author},
+                )
+            ).pipe(codec.pack),
         ]
     )
     .rename(columns={"likes": "reactions"})
     .query(f"author.isin({config.data.author})")
     .reset_index(drop=True)
-    .filter(config.data.usecols, axis="columns")
+    .filter(USECOLS, axis="columns")
     .fillna({"country": "us"})
-    .drop_duplicates(subset="key", keep="last")
-    .sort_values(["name", "timestamp"], ignore_index=True)
 )
+keys = KeyIndex.from_keys(data)
+data = data[~keys.duplicated(keep="last")].sort_values(["name", "timestamp"])
+keys = keys.take(data.index)
+data = data.reset_index(drop=True)
 for col in ["day", "month", "year"]:
     data.insert(
         data.columns.tolist().index("timestamp") + 1,
@@ -56,15 +86,20 @@ for col in ["day", "month", "year"]:
 
 # %% Consistency checks --------------------------------------------------------------
 
+metrics.section("checks")
+
 x = data["reactions"].to_numpy()
 assert (np.isnan(x) | (x % 1 == 0)).all()
 
 assert data.timestamp.min().date() == date(2016, 1, 1), "Unexpected start date"
 assert data.timestamp.max().date() == date(2025, 12, 15), "Unexpected end date"
-assert data["key"].is_unique, "Keys are not unique"
+assert keys.is_unique, "Keys are not unique"
 
 # %% ---------------------------------------------------------------------------------
 
-data.to_parquet(paths.nonnews)
+metrics.section("write")
+
+metrics.output(write(codec.unpack(data), paths.nonnews), paths.nonnews)
+metrics.dump(paths.metrics)
 
 # %% ----------------------------------------------------------------------------------
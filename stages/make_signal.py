@@ -1,28 +1,47 @@
 """DVC stage 'signal'. Constructs country-level engagement signals from weekly
 outlet data by averaging log-transformed metrics across outlets within each
 country. The log transform stabilizes variance across outlets with very
-different scales. Output: data/proc/signal.parquet.
+different scales. A single country may be processed with
+``python stages/make_signal.py <country>`` (see 'project/fanout.py').
+Output: data/proc/signal.parquet.
 """
 # %% ---------------------------------------------------------------------------------
 
 import numpy as np
-from newsuse.data import DataFrame
 
 from project import config, paths
+from project.calendar import week_index
+from project.fanout import Fanout
+from project.io import scan, write
+from project.metrics import StageMetrics
+
+fanout = Fanout.from_argv()
+metrics = StageMetrics(fanout.stage("signal"))
+
+if fanout.country is not None and "country" not in config.signal.groups:
+    errmsg = "signals are computed per country only if grouped by 'country'"
+    raise ValueError(errmsg)
 
 # %% ---------------------------------------------------------------------------------
 
-weekly = DataFrame.from_(paths.weekly)
+metrics.section("read")
+
+weekly = metrics.input(
+    scan(paths.weekly, filters=fanout.filters), fanout.path(paths.weekly)
+)
 
 # %% ---------------------------------------------------------------------------------
 
+metrics.section("signal")
+
+weeks = week_index(config.period.start, config.period.end)
 cols = ["reactions_mu", "reactions_rel_mu", "reactions_cv", "reactions_rel_cv"]
 signal = (
     weekly.assign(
         reactions_mu=lambda df: np.log(df["reactions_mu"]),
         reactions_rel_mu=lambda df: np.log(df["reactions_rel_mu"]),
     )
-    .groupby([*config.signal.groups, "week_t"])
+    .groupby([*config.signal.groups, "week_t"], observed=True)
     .agg(
         {
             "timestamp": "first",
@@ -31,7 +50,9 @@ signal = (
         }
     )
     .assign(timestamp=lambda df: df["timestamp"].dt.date)
-    .reset_index()[1:-1]  # ignore first and last week as they may be incomplete
+    .reset_index()
+    # Ignore the first and last week of the period as they may be incomplete.
+    .loc[lambda df: df["week_t"].between(1, len(weeks) - 2)]
     .reset_index(drop=True)
 )
 
@@ -40,13 +61,16 @@ signal = (
 signal.insert(
     signal.columns.get_loc("timestamp") + 1,
     "time",
-    signal["timestamp"].pipe(
-        lambda s: (s.dt.year.add(s.dt.isocalendar().week.div(52).add(0.5 / 52)))
-    ),
+    weeks.time[signal["week_t"].to_numpy(dtype=np.int64)],
 )
 
 # %% ---------------------------------------------------------------------------------
 
-signal.to_(paths.signal)
+metrics.section("write")
+
+metrics.output(
+    write(signal, paths.signal, partition=fanout.partition), fanout.path(paths.signal)
+)
+metrics.dump(paths.metrics)
 
 # %% ---------------------------------------------------------------------------------
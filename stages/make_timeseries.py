@@ -1,16 +1,23 @@
 """DVC stage 'timeseries'. Creates a dense, contiguous weekly time series by
-computing a full cross-product of (outlet x week) and filling gaps via
-interpolation. This guarantees every outlet has an observation for every week
-in the study period, which is required for time series modeling.
-Output: data/proc/timeseries.parquet.
+expanding every outlet to all weeks between its first and last observed week
+and filling gaps. This guarantees every outlet has an observation for every week
+of its observed span, which is required for time series modeling.
+A single country may be processed with ``python stages/make_timeseries.py <country>``
+(see 'project/fanout.py'). Output: data/proc/timeseries.parquet.
 """
 # %% ---------------------------------------------------------------------------------
 
 import numpy as np
-import pandas as pd
-from newsuse.data import DataFrame
 
-from project import paths
+from project import config, paths
+from project.calendar import week_index
+from project.fanout import Fanout
+from project.io import scan, write
+from project.metrics import StageMetrics
+from project.schema import concat
+
+fanout = Fanout.from_argv()
+metrics = StageMetrics(fanout.stage("timeseries"))
 
 KEYCOLS = ["country", "name", "sector", "quality"]
 TIMECOLS = ["week_t", "timestamp"]
@@ -18,10 +25,12 @@ SIGNALCOLS = ["n_posts", "reactions"]
 
 # %% Get data ------------------------------------------------------------------------
 
-weekly = pd.concat(
+metrics.section("read")
+
+weekly = concat(
     [
-        DataFrame.from_(paths.weekly),
-        DataFrame.from_(paths.weekly_nonnews),
+        metrics.input(scan(path, filters=fanout.filters), fanout.path(path))
+        for path in (paths.weekly, paths.weekly_nonnews)
     ],
     axis=0,
     ignore_index=True,
@@ -34,53 +43,69 @@ weekly = weekly[[*KEYCOLS, *TIMECOLS, *SIGNALCOLS]]
 
 # %% ---------------------------------------------------------------------------------
 
+metrics.section("spans")
+
 # Sparse-to-dense strategy: real-world posting data has gaps (outlets skip weeks);
-# the cross-product of all outlets x all weeks creates the complete grid, and
-# missing values are then interpolated to ensure contiguous series for
-# downstream AR(1) models.
-accounts = weekly[KEYCOLS].drop_duplicates(ignore_index=True)
-timegrid = (
-    weekly[["timestamp"]]
-    .sort_values("timestamp")
-    .drop_duplicates(ignore_index=True)[1:-1]
-    .reset_index(drop=True)
-    .pipe(lambda df: accounts.merge(df, how="cross"))
+# every account gets one row per week between its first and last observed week
+# (within the study period without its first and last, possibly incomplete,
+# weeks), and missing values are filled, to ensure contiguous series for
+# downstream AR(1) models. Only these inner spans are materialized, never the
+# full product of accounts and weeks.
+weeks = week_index(config.period.start, config.period.end)
+weekly = weekly[weekly["week_t"].between(1, len(weeks) - 2)].dropna(
+    subset=KEYCOLS, ignore_index=True
 )
 
+groups = weekly.groupby(KEYCOLS, observed=True, sort=True)
+account = groups.ngroup().to_numpy()
+span = groups["week_t"].agg(["min", "max"])
+first = span["min"].to_numpy(dtype=np.int64)
+size = span["max"].to_numpy(dtype=np.int64) - first + 1
+offset = np.r_[0, np.cumsum(size)[:-1]]
+
 # %% Define timeseries ---------------------------------------------------------------
 
+metrics.section("timeseries")
+
+# Accounts are ordered by keys as in 'groupby', and weeks are ascending within
+# accounts, so the dense frame is sorted without sorting. Observed rows are placed
+# at their positions directly.
+rows = np.repeat(np.arange(len(span)), size)
+week_t = np.repeat(first, size) + np.arange(len(rows)) - np.repeat(offset, size)
+pos = offset[account] + weekly["week_t"].to_numpy(dtype=np.int64) - first[account]
+# Every week of an account is observed at most once, otherwise rows would overwrite
+# each other and series would not be week-contiguous.
+assert np.bincount(pos, minlength=len(rows)).max(initial=0) <= 1, (
+    "some timeseries are not week-contiguous (duplicate weeks of accounts)"
+)
+
+n_posts = np.zeros(len(rows), dtype=np.int64)
+n_posts[pos] = weekly["n_posts"].fillna(0).to_numpy(dtype=np.int64)
+reactions = np.zeros(len(rows))
+reactions[pos] = weekly["reactions"].fillna(0).to_numpy(dtype=np.float64)
+
 timeseries = (
-    timegrid.merge(weekly, how="left", on=[*KEYCOLS, "timestamp"])
-    .groupby(KEYCOLS, observed=True)[KEYCOLS + TIMECOLS + SIGNALCOLS]
-    .apply(
-        lambda gdf: gdf.assign(
-            week_t=lambda df: (
-                df["week_t"].interpolate(
-                    limit_direction="both",
-                    limit_area="inside",
-                )
-            )
-        ),
-    )
-    .dropna(subset="week_t", ignore_index=True)
+    span.index.to_frame(index=False)
+    .iloc[rows]
+    .reset_index(drop=True)
     .assign(
-        week_t=lambda df: df["week_t"].astype(int),
-        n_posts=lambda df: df["n_posts"].fillna(0).astype(int),
-        reactions=lambda df: df["reactions"].fillna(0),
+        week_t=week_t,
+        timestamp=weeks.week_start[week_t],
+        n_posts=n_posts,
+        reactions=reactions,
     )
-    .sort_values([*KEYCOLS, *TIMECOLS], ignore_index=True)
-    .convert_dtypes()
 )
 
 assert timeseries.notnull().all().all(), "'timeseries' cannot contain missing values"
-assert (
-    timeseries.groupby(KEYCOLS)["week_t"]
-    .apply(lambda s: s.diff().dropna().eq(1).all())
-    .all()
-), "some timeseries are not week-contiguous"
 
 # %% Save timeseries -----------------------------------------------------------------
 
-timeseries.to_(paths.timeseries)
+metrics.section("write")
+
+metrics.output(
+    write(timeseries, paths.timeseries, partition=fanout.partition),
+    fanout.path(paths.timeseries),
+)
+metrics.dump(paths.metrics)
 
 # %% ---------------------------------------------------------------------------------
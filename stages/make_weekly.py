@@ -1,7 +1,9 @@
 """DVC stage 'weekly'. Aggregates daily post-level data into weekly outlet-level
 time series using a two-step process: first daily means, then weekly means.
 This prevents high-volume posting days from disproportionately influencing
-weekly averages. Output: data/proc/weekly.parquet, data/proc/weekly-non-news.parquet.
+weekly averages. A single country may be processed with
+``python stages/make_weekly.py <country>`` (see 'project/fanout.py').
+Output: data/proc/weekly.parquet, data/proc/weekly-non-news.parquet.
 """
 # %% ---------------------------------------------------------------------------------
 
@@ -9,39 +11,20 @@ import numpy as np
 import pandas as pd
 from newsuse.data import DataFrame
 
-from project import paths
+from project import config, paths
+from project.aggregate import aggregate
+from project.calendar import week_index
+from project.fanout import Fanout
+from project.io import scan, write
+from project.metrics import StageMetrics
+from project.schema import concat
 
-# %% ---------------------------------------------------------------------------------
-
-dataset = pd.concat(
-    [
-        DataFrame.from_(paths.dataset),
-        DataFrame.from_(paths.nonnews).assign(quality="non-news"),
-    ],
-    axis=0,
-    ignore_index=True,
-).assign(timestamp=lambda df: df["timestamp"].dt.tz_localize(None))
-idx = dataset.columns.tolist().index("day")
-dataset.insert(idx + 1, "week", dataset["timestamp"].dt.isocalendar().week)
-idx = dataset.columns.tolist().index("quality")
-dataset.insert(
-    idx, "sector", np.where(dataset["quality"].eq("non-news"), "non-news", "news")
-)
+fanout = Fanout.from_argv()
+metrics = StageMetrics(fanout.stage("weekly"))
 
 # %% ---------------------------------------------------------------------------------
 
-timegrid = (
-    dataset[["year", "month", "day", "week"]]
-    .drop_duplicates()
-    .pipe(lambda df: df.sort_values(df.columns.tolist(), ignore_index=True))
-    .convert_dtypes(dtype_backend="numpy_nullable")
-    .assign(
-        week_t=lambda df: df["week"].diff().ne(0).fillna(True).cumsum() - 1,
-    )
-    .convert_dtypes()
-)
-
-# %% ---------------------------------------------------------------------------------
+metrics.section("daily")
 
 keycols = ["country", "name", "quality"]
 datecols = ["year", "month", "day"]
@@ -53,49 +36,82 @@ signalcols = [
     "reactions_rel_cv",
 ]
 
+
+def read_posts(year: int | None = None) -> pd.DataFrame:
+    """Read news and non-news posts, optionally from a single year."""
+    kwds = {
+        "columns": [*keycols, *datecols, "key", *signalcols],
+        "filters": {**fanout.filters, **({"year": [year]} if year is not None else {})},
+        "period": (config.period.start, config.period.end),
+    }
+    return concat(
+        [
+            scan(paths.dataset, **kwds),
+            scan(paths.nonnews, **kwds).assign(quality="non-news"),
+        ],
+        axis=0,
+        ignore_index=True,
+    )
+
+
 # Two-step aggregation: first compute daily means per outlet, then average
 # those daily means within each week. This ensures each day contributes
 # equally to the weekly value regardless of posting volume, which is
 # important because outlets vary widely in daily posting frequency.
-weekly = (
-    dataset.groupby([*keycols, *datecols], observed=True)
-    .agg(
-        {
-            **dict.fromkeys(["key"], "count"),
-            **dict.fromkeys(signalcols, "mean"),
-        }
+def daily_means(posts: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate posts into daily post counts and means per outlet."""
+    return aggregate(
+        posts,
+        [*keycols, *datecols],
+        {"key": "count", **dict.fromkeys(signalcols, "mean")},
+    ).rename(columns={"key": "n_posts"})
+
+
+# Days belong to a single year, so in streaming mode posts are aggregated one year
+# at a time and only the (much smaller) daily aggregates are kept in memory.
+if config.weekly.streaming:
+    years = np.union1d(
+        scan(paths.dataset, columns=["year"], filters=fanout.filters)["year"].unique(),
+        scan(paths.nonnews, columns=["year"], filters=fanout.filters)["year"].unique(),
     )
-    .rename(columns={"key": "n_posts"})
-    .reset_index()
-    .merge(timegrid, on=datecols, how="left")
-    .groupby([*keycols, "week_t"], observed=True)
-    .agg(
-        {
-            **dict.fromkeys(["year", "month", "day", "week"], "first"),
-            "n_posts": "sum",
-            **dict.fromkeys(signalcols, "mean"),
-        }
+    daily = concat(
+        [daily_means(metrics.input(read_posts(y))) for y in years], ignore_index=True
     )
-    .reset_index()
-)
+else:
+    daily = daily_means(metrics.input(read_posts()))
 
-idx = weekly.columns.tolist().index("year")
-weekly.insert(idx, "timestamp", pd.to_datetime(weekly[["year", "month", "day"]]))
-weekly.drop(columns=["year", "month", "day", "week"], inplace=True)
+# %% ---------------------------------------------------------------------------------
 
-# %% Correct timestamp ---------------------------------------------------------------
+metrics.section("weekly")
 
-weekly["timestamp"] = weekly["timestamp"].dt.to_period("W").map(lambda p: p.start_time)
-weekly = weekly.convert_dtypes()
+# Daily aggregates are sorted by outlet and day, and so by outlet and week,
+# so weekly segments are found without sorting again.
+weeks = week_index(config.period.start, config.period.end)
+weekly = DataFrame(
+    aggregate(
+        daily.assign(week_t=weeks.week_of(pd.to_datetime(daily[datecols]))),
+        [*keycols, "week_t"],
+        {"n_posts": "sum", **dict.fromkeys(signalcols, "mean")},
+    )
+)
+
+# Timestamps point to the start (Monday) of the week.
+idx = weekly.columns.tolist().index("week_t") + 1
+weekly.insert(idx, "timestamp", weeks.week_start[weekly["week_t"]])
 
 # %% ---------------------------------------------------------------------------------
 
+metrics.section("split")
+
 nonnews = weekly.query("quality.eq('non-news')").reset_index(drop=True)
 weekly = weekly.query("quality.ne('non-news')").reset_index(drop=True)
 
 # %% ---------------------------------------------------------------------------------
 
-weekly.to_(paths.weekly)
-nonnews.to_(paths.weekly_nonnews)
+metrics.section("write")
+
+for df, path in [(weekly, paths.weekly), (nonnews, paths.weekly_nonnews)]:
+    metrics.output(write(df, path, partition=fanout.partition), fanout.path(path))
+metrics.dump(paths.metrics)
 
 # %% --------------------------------------------------------------------------------
@@ -0,0 +1,45 @@
+"""Benchmarks of startup time of stages.
+
+Every Python stage and every R stage (through ``reticulate``) starts by
+importing :mod:`project` and accessing ``config`` and ``paths``. Imports run in
+new interpreters, so modules cached by the test process do not hide their cost.
+Run with ``pytest tests/benchmarks``.
+"""
+
+import shutil
+import subprocess
+import sys
+from functools import partial
+
+from pytest_benchmark.fixture import BenchmarkFixture
+
+import project
+
+
+def _run(code: str) -> None:
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=project.root)  # noqa: S603
+
+
+def _clear_params_cache() -> None:
+    shutil.rmtree(project.root / "data" / "cache" / "params", ignore_errors=True)
+
+
+def test_import(benchmark: BenchmarkFixture) -> None:
+    """Import with cached parameters (without importing DVC)."""
+    benchmark.pedantic(
+        partial(_run, "from project import config, paths"), rounds=10, warmup_rounds=1
+    )
+
+
+def test_import_uncached(benchmark: BenchmarkFixture) -> None:
+    """Import with parameters interpolated by DVC."""
+    benchmark.pedantic(
+        partial(_run, "from project import config, paths"),
+        setup=_clear_params_cache,
+        rounds=5,
+    )
+
+
+def test_import_lazy(benchmark: BenchmarkFixture) -> None:
+    """Import without accessing ``config`` and ``paths``."""
+    benchmark.pedantic(partial(_run, "import project"), rounds=10)
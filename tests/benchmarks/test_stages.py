@@ -0,0 +1,147 @@
+"""Benchmarks of Python stages on synthetic data.
+
+Stages run against data generated by :mod:`project.synthetic` in a temporary
+project root, with parameters of the project and ``paths`` rooted at the
+temporary directory. Scale factors of the data are given by the
+``SYNTHETIC_SCALES`` environment variable (comma separated, ``1`` by default)::
+
+    SYNTHETIC_SCALES=1,10,100 pytest tests/benchmarks/test_stages.py
+
+Stages producing inputs of a benchmarked stage (e.g. ``dataset`` for ``weekly``)
+are run once beforehand. Performance metrics of the last round of every stage
+are left in ``metrics`` of the temporary root. Outputs of incremental runs of
+``news`` are compared with outputs of full runs on the same data.
+"""
+
+import os
+import runpy
+import sys
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Any
+
+import matplotlib.pyplot as plt
+import pandas as pd
+import pytest
+from pytest_benchmark.fixture import BenchmarkFixture
+
+import project
+from project.keys import hash_packed, unpack_keys
+from project.synthetic import generate
+
+# Stage scripts and Python stages producing their inputs (other inputs are
+# generated directly).
+STAGES = {
+    "news": ("make_news.py", ()),
+    "non-news": ("make_nonnews.py", ()),
+    "comscore": ("make_comscore.py", ()),
+    "dataset": ("make_dataset.py", ("news",)),
+    "weekly": ("make_weekly.py", ("dataset", "non-news")),
+    "signal": ("make_signal.py", ("weekly",)),
+    "timeseries": ("make_timeseries.py", ("weekly",)),
+    "changepoints-postprocess": ("changepoints_postprocess.py", ("dataset", "non-news")),
+}
+
+
+# Outputs of 'news' compared between incremental and full runs.
+OUTPUTS = ("news", "counts", "text")
+
+
+def _scales() -> list[float]:
+    return [float(s) for s in os.environ.get("SYNTHETIC_SCALES", "1").split(",")]
+
+
+@dataclass
+class Project:
+    """Project rooted at a directory with synthetic data."""
+
+    root: Path
+    config: Any
+    paths: Any
+    done: set[str] = field(default_factory=set)
+
+    def prepare(self, stage: str) -> None:
+        """Run stages producing inputs of ``stage`` unless they are done."""
+        for name in STAGES[stage][1]:
+            if name not in self.done:
+                self.prepare(name)
+                self.run(name)
+
+    def run(self, stage: str) -> None:
+        """Run ``stage``."""
+        script, _ = STAGES[stage]
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr(project, "config", self.config, raising=False)
+            mp.setattr(project, "paths", self.paths, raising=False)
+            # Stages run for all countries (without command line arguments).
+            path = str(project.root / "stages" / script)
+            mp.setattr(sys, "argv", [path])
+            runpy.run_path(path, run_name="__main__")
+        plt.close("all")
+        self.done.add(stage)
+
+
+@pytest.fixture(scope="session", params=_scales(), ids=lambda s: f"scale={s:g}")
+def synthetic(
+    request: pytest.FixtureRequest, tmp_path_factory: pytest.TempPathFactory
+) -> Project:
+    root = tmp_path_factory.mktemp(f"synthetic-{request.param:g}")
+    generate(root, request.param)
+    config, paths = project._load(root)
+    return Project(root, config, paths)
+
+
+@pytest.mark.parametrize("stage", STAGES)
+def test_stage(benchmark: BenchmarkFixture, synthetic: Project, stage: str) -> None:
+    synthetic.prepare(stage)
+    benchmark.group = stage
+    benchmark.pedantic(partial(synthetic.run, stage), rounds=3)
+    assert (synthetic.paths.metrics / f"{stage}.json").exists()
+
+
+def test_news_incremental(tmp_path: Path) -> None:
+    """Incremental runs of ``news`` give the outputs of full runs.
+
+    Some posts of the news file are also in 2025 data, whose rows take precedence,
+    and the news file changes after the first run.
+    """
+    generate(tmp_path, 0.1, countries=1)
+    config, paths = project._load(tmp_path)
+    synthetic = Project(tmp_path, config, paths)
+    raw = tmp_path / "data" / "raw"
+    news = pd.read_parquet(raw / "news-us.parquet")
+    extra = pd.read_parquet(raw / "2025.parquet")
+    both = news[news["fb_post_id"].str.startswith("1_")].sample(100, random_state=0)
+    keys = unpack_keys(*hash_packed(both["fb_post_id"]))
+    both = both.assign(
+        key=keys,
+        timestamp=pd.to_datetime(both["date"] + " " + both["hour"], utc=True),
+        likes=both["likes"].fillna(0) + 1,
+        ini=1,
+        link_title="title",
+        content_type="text",
+    )[extra.columns]
+    pd.concat([extra, both], ignore_index=True).to_parquet(raw / "2025.parquet")
+
+    def outputs() -> dict[str, pd.DataFrame]:
+        # Outputs in the order of all their columns.
+        frames = {name: pd.read_parquet(getattr(paths, name)) for name in OUTPUTS}
+        return {
+            name: df.sort_values(df.columns.tolist(), ignore_index=True)
+            for name, df in frames.items()
+        }
+
+    config["data"]["incremental"] = True
+    synthetic.run("news")
+    news.assign(comments=news["comments"] + 1).to_parquet(raw / "news-us.parquet")
+    synthetic.run("news")
+    incremental = outputs()
+    config["data"]["incremental"] = False
+    synthetic.run("news")
+    full = outputs()
+
+    reactions = full["news"].set_index("key").loc[keys, "reactions"]
+    assert (reactions.to_numpy() == both["likes"].to_numpy()).all()
+    for name, df in full.items():
+        pd.testing.assert_frame_equal(incremental[name], df, obj=name)